@@ -4,22 +4,57 @@ from flask_login import LoginManager
 from flask_wtf import CSRFProtect
 from pathlib import Path
 
+try:
+    from flask_sock import Sock
+except ImportError:  # WebSocket 为可选能力，未安装时客户端退回 SSE / 轮询
+    Sock = None
+
 db = SQLAlchemy()
 login_manager = LoginManager()
 csrf = CSRFProtect()
+sock = Sock() if Sock is not None else None
 
 
-def create_app():
+def create_app(test_config: dict | None = None):
     app = Flask(__name__, static_folder="../static", template_folder="../templates")
     app.config.from_object("config.Config")
+    # 测试时覆盖数据库与上传目录，并在各后台任务 init_app 之前置 TESTING，不启动后台线程
+    if test_config:
+        app.config.update(test_config)
 
     Path(app.config["UPLOAD_FOLDER"]).mkdir(parents=True, exist_ok=True)
     Path(app.config["AVATAR_FOLDER"]).mkdir(parents=True, exist_ok=True)
     Path(app.config["MUSIC_FOLDER"]).mkdir(parents=True, exist_ok=True)
 
+    from . import sqlite_profile
+
+    sqlite_profile.configure(app)
     db.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
+    if sock is not None:
+        sock.init_app(app)
+
+    from .cache import room_cache, user_cache
+
+    room_cache.init_app(app)
+    user_cache.init_app(app)
+
+    from .presence import presence
+
+    presence.init_app(app)
+
+    from .ratelimit import login_limiter
+
+    login_limiter.init_app(app)
+
+    from .avatars import avatar_pipeline
+
+    avatar_pipeline.init_app(app)
+
+    from .writebehind import write_behind
+
+    write_behind.init_app(app)
 
     login_manager.login_view = "auth.login"
 
@@ -33,7 +68,27 @@ def create_app():
     app.register_blueprint(admin_bp)
 
     with app.app_context():
+        # 先挂 PRAGMA 再建表，保证连接池里的每个连接都带上 WAL 等设置
+        sqlite_profile.apply_pragmas(db.engine, app.config["SQLITE_PRAGMAS"])
         db.create_all()
 
+    from . import migrations
+
+    # create_all 只建缺失的表，已有表的新增列与索引由版本化迁移补齐
+    migrations.init_app(app, db)
+
+    from .routes import _advance_room
+    from .scheduler import scheduler
+
+    scheduler.init_app(app, advance=_advance_room)
+
+    from .retention import retention
+
+    retention.init_app(app)
+
+    from .storage_gc import storage_collector
+
+    storage_collector.init_app(app)
+
     return app
 
@@ -1,11 +1,15 @@
 from flask import Blueprint, abort, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required
+from sqlalchemy.orm import joinedload
 
 from . import db
 from .models import Music, User
+from .pagination import paginate
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
+ADMIN_PAGE_SIZE = 50
+
 
 def _admin_required():
     if not current_user.is_authenticated or not current_user.is_admin:
@@ -16,9 +20,30 @@ def _admin_required():
 @login_required
 def dashboard():
     _admin_required()
-    pending = Music.query.filter_by(status="pending").order_by(Music.uploaded_at.asc()).all()
-    rejected = Music.query.filter_by(status="rejected").order_by(Music.uploaded_at.desc()).all()
-    return render_template("admin/dashboard.html", pending=pending, rejected=rejected)
+    # 模板逐条展示上传者，预先 JOIN 避免逐行懒加载；两个列表各自按游标分页
+    owner_loader = joinedload(Music.owner)
+    pending_page = paginate(
+        Music.query.options(owner_loader).filter_by(status="pending"),
+        Music.uploaded_at,
+        Music.id,
+        cursor=request.args.get("pending_cursor"),
+        per_page=ADMIN_PAGE_SIZE,
+        descending=False,  # 审核队列先进先出
+    )
+    rejected_page = paginate(
+        Music.query.options(owner_loader).filter_by(status="rejected"),
+        Music.uploaded_at,
+        Music.id,
+        cursor=request.args.get("rejected_cursor"),
+        per_page=ADMIN_PAGE_SIZE,
+    )
+    return render_template(
+        "admin/dashboard.html",
+        pending=pending_page.items,
+        rejected=rejected_page.items,
+        pending_page=pending_page,
+        rejected_page=rejected_page,
+    )
 
 
 @admin_bp.post("/music/<int:music_id>/approve")
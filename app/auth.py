@@ -45,7 +45,7 @@ def login():
     form = LoginForm()
     if form.validate_on_submit():
         username = form.username.data
-        if not can_attempt_login(username):
+        if not can_attempt_login(username, request.remote_addr):
             flash("操作频繁，请 1 分钟后重试", "error")
             return render_template("auth/login.html", form=form, page="user")
         user = User.query.filter_by(username=username, is_admin=False).first()
@@ -54,7 +54,7 @@ def login():
             login_user(user)
             flash("登录成功", "success")
             return redirect(url_for("main.dashboard"))
-        record_failed_login(username)
+        record_failed_login(username, request.remote_addr)
         flash("账号或密码错误", "error")
     return render_template("auth/login.html", form=form, page="user")
 
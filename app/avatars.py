@@ -0,0 +1,136 @@
+"""头像处理：上传后由后台线程池解码、裁剪并重编码为几种固定尺寸，文件按内容摘要命名。"""
+import hashlib
+import io
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import click
+from flask.cli import with_appcontext
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow 为可选依赖，未安装时直接使用上传的原图
+    Image = None
+
+AVATAR_SIZES = (40, 80, 160)
+# 像素总数上限：超过的图片多半是恶意构造的解码炸弹，直接放弃处理
+_MAX_PIXELS = 40_000_000
+
+
+def avatar_format() -> str:
+    """优先 WebP；Pillow 编译时缺少 WebP 编码器则退回 JPEG。"""
+    return "webp" if features.check("webp") else "jpg"
+
+
+def variant_name(avatar_key: str, size: int) -> str:
+    digest, ext = avatar_key.rsplit(".", 1)
+    return f"{digest}-{size}.{ext}"
+
+
+def pick_size(size: int) -> int:
+    """取不小于需求的最小规格，超出最大规格时用最大的。"""
+    for candidate in AVATAR_SIZES:
+        if candidate >= size:
+            return candidate
+    return AVATAR_SIZES[-1]
+
+
+def render_avatar(source: Path, folder: Path) -> str:
+    """把原图处理为各尺寸方形缩略图，返回 avatar_key（摘要 + 扩展名）；同内容已处理过则直接复用。"""
+    data = source.read_bytes()
+    ext = avatar_format()
+    avatar_key = f"{hashlib.sha256(data).hexdigest()[:32]}.{ext}"
+    if all((folder / variant_name(avatar_key, size)).exists() for size in AVATAR_SIZES):
+        return avatar_key
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width * image.height > _MAX_PIXELS:
+            raise ValueError("图片尺寸过大")
+        # JPEG 可在解码阶段直接降采样，大图省掉大部分解码开销
+        image.draft("RGB", (AVATAR_SIZES[-1] * 2, AVATAR_SIZES[-1] * 2))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA")
+        # 透明背景铺白底，JPEG 与 WebP 输出保持一致
+        canvas = Image.new("RGB", image.size, (255, 255, 255))
+        canvas.paste(image, mask=image.getchannel("A"))
+        square = ImageOps.fit(canvas, (AVATAR_SIZES[-1], AVATAR_SIZES[-1]), Image.Resampling.LANCZOS)
+    for size in AVATAR_SIZES:
+        thumb = square if size == square.width else square.resize((size, size), Image.Resampling.LANCZOS)
+        target = folder / variant_name(avatar_key, size)
+        temp = target.with_name(f".{target.name}.tmp")
+        if ext == "webp":
+            thumb.save(temp, "WEBP", quality=80, method=4)
+        else:
+            thumb.save(temp, "JPEG", quality=85, optimize=True, progressive=True)
+        os.replace(temp, target)
+    return avatar_key
+
+
+class AvatarPipeline:
+    """固定大小的线程池，请求线程只负责保存原图并提交任务。
+
+    处理完成后按 avatar_path 做条件更新：处理期间用户又换了头像时，旧任务的结果直接丢弃。
+    """
+
+    def __init__(self):
+        self.app = None
+        self._executor = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._executor is not None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        app.cli.add_command(rebuild_avatars_command)
+        if Image is None or not app.config["AVATAR_PIPELINE_ENABLED"]:
+            return
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config["AVATAR_PIPELINE_WORKERS"], thread_name_prefix="avatar"
+        )
+
+    def submit(self, user_id: int, stored_name: str) -> Future | None:
+        if not self.enabled:
+            return None
+        return self._executor.submit(self._process, user_id, stored_name)
+
+    def process_now(self, user_id: int, stored_name: str) -> str | None:
+        return self._process(user_id, stored_name)
+
+    def _process(self, user_id: int, stored_name: str) -> str | None:
+        from . import db
+        from .cache import room_cache, user_cache
+        from .models import User
+
+        with self.app.app_context():
+            folder = Path(self.app.config["AVATAR_FOLDER"])
+            try:
+                avatar_key = render_avatar(folder / stored_name, folder)
+            except Exception:
+                # 无法解码的图片保留原图展示，不影响用户
+                self.app.logger.exception("头像处理失败 user_id=%s file=%s", user_id, stored_name)
+                return None
+            User.query.filter_by(id=user_id, avatar_path=stored_name).update(
+                {"avatar_key": avatar_key}, synchronize_session=False
+            )
+            db.session.commit()
+            user_cache.invalidate(user_id)
+            room_cache.invalidate_author(user_id)
+            return avatar_key
+
+
+avatar_pipeline = AvatarPipeline()
+
+
+@click.command("rebuild-avatars")
+@with_appcontext
+def rebuild_avatars_command():
+    """为尚未生成缩略图的存量头像补做处理。"""
+    from .models import User
+
+    if Image is None:
+        click.echo("未安装 Pillow，无法处理头像")
+        return
+    pending = User.query.filter(User.avatar_path.isnot(None), User.avatar_key.is_(None)).all()
+    done = sum(1 for user in pending if avatar_pipeline.process_now(user.id, user.avatar_path))
+    click.echo(f"已处理 {done}/{len(pending)} 个头像")
@@ -0,0 +1,213 @@
+"""进程内缓存：房间状态快照与登录用户资料。轮询读远多于写，热点请求不必每次访问数据库。"""
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+
+
+@dataclass
+class RoomSnapshot:
+    """某一版本的房间状态；字段名与 Room 保持一致，便于复用序列化函数。"""
+
+    room_id: int
+    owner_id: int
+    is_active: bool
+    state_version: int
+    playlist_version: int
+    playback_status: str
+    current_track_name: str | None
+    current_track_file: str | None
+    current_position: float
+    updated_at: datetime | None
+    current_playlist_item_id: int | None
+    current_track_duration: float | None
+    playlist: list[dict]
+    messages: deque
+    loaded_at: float = field(default_factory=time.monotonic)
+    # 最近一次状态变化（播放操作、消息、歌单）的 UTC 时间，用于给轮询间隔提示
+    changed_at: datetime | None = None
+    # 开始查库时的资料 epoch，见 RoomStateCache.invalidate_author
+    profile_epoch: int = 0
+
+
+class RoomStateCache:
+    """按房间号缓存快照，LRU 限制容量，TTL 限制快照年龄。
+
+    快照按写时复制更新，读者拿到的对象不会再被修改。
+    写操作按版本号“写穿”：只有新版本恰好是缓存版本 + 1 时才更新，
+    否则（乱序、跨进程写入导致的版本跳跃）直接失效，交给下一次读取重建。
+    TTL 按加载 / 写入时间计算而非访问时间，多进程部署时也能限制陈旧时长。
+    每个房间最近一次写入的版本号单独记录（房间未缓存时也记），
+    写入之前从数据库读出、写入之后才 put 的旧快照据此拒收。
+    消息里带着作者昵称与头像地址，用户资料变化时丢弃含其消息的快照；
+    profile_epoch 在每次资料变化时递增，查库期间 epoch 变化的快照同样拒收。
+    """
+
+    def __init__(self, max_rooms: int = 1000, ttl: float = 30.0, max_messages: int = 50):
+        self.max_rooms = max_rooms
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, RoomSnapshot] = OrderedDict()
+        self._written: OrderedDict[str, int] = OrderedDict()
+        self.profile_epoch = 0
+
+    def init_app(self, app) -> None:
+        self.max_rooms = app.config["ROOM_STATE_CACHE_MAX_ROOMS"]
+        self.ttl = app.config["ROOM_STATE_CACHE_TTL"]
+        self.clear()
+
+    def get(self, code: str) -> RoomSnapshot | None:
+        with self._lock:
+            snapshot = self._entries.get(code)
+            if snapshot is None:
+                return None
+            if time.monotonic() - snapshot.loaded_at > self.ttl:
+                del self._entries[code]
+                return None
+            self._entries.move_to_end(code)
+            return snapshot
+
+    def put(self, code: str, snapshot: RoomSnapshot) -> None:
+        with self._lock:
+            current = self._entries.get(code)
+            # 并发重建时保留版本更新的那一份
+            if current is not None and current.state_version > snapshot.state_version:
+                return
+            if snapshot.state_version < self._written.get(code, 0):
+                return
+            if snapshot.profile_epoch != self.profile_epoch:
+                return
+            self._entries[code] = snapshot
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_rooms:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, code: str, version: int | None = None) -> None:
+        with self._lock:
+            self._entries.pop(code, None)
+            if version is not None:
+                self._mark_written(code, version)
+
+    def invalidate_author(self, user_id: int) -> None:
+        """用户昵称 / 头像变化后调用，丢弃消息里含该用户旧资料的快照。"""
+        with self._lock:
+            self.profile_epoch += 1
+            stale = [
+                code
+                for code, snapshot in self._entries.items()
+                if any(message["author_id"] == user_id for message in snapshot.messages)
+            ]
+            for code in stale:
+                del self._entries[code]
+
+    def forget(self, code: str) -> None:
+        """房间删除后调用：快照与版本记录一起丢弃，房间号复用时新房间从版本 1 重新开始。"""
+        with self._lock:
+            self._entries.pop(code, None)
+            self._written.pop(code, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._written.clear()
+
+    def _mark_written(self, code: str, version: int) -> None:
+        if version > self._written.get(code, 0):
+            self._written[code] = version
+        self._written.move_to_end(code)
+        # 版本记录只需覆盖“读库到 put 之间”的窗口，按容量的数倍淘汰最久未写的房间
+        while len(self._written) > self.max_rooms * 4:
+            self._written.popitem(last=False)
+
+    def update(self, code: str, version: int, *, message: dict | None = None, **fields) -> None:
+        """写穿：把某次提交后的变化应用到快照上（version 为提交后的 state_version）。"""
+        with self._lock:
+            self._mark_written(code, version)
+            snapshot = self._entries.get(code)
+            if snapshot is None:
+                return
+            if version != snapshot.state_version + 1:
+                del self._entries[code]
+                return
+            messages = snapshot.messages
+            if message is not None:
+                messages = deque(messages, maxlen=self.max_messages)
+                messages.append(message)
+            self._entries[code] = replace(
+                snapshot,
+                state_version=version,
+                messages=messages,
+                loaded_at=time.monotonic(),
+                changed_at=datetime.utcnow(),
+                **fields,
+            )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+room_cache = RoomStateCache()
+
+
+class UserCache:
+    """Flask-Login 每个请求都要按 ID 重建 current_user，这里缓存用户行的列值（LRU + TTL）。
+
+    只缓存普通列值而不是 ORM 对象，命中时在当前会话里还原成干净的持久化实例，
+    修改与懒加载关系都照常工作。失效由提交后的钩子触发；
+    epoch 在每次失效时递增，查库前后 epoch 变化说明读到的可能是提交前的旧值，不写入缓存。
+    """
+
+    def __init__(self, max_users: int = 10000, ttl: float = 30.0):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+
+    def init_app(self, app) -> None:
+        self.max_users = app.config["USER_CACHE_MAX_USERS"]
+        self.ttl = app.config["USER_CACHE_TTL"]
+        self.clear()
+
+    def get(self, user_id: int) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, user_id: int, values: dict, epoch: int) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if epoch != self.epoch:
+                return
+            self._entries[user_id] = (time.monotonic(), values)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self.epoch += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.epoch += 1
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+user_cache = UserCache()
@@ -0,0 +1,58 @@
+"""房间事件广播：进程内发布/订阅，供 SSE 推送通道使用。"""
+import json
+import queue
+import threading
+from collections import defaultdict
+
+
+class RoomEventBroker:
+    """按房间号维护订阅队列，写操作提交后 publish，推送连接各自消费自己的队列。
+
+    仅在当前进程内广播；多进程部署时其他进程的订阅者依赖客户端的兜底轮询。
+    """
+
+    def __init__(self, max_queue: int = 100):
+        self._max_queue = max_queue
+        self._lock = threading.Lock()
+        self._subscribers: dict[str, set[queue.Queue]] = defaultdict(set)
+
+    def subscribe(self, code: str) -> queue.Queue:
+        subscription = queue.Queue(maxsize=self._max_queue)
+        with self._lock:
+            self._subscribers[code].add(subscription)
+        return subscription
+
+    def unsubscribe(self, code: str, subscription: queue.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(code)
+            if not subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(code, None)
+
+    def publish(self, code: str, event: str, data: dict | None = None) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(code, ()))
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait((event, data or {}))
+            except queue.Full:
+                # 消费过慢的连接丢弃最旧的事件；事件只是“有变化”的信号，客户端会拉取完整增量
+                try:
+                    subscription.get_nowait()
+                    subscription.put_nowait((event, data or {}))
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def subscriber_count(self, code: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(code, ()))
+
+
+def format_sse(event: str, data: dict | None = None) -> str:
+    payload = json.dumps(data or {}, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+broker = RoomEventBroker()
@@ -0,0 +1,190 @@
+"""轻量级结构迁移：db.create_all() 只会建新表，已有库的新增列与索引由这里按版本补齐。
+
+schema_version 表记录已应用的版本；每个迁移在 BEGIN IMMEDIATE 事务内执行并登记，
+多个 worker 同时启动时只有拿到写锁的那个会真正执行，其余的看到版本已更新后直接跳过。
+迁移函数只允许做幂等操作（IF NOT EXISTS / 先查列再加列），新建的库重复执行也无副作用。
+"""
+import sqlite3
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+
+
+def _columns(cursor, table: str) -> set[str]:
+    return {row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")')}
+
+
+def _add_columns(cursor, table: str, columns: list[tuple[str, str]]) -> None:
+    existing = _columns(cursor, table)
+    for name, ddl in columns:
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}')
+
+
+def _m1_state_and_media_columns(cursor) -> None:
+    _add_columns(cursor, "room", [
+        ("state_version", "INTEGER NOT NULL DEFAULT 0"),
+        ("playlist_version", "INTEGER NOT NULL DEFAULT 0"),
+        ("current_playlist_item_id", "INTEGER"),
+    ])
+    _add_columns(cursor, "musics", [
+        ("duration", "FLOAT"),
+        ("bitrate", "INTEGER"),
+        ("sample_rate", "INTEGER"),
+        ("seek_index", "BLOB"),
+    ])
+    _add_columns(cursor, "user", [("avatar_key", "VARCHAR(64)")])
+
+
+_HOT_PATH_INDEXES = [
+    ("ix_room_message_room_created", "room_message", "room_id, created_at"),
+    ("ix_room_playlist_room_created", "room_playlist", "room_id, created_at"),
+    ("ix_listen_record_user_played", "listen_record", "user_id, played_at"),
+    ("ix_room_participation_user_time", "room_participation_record", "user_id, participated_at"),
+    ("ix_musics_user_status_uploaded", "musics", "user_id, status, uploaded_at"),
+    ("ix_musics_user_uploaded", "musics", "user_id, uploaded_at"),
+    ("ix_musics_status_uploaded", "musics", "status, uploaded_at"),
+    ("ix_musics_stored_filename", "musics", "stored_filename"),
+    ("ix_room_member_user_joined", "room_member", "user_id, joined_at"),
+    ("ix_room_owner_created", "room", "owner_id, created_at"),
+]
+
+
+def _m2_hot_path_indexes(cursor) -> None:
+    for name, table, columns in _HOT_PATH_INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON "{table}" ({columns})')
+    # 新索引建好后刷新统计信息，让查询规划器立刻选用
+    cursor.execute("PRAGMA optimize")
+
+
+def _m3_retention_indexes(cursor) -> None:
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS ix_room_participation_time ON "room_participation_record" (participated_at)'
+    )
+
+
+def _m4_music_search(cursor) -> None:
+    try:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS music_search "
+            "USING fts5(title, original_filename, user_id UNINDEXED, tokenize='trigram')"
+        )
+    except sqlite3.OperationalError:
+        # SQLite 未编译 FTS5 或版本低于 3.34（无 trigram）：跳过，搜索退回 LIKE
+        return
+    # 只索引已审核曲目；状态、标题变化时先删后按需重新插入
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS music_search_ai AFTER INSERT ON musics WHEN new.status = 'approved' BEGIN "
+        "INSERT INTO music_search (rowid, title, original_filename, user_id) "
+        "VALUES (new.id, new.title, new.original_filename, new.user_id); END"
+    )
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS music_search_ad AFTER DELETE ON musics BEGIN "
+        "DELETE FROM music_search WHERE rowid = old.id; END"
+    )
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS music_search_au AFTER UPDATE OF title, original_filename, status, user_id "
+        "ON musics BEGIN "
+        "DELETE FROM music_search WHERE rowid = old.id; "
+        "INSERT INTO music_search (rowid, title, original_filename, user_id) "
+        "SELECT new.id, new.title, new.original_filename, new.user_id WHERE new.status = 'approved'; END"
+    )
+    cursor.execute("DELETE FROM music_search")
+    cursor.execute(
+        "INSERT INTO music_search (rowid, title, original_filename, user_id) "
+        "SELECT id, title, original_filename, user_id FROM musics WHERE status = 'approved'"
+    )
+
+
+# (版本号, 说明, 迁移函数)；只能追加，已发布的迁移不要修改
+MIGRATIONS = [
+    (1, "补齐房间状态版本、曲目元数据与头像缩略图列", _m1_state_and_media_columns),
+    (2, "热点查询的复合索引", _m2_hot_path_indexes),
+    (3, "过期记录清理用的时间索引", _m3_retention_indexes),
+    (4, "曲库全文检索索引与同步触发器", _m4_music_search),
+]
+
+
+def _ensure_version_table(cursor) -> None:
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at TEXT NOT NULL)"
+    )
+
+
+def applied_versions(cursor) -> set[int]:
+    _ensure_version_table(cursor)
+    return {row[0] for row in cursor.execute("SELECT version FROM schema_version")}
+
+
+def upgrade(engine, log=None) -> list[int]:
+    """执行所有未应用的迁移，返回本次执行的版本号。"""
+    if engine.dialect.name != "sqlite":
+        return []
+    applied = []
+    connection = engine.raw_connection()
+    dbapi = connection.driver_connection
+    isolation_level = dbapi.isolation_level
+    # 交给我们手动控制事务，避免 pysqlite 在 DDL 前后隐式提交
+    dbapi.isolation_level = None
+    try:
+        cursor = dbapi.cursor()
+        done = applied_versions(cursor)
+        for version, description, migrate in MIGRATIONS:
+            if version in done:
+                continue
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # 拿到写锁后再确认一次，其他进程可能刚刚执行完
+                if cursor.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                    cursor.execute("COMMIT")
+                    continue
+                migrate(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, datetime.utcnow().isoformat(timespec="seconds")),
+                )
+                cursor.execute("COMMIT")
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            applied.append(version)
+            if log is not None:
+                log(f"已应用迁移 {version}: {description}")
+        cursor.close()
+    finally:
+        dbapi.isolation_level = isolation_level
+        connection.close()
+    return applied
+
+
+def init_app(app, db) -> None:
+    app.cli.add_command(migrate_command)
+    if app.config["SCHEMA_AUTO_UPGRADE"]:
+        with app.app_context():
+            upgrade(db.engine, log=app.logger.info)
+
+
+@click.command("migrate")
+@click.option("--status", is_flag=True, help="只列出迁移状态，不执行")
+@with_appcontext
+def migrate_command(status):
+    """把数据库结构升级到最新版本。"""
+    from . import db
+
+    if status:
+        connection = db.engine.raw_connection()
+        try:
+            cursor = connection.driver_connection.cursor()
+            done = applied_versions(cursor)
+            connection.commit()
+        finally:
+            connection.close()
+        for version, description, _ in MIGRATIONS:
+            mark = "已应用" if version in done else "待执行"
+            click.echo(f"{version:>3}  {mark}  {description}")
+        return
+    applied = upgrade(db.engine, log=click.echo)
+    if not applied:
+        click.echo("数据库结构已是最新")
@@ -1,9 +1,14 @@
 from datetime import datetime
 from pathlib import Path
 from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from . import db, login_manager
+from .avatars import pick_size, variant_name
+from .cache import room_cache, user_cache
+from .mp3 import seek_offset
 
 
 class TimestampMixin:
@@ -19,7 +24,8 @@ class User(UserMixin, TimestampMixin, db.Model):
     password_hash = db.Column(db.String(256), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
     nickname = db.Column(db.String(32), default="新用户")
-    avatar_path = db.Column(db.String(256), nullable=True)
+    avatar_path = db.Column(db.String(256), nullable=True)  # 上传的原图
+    avatar_key = db.Column(db.String(64), nullable=True)  # 缩略图的内容摘要 + 格式，后台处理完成后写入
     notification_message = db.Column(db.String(256), nullable=True)
 
     musics = db.relationship("Music", backref="owner", lazy=True)
@@ -32,14 +38,49 @@ class User(UserMixin, TimestampMixin, db.Model):
 
     @property
     def avatar_url(self) -> str:
+        return self.avatar_url_for(80)
+
+    def avatar_url_for(self, size: int) -> str:
+        """按显示尺寸取缩略图；尚未处理完成（或未安装 Pillow）时退回原图。"""
+        if self.avatar_key:
+            return f"/static/uploads/avatars/{variant_name(self.avatar_key, pick_size(size))}"
         if self.avatar_path:
             return f"/static/uploads/avatars/{Path(self.avatar_path).name}"
-        return "https://placehold.co/80x80?text=VS"
+        return f"https://placehold.co/{size}x{size}?text=VS"
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    values = user_cache.get(user_id)
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    epoch = user_cache.epoch
+    user = db.session.get(User, user_id)
+    if user is not None:
+        user_cache.put(user_id, {column.key: getattr(user, column.key) for column in User.__table__.columns}, epoch)
+    return user
+
+
+# 用户行经 ORM 修改 / 删除后，提交成功时再让缓存失效；批量 UPDATE 不触发这里，需调用方自行失效
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _mark_user_changed(mapper, connection, target):
+    object_session(target).info.setdefault("changed_user_ids", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        user_cache.invalidate(user_id)
+        room_cache.invalidate_author(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_changed_users(session, previous_transaction):
+    session.info.pop("changed_user_ids", None)
 
 
 class Music(TimestampMixin, db.Model):
@@ -53,9 +94,25 @@ class Music(TimestampMixin, db.Model):
     status = db.Column(db.String(32), default="pending")  # pending/approved/rejected
     rejection_reason = db.Column(db.String(255), nullable=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    duration = db.Column(db.Float, nullable=True)  # 秒；服务端排程自动切歌依赖此字段
+    # 上传时由 app/mp3.py 扫描帧得到；旧数据为空
+    bitrate = db.Column(db.Integer, nullable=True)  # 平均码率 kbps
+    sample_rate = db.Column(db.Integer, nullable=True)
+    seek_index = db.Column(db.LargeBinary, nullable=True)  # 按秒的帧起点字节偏移，见 mp3.pack_seek_table
+
+    # 索引与 app/migrations.py 中的迁移保持一致，存量库由迁移补建
+    __table_args__ = (
+        db.Index("ix_musics_user_status_uploaded", "user_id", "status", "uploaded_at"),  # 房间内“我的曲库”
+        db.Index("ix_musics_user_uploaded", "user_id", "uploaded_at"),  # 我的音乐列表
+        db.Index("ix_musics_status_uploaded", "status", "uploaded_at"),  # 审核后台
+        db.Index("ix_musics_stored_filename", "stored_filename"),  # 内容寻址的引用计数
+    )
 
     def file_url(self) -> str:
-        return f"/static/uploads/music/{self.stored_filename}"
+        return f"/music/stream/{self.stored_filename}"
+
+    def seek_offset(self, seconds: float) -> int | None:
+        return seek_offset(self.seek_index, seconds)
 
 
 class Room(TimestampMixin, db.Model):
@@ -70,15 +127,47 @@ class Room(TimestampMixin, db.Model):
     current_track_name = db.Column(db.String(255), nullable=True)
     current_track_file = db.Column(db.String(255), nullable=True)
     current_position = db.Column(db.Float, default=0.0)
+    # 当前播放的歌单条目；不设外键，避免 room <-> room_playlist 循环依赖
+    current_playlist_item_id = db.Column(db.Integer, nullable=True)
+    # 房间状态版本号：任何会改变 /state 响应内容的写操作都要递增，轮询端据此做增量同步
+    state_version = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    # 播放列表最近一次变化时的 state_version，用于判断增量响应是否需要携带歌单
+    playlist_version = db.Column(db.Integer, default=0, server_default="0", nullable=False)
 
     owner = db.relationship("User", backref="rooms")
     members = db.relationship("RoomMember", backref="room", lazy=True)
     # 新增 playlist 关系
     playlist = db.relationship("RoomPlaylist", backref="room", lazy=True, cascade="all, delete-orphan")
+    current_item = db.relationship(
+        "RoomPlaylist",
+        primaryjoin="foreign(Room.current_playlist_item_id) == RoomPlaylist.id",
+        viewonly=True,
+    )
     __table_args__ = (
         db.Index("ix_room_code", "code", unique=True),
+        db.Index("ix_room_owner_created", "owner_id", "created_at"),
     )
 
+    def bump_version(self, *, playlist: bool = False) -> None:
+        """在 commit 前调用，原子递增状态版本号（SQL 表达式，避免并发写丢失）。"""
+        self.state_version = Room.state_version + 1
+        if playlist:
+            self.playlist_version = Room.state_version + 1
+        # updated_at 同时是播放进度的计时锚点，单纯的版本变化不能让 onupdate 把它刷新
+        if not db.inspect(self).attrs.updated_at.history.has_changes():
+            self.updated_at = Room.updated_at
+
+    @staticmethod
+    def bump_versions(room_ids, *, playlist: bool = False) -> None:
+        """批量版本递增，供一次影响多个房间的操作使用（如删除音乐）。"""
+        room_ids = list(room_ids)
+        if not room_ids:
+            return
+        values = {Room.state_version: Room.state_version + 1, Room.updated_at: Room.updated_at}
+        if playlist:
+            values[Room.playlist_version] = Room.state_version + 1
+        Room.query.filter(Room.id.in_(room_ids)).update(values, synchronize_session=False)
+
 
 class RoomPlaylist(TimestampMixin, db.Model):
     """房间播放列表"""
@@ -86,15 +175,37 @@ class RoomPlaylist(TimestampMixin, db.Model):
     room_id = db.Column(db.Integer, db.ForeignKey("room.id"), nullable=False)
     music_id = db.Column(db.Integer, db.ForeignKey("musics.id"), nullable=False)
 
+    __table_args__ = (db.Index("ix_room_playlist_room_created", "room_id", "created_at"),)
+
     music = db.relationship("Music")
 
 
+class RoomCodeSequence(db.Model):
+    """房间号分配序号，只有 id=1 一行；见 app/roomcodes.py。"""
+
+    __tablename__ = "room_code_sequence"
+
+    id = db.Column(db.Integer, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RoomCodeFree(db.Model):
+    """已删除房间释放的号码，冷却期后按释放时间先后复用。"""
+
+    __tablename__ = "room_code_free"
+
+    code = db.Column(db.String(6), primary_key=True)
+    released_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
 class RoomMessage(TimestampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     room_id = db.Column(db.Integer, db.ForeignKey("room.id"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     content = db.Column(db.Text, nullable=False)
 
+    __table_args__ = (db.Index("ix_room_message_room_created", "room_id", "created_at"),)
+
     room = db.relationship("Room", backref="messages")
     author = db.relationship("User")
 
@@ -107,6 +218,7 @@ class RoomMember(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("room_id", "user_id", name="uniq_room_member"),
+        db.Index("ix_room_member_user_joined", "user_id", "joined_at"),
     )
 
     user = db.relationship("User")
@@ -118,6 +230,8 @@ class ListenRecord(db.Model):
     song_name = db.Column(db.String(255), nullable=False)
     played_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
+    __table_args__ = (db.Index("ix_listen_record_user_played", "user_id", "played_at"),)
+
     user = db.relationship("User", backref="listen_records")
 
 
@@ -127,4 +241,23 @@ class RoomParticipationRecord(db.Model):
     room_code = db.Column(db.String(6), nullable=False)
     participated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_room_participation_user_time", "user_id", "participated_at"),
+        # 过期清理按时间跨用户扫描
+        db.Index("ix_room_participation_time", "participated_at"),
+    )
+
     user = db.relationship("User", backref="room_participations")
+
+
+class UploadSession(TimestampMixin, db.Model):
+    """分块上传会话：数据按偏移追加写入临时文件，received 为已确认写入的字节数。"""
+
+    __tablename__ = "upload_sessions"
+
+    id = db.Column(db.String(32), primary_key=True)  # 随机令牌，同时决定临时文件名
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False, index=True)
+    title = db.Column(db.String(64), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    total_size = db.Column(db.Integer, nullable=False)
+    received = db.Column(db.Integer, nullable=False, default=0, server_default="0")
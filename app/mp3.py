@@ -0,0 +1,327 @@
+"""MPEG 音频帧扫描：上传时流式读取一遍，校验真实帧并计算时长、码率与按时间的字节偏移索引。
+
+纯 Python 实现，不依赖第三方库；内存占用只与读缓冲大小有关，与文件大小无关。
+"""
+import struct
+from array import array
+from dataclasses import dataclass, field
+
+# 码率表（kbps），按 (MPEG 版本是否为 1, 层) 索引，下标为帧头中的码率索引
+_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# 采样率表，按版本位（3=MPEG1, 2=MPEG2, 0=MPEG2.5）索引
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+SEEK_INTERVAL_SECONDS = 1.0
+MIN_CONSECUTIVE_FRAMES = 3
+MAX_RESYNC_BYTES = 64 * 1024
+# 扫描到的帧至少覆盖音频区这么大比例才采用逐帧累计的时长，否则按平均码率估算
+MIN_SCANNED_RATIO = 0.9
+_READ_SIZE = 64 * 1024
+
+
+class Mp3FormatError(ValueError):
+    """文件不是可识别的 MPEG 音频。"""
+
+
+@dataclass
+class FrameHeader:
+    version_bits: int
+    layer: int
+    bitrate: int  # kbps
+    sample_rate: int
+    padding: int
+    channel_mode: int
+
+    @property
+    def is_mpeg1(self) -> bool:
+        return self.version_bits == 3
+
+    @property
+    def samples(self) -> int:
+        if self.layer == 1:
+            return 384
+        if self.layer == 3 and not self.is_mpeg1:
+            return 576
+        return 1152
+
+    @property
+    def length(self) -> int:
+        if self.layer == 1:
+            return (12 * self.bitrate * 1000 // self.sample_rate + self.padding) * 4
+        return self.samples // 8 * self.bitrate * 1000 // self.sample_rate + self.padding
+
+    def same_stream(self, other: "FrameHeader") -> bool:
+        return (
+            self.version_bits == other.version_bits
+            and self.layer == other.layer
+            and self.sample_rate == other.sample_rate
+        )
+
+
+def parse_header(data: bytes, offset: int = 0) -> FrameHeader | None:
+    if len(data) - offset < 4:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    if data[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version_bits = (b1 >> 3) & 0x03
+    layer_bits = (b1 >> 1) & 0x03
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_index = (b2 >> 2) & 0x03
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_index == 3:
+        # 保留值；码率索引 0 为 free format，不支持
+        return None
+    layer = 4 - layer_bits
+    return FrameHeader(
+        version_bits=version_bits,
+        layer=layer,
+        bitrate=_BITRATES[(version_bits == 3, layer)][bitrate_index],
+        sample_rate=_SAMPLE_RATES[version_bits][sample_index],
+        padding=(b2 >> 1) & 0x01,
+        channel_mode=(b3 >> 6) & 0x03,
+    )
+
+
+@dataclass
+class Mp3Info:
+    duration: float
+    bitrate: int  # 平均码率 kbps
+    sample_rate: int
+    channels: int
+    frames: int
+    vbr: bool
+    audio_offset: int
+    seek_interval: float = SEEK_INTERVAL_SECONDS
+    seek_table: list[int] = field(default_factory=list)
+
+    def pack_seek_table(self) -> bytes:
+        """紧凑编码：4 字节间隔（float32）+ 每个间隔一项的 uint32 字节偏移。"""
+        return struct.pack("<f", self.seek_interval) + array("I", self.seek_table).tobytes()
+
+
+def unpack_seek_table(blob: bytes | None) -> tuple[float, array]:
+    if not blob or len(blob) < 4:
+        return SEEK_INTERVAL_SECONDS, array("I")
+    (interval,) = struct.unpack_from("<f", blob)
+    table = array("I")
+    table.frombytes(blob[4:])
+    return interval, table
+
+
+def seek_offset(blob: bytes | None, seconds: float) -> int | None:
+    """按秒数查字节偏移（取不晚于该时刻的最近一帧起点）。"""
+    interval, table = unpack_seek_table(blob)
+    if not table:
+        return None
+    index = min(max(int(seconds // interval), 0), len(table) - 1)
+    return table[index]
+
+
+def _id3v2_size(header: bytes) -> int:
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if header[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _encoder_tag(frame: bytes, header: FrameHeader) -> tuple[bytes | None, int | None]:
+    """读取首帧里的 Xing/Info 或 VBRI 头，返回 (标签名, 编码器记录的音频帧数)。
+
+    Info 是 CBR 编码器写入的同格式标签，不代表可变码率。
+    """
+    mono = header.channel_mode == 3
+    if header.is_mpeg1:
+        side_info = 17 if mono else 32
+    else:
+        side_info = 9 if mono else 17
+    xing_at = 4 + side_info
+    tag = frame[xing_at:xing_at + 4]
+    if tag in (b"Xing", b"Info") and len(frame) >= xing_at + 12:
+        (flags,) = struct.unpack_from(">I", frame, xing_at + 4)
+        if flags & 0x01:
+            (frames,) = struct.unpack_from(">I", frame, xing_at + 8)
+            return tag, frames
+        return tag, None
+    if frame[36:40] == b"VBRI" and len(frame) >= 36 + 18:
+        (frames,) = struct.unpack_from(">I", frame, 36 + 14)
+        return b"VBRI", frames
+    return None, None
+
+
+class _Reader:
+    """带前瞻缓冲的顺序读取器；pos 为缓冲区内的读位置，base + pos 为文件绝对偏移。"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b""
+        self.pos = 0
+        self.base = 0
+        self.eof = False
+
+    @property
+    def offset(self) -> int:
+        return self.base + self.pos
+
+    def ensure(self, size: int) -> bool:
+        if len(self.buffer) - self.pos >= size:
+            return True
+        # 只在补数据时丢弃已读部分，避免每帧都复制缓冲区
+        self.buffer = self.buffer[self.pos:]
+        self.base += self.pos
+        self.pos = 0
+        while len(self.buffer) < size and not self.eof:
+            chunk = self.stream.read(max(_READ_SIZE, size - len(self.buffer)))
+            if not chunk:
+                self.eof = True
+                break
+            self.buffer += chunk
+        return len(self.buffer) >= size
+
+    def skip(self, size: int) -> None:
+        remaining = size - (len(self.buffer) - self.pos)
+        if remaining <= 0:
+            self.pos += size
+            return
+        self.base += len(self.buffer) + remaining
+        self.buffer = b""
+        self.pos = 0
+        while remaining > 0:
+            chunk = self.stream.read(min(remaining, _READ_SIZE))
+            if not chunk:
+                self.eof = True
+                break
+            remaining -= len(chunk)
+
+    def header(self, offset: int = 0) -> FrameHeader | None:
+        return parse_header(self.buffer, self.pos + offset) if self.ensure(offset + 4) else None
+
+    def drain(self) -> int:
+        """读完剩余内容，返回剩余字节数。"""
+        remaining = len(self.buffer) - self.pos
+        self.base += len(self.buffer)
+        self.buffer = b""
+        self.pos = 0
+        while not self.eof:
+            chunk = self.stream.read(_READ_SIZE)
+            if not chunk:
+                self.eof = True
+                break
+            remaining += len(chunk)
+            self.base += len(chunk)
+        return remaining
+
+
+def scan_mp3(stream) -> Mp3Info:
+    """扫描文件对象中的 MPEG 音频帧；内容不是有效 MP3 时抛出 Mp3FormatError。
+
+    帧之间夹杂的垃圾字节或 ID3 标签会跳过并重新同步；重新同步失败时停止扫描，
+    扫描到的帧覆盖不到音频区的大部分时，时长改按平均码率估算。
+    """
+    reader = _Reader(stream)
+    reader.ensure(10)
+    tag_size = _id3v2_size(reader.buffer[:10])
+    if tag_size:
+        reader.skip(tag_size)
+
+    first = _find_frame(reader, first=None)
+    if first is None:
+        raise Mp3FormatError("文件开头找不到 MP3 帧同步头")
+    audio_offset = reader.offset
+    reader.ensure(first.length)
+    tag, tag_frames = _encoder_tag(reader.buffer[reader.pos:reader.pos + first.length], first)
+
+    frames = 0
+    samples = 0
+    total_bytes = 0
+    bitrates = set()
+    seek_table: list[int] = []
+    next_seek = 0.0
+    header = first
+    if tag is not None:
+        # Xing/Info/VBRI 所在帧不含音频，跳过不计
+        reader.skip(first.length)
+        header = reader.header()
+    while True:
+        if header is None or not header.same_stream(first):
+            header = _find_frame(reader, first)
+            if header is None:
+                break
+        length = header.length
+        if not reader.ensure(length):
+            break  # 末尾截断的半帧
+        position = samples / first.sample_rate
+        while position >= next_seek:
+            seek_table.append(reader.offset)
+            next_seek += SEEK_INTERVAL_SECONDS
+        frames += 1
+        samples += header.samples
+        total_bytes += length
+        bitrates.add(header.bitrate)
+        reader.skip(length)
+        header = reader.header()
+
+    if frames < MIN_CONSECUTIVE_FRAMES:
+        raise Mp3FormatError("未找到连续的 MP3 音频帧")
+    bitrate = round(total_bytes * 8 / (samples / first.sample_rate) / 1000)
+    # 停止扫描处之后的内容（尾部 ID3v1/APE 标签或无法同步的数据）计入音频区长度
+    scanned_end = reader.offset
+    audio_bytes = scanned_end + reader.drain() - audio_offset
+    if tag_frames:
+        duration = tag_frames * first.samples / first.sample_rate
+    elif total_bytes >= audio_bytes * MIN_SCANNED_RATIO:
+        duration = samples / first.sample_rate
+    else:
+        duration = audio_bytes * 8 / (bitrate * 1000)
+    return Mp3Info(
+        duration=duration,
+        bitrate=bitrate,
+        sample_rate=first.sample_rate,
+        channels=1 if first.channel_mode == 3 else 2,
+        frames=frames,
+        vbr=tag in (b"Xing", b"VBRI") or len(bitrates) > 1,
+        audio_offset=audio_offset,
+        seek_table=seek_table,
+    )
+
+
+def _find_frame(reader: _Reader, first: FrameHeader | None) -> FrameHeader | None:
+    """在有限范围内寻找“后面紧跟同流帧”的帧头，排除偶然出现的 0xFFE 字节。
+
+    first 为 None 时寻找文件的第一帧；否则是流中途的重新同步，只接受与首帧同流的帧，
+    途中遇到的 ID3v2 标签整体跳过。
+    """
+    scanned = 0
+    while scanned < MAX_RESYNC_BYTES and reader.ensure(4):
+        if first is not None and reader.ensure(10):
+            tag_size = _id3v2_size(reader.buffer[reader.pos:reader.pos + 10])
+            if tag_size:
+                reader.skip(tag_size)
+                continue
+        header = reader.header()
+        if header is not None and (first is None or header.same_stream(first)) and _confirmed(reader, header):
+            return header
+        reader.skip(1)
+        scanned += 1
+    return None
+
+
+def _confirmed(reader: _Reader, header: FrameHeader) -> bool:
+    offset = 0
+    current = header
+    for _ in range(MIN_CONSECUTIVE_FRAMES - 1):
+        offset += current.length
+        following = reader.header(offset)
+        if following is None or not following.same_stream(header):
+            return False
+        current = following
+    return True
@@ -0,0 +1,92 @@
+"""键集（游标）分页：按 (时间, id) 定位上一页 / 下一页，翻到多深都只读一页的行。
+
+游标对客户端不透明：base64 编码的 [时间, id, 方向]。以 id 作为并列时间的次序，
+新插入的行不会让已翻过的页重复或漏行；配合 (过滤列, 时间) 复合索引即为一次索引范围扫描。
+"""
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+
+from flask import request, url_for
+from sqlalchemy import tuple_
+
+
+def encode_cursor(timestamp: datetime, row_id: int, direction: str) -> str:
+    raw = json.dumps([timestamp.isoformat(), row_id, direction], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None) -> tuple[datetime, int, str] | None:
+    """无效或被篡改的游标按“没有游标”处理，回到第一页。"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id, direction = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ("after", "before"):
+            return None
+        return datetime.fromisoformat(timestamp), int(row_id), direction
+    except (ValueError, TypeError):
+        return None
+
+
+@dataclass
+class KeysetPage:
+    items: list
+    next_cursor: str | None
+    prev_cursor: str | None
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+    def url(self, param: str, cursor: str | None) -> str:
+        """在当前页面 URL 上替换 param 对应的游标，保留其余筛选参数。"""
+        args = request.args.to_dict()
+        if cursor:
+            args[param] = cursor
+        else:
+            args.pop(param, None)
+        return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def paginate(query, time_column, id_column, *, cursor: str | None = None, per_page: int = 20,
+             descending: bool = True) -> KeysetPage:
+    """对已带过滤条件的 query 做键集分页；descending 决定第一页是最新还是最早的记录。"""
+    position = decode_cursor(cursor)
+    key = tuple_(time_column, id_column)
+    # 向前翻页时临时反转排序方向，取回后再倒过来，保证页内顺序一致
+    backwards = position is not None and position[2] == "before"
+    reverse = descending != backwards
+    if position is not None:
+        bound = tuple_(position[0], position[1])
+        query = query.filter(key < bound if reverse else key > bound)
+    if reverse:
+        query = query.order_by(time_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(time_column.asc(), id_column.asc())
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    def make(row, direction):
+        return encode_cursor(getattr(row, time_column.key), getattr(row, id_column.key), direction)
+
+    if not rows:
+        return KeysetPage(items=[], next_cursor=None, prev_cursor=None)
+    if backwards:
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, position is not None
+    return KeysetPage(
+        items=rows,
+        next_cursor=make(rows[-1], "after") if has_next else None,
+        prev_cursor=make(rows[0], "before") if has_prev else None,
+    )
@@ -0,0 +1,129 @@
+"""房间在线状态：轮询与实时连接作为心跳，超过 TTL 没有心跳的成员在时间轮上到期移出。
+
+人数与在线列表直接从内存读取，轮询不再对 RoomMember 做 COUNT；
+每个房间维护 presence 版本号，成员进出时递增，并入 /state 的 ETag 与增量判断。
+版本号取自进程内单调计数器，房间清空后即可丢弃其版本而不会与旧值重复。
+与房间状态缓存一样是进程内数据，多进程部署时各进程只看得到连到自己的成员。
+"""
+import threading
+import time
+
+from .events import broker
+from .scheduler import TimerWheel
+
+
+class PresenceRegistry:
+    def __init__(self):
+        self.app = None
+        self.ttl = 45.0
+        self._wheel = TimerWheel(slots=128, tick=1.0)
+        self._lock = threading.Lock()
+        self._rooms: dict[str, dict[int, dict]] = {}
+        self._versions: dict[str, int] = {}
+        self._clock = 0
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.ttl = float(app.config["PRESENCE_TTL_SECONDS"])
+        tick = float(app.config["PRESENCE_TICK_SECONDS"])
+        # 一圈覆盖 TTL，心跳续期时不需要记圈数
+        self._wheel = TimerWheel(slots=max(8, int(self.ttl / tick) + 2), tick=tick)
+        if not app.testing:
+            self.start()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="presence", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def touch(self, code: str, user_id: int, name: str, avatar: str) -> None:
+        """记录一次心跳；成员新上线时递增版本并推送人数变化。"""
+        with self._lock:
+            self._wheel.schedule((code, user_id), self.ttl)
+            members = self._rooms.setdefault(code, {})
+            joined = user_id not in members
+            members[user_id] = {"id": user_id, "name": name, "avatar": avatar}
+            if joined:
+                version = self._bump(code)
+                count = len(members)
+        if joined:
+            self._announce(code, version, count)
+
+    def leave(self, code: str, user_id: int) -> None:
+        with self._lock:
+            self._wheel.cancel((code, user_id))
+            changed = self._remove(code, user_id)
+            if changed:
+                version, count = self._bump(code), len(self._rooms.get(code, ()))
+        if changed:
+            self._announce(code, version, count)
+
+    def drop_room(self, code: str) -> None:
+        with self._lock:
+            for user_id in self._rooms.pop(code, {}):
+                self._wheel.cancel((code, user_id))
+            self._versions.pop(code, None)
+
+    def count(self, code: str) -> int:
+        with self._lock:
+            return len(self._rooms.get(code, ()))
+
+    def version(self, code: str) -> int:
+        with self._lock:
+            return self._versions.get(code, 0)
+
+    def members(self, code: str) -> list[dict]:
+        with self._lock:
+            return list(self._rooms.get(code, {}).values())
+
+    def expire(self) -> None:
+        """时间轮前进一格，移出到期未续期的成员。"""
+        changes = []
+        with self._lock:
+            touched = set()
+            for code, user_id in (key for key, _ in self._wheel.advance()):
+                if self._remove(code, user_id):
+                    touched.add(code)
+            for code in touched:
+                changes.append((code, self._bump(code), len(self._rooms.get(code, ()))))
+        for code, version, count in changes:
+            self._announce(code, version, count)
+
+    def _remove(self, code: str, user_id: int) -> bool:
+        members = self._rooms.get(code)
+        if not members or members.pop(user_id, None) is None:
+            return False
+        if not members:
+            del self._rooms[code]
+        return True
+
+    def _bump(self, code: str) -> int:
+        self._clock += 1
+        if code in self._rooms:
+            self._versions[code] = self._clock
+        else:
+            # 房间已空，不再保留版本，避免字典随历史房间无限增长
+            self._versions.pop(code, None)
+        return self._clock
+
+    def _announce(self, code: str, version: int, count: int) -> None:
+        broker.publish(code, "presence", {"presence_version": version, "member_count": count})
+
+    def _run(self) -> None:
+        next_tick = time.monotonic() + self._wheel.tick
+        while not self._stopped.wait(max(0.0, next_tick - time.monotonic())):
+            next_tick += self._wheel.tick
+            self.expire()
+
+
+presence = PresenceRegistry()
@@ -0,0 +1,143 @@
+"""登录失败限流：滑动窗口计数，后端可换成进程内存或多进程共享的 SQLite 文件。"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+
+
+class MemoryLimiterBackend:
+    """进程内滑动窗口：每个 key 只保留最近 limit 次时间戳，key 总数按 LRU 淘汰。
+
+    只适合单进程部署；多 worker 时每个进程各算各的。
+    """
+
+    def __init__(self, max_keys: int = 10000, max_hits: int = 100):
+        self.max_keys = max_keys
+        self.max_hits = max_hits
+        self._lock = threading.Lock()
+        self._hits: OrderedDict[str, deque] = OrderedDict()
+
+    def count(self, key: str, window: float, now: float) -> int:
+        with self._lock:
+            hits = self._hits.get(key)
+            if not hits:
+                return 0
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if not hits:
+                del self._hits[key]
+                return 0
+            return len(hits)
+
+    def hit(self, key: str, now: float) -> None:
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque(maxlen=self.max_hits)
+            hits.append(now)
+            self._hits.move_to_end(key)
+            while len(self._hits) > self.max_keys:
+                self._hits.popitem(last=False)
+
+    def reset(self, key: str) -> None:
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._hits)
+
+
+class SQLiteLimiterBackend:
+    """同一台机器上所有 worker 共享的计数：单独的 SQLite 文件，不占用业务库的写锁。
+
+    过期记录在写入时按窗口顺带清理，表大小与窗口内的失败次数成正比。
+    """
+
+    _PRUNE_EVERY = 100
+
+    def __init__(self, path: str | Path, window: float = 60.0):
+        self.path = str(path)
+        self.window = window
+        self._local = threading.local()
+        self._writes = 0
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS login_failures (key TEXT NOT NULL, ts REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_login_failures_key_ts ON login_failures (key, ts)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def count(self, key: str, window: float, now: float) -> int:
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM login_failures WHERE key = ? AND ts > ?", (key, now - window)
+        ).fetchone()
+        return row[0]
+
+    def hit(self, key: str, now: float) -> None:
+        conn = self._connect()
+        conn.execute("INSERT INTO login_failures (key, ts) VALUES (?, ?)", (key, now))
+        self._writes += 1
+        if self._writes % self._PRUNE_EVERY == 0:
+            conn.execute("DELETE FROM login_failures WHERE ts <= ?", (now - self.window,))
+
+    def reset(self, key: str) -> None:
+        self._connect().execute("DELETE FROM login_failures WHERE key = ?", (key,))
+
+
+class LoginRateLimiter:
+    """同时按用户名和客户端 IP 计数，任一超限即拒绝。
+
+    IP 的阈值更宽，避免同一出口 NAT 后的正常用户互相影响；
+    登录成功只清用户名计数，IP 计数照常过期，防止借自己的账号反复清零。
+    """
+
+    def __init__(self):
+        self.backend = MemoryLimiterBackend()
+        self.window = 60.0
+        self.max_per_user = 2
+        self.max_per_ip = 20
+
+    def init_app(self, app) -> None:
+        self.window = float(app.config["LOGIN_LOCKOUT_SECONDS"])
+        self.max_per_user = app.config["LOGIN_MAX_FAILED_ATTEMPTS"]
+        self.max_per_ip = app.config["LOGIN_MAX_FAILED_PER_IP"]
+        backend = app.config["LOGIN_RATELIMIT_BACKEND"]
+        if backend == "sqlite":
+            self.backend = SQLiteLimiterBackend(app.config["LOGIN_RATELIMIT_SQLITE_PATH"], window=self.window)
+        elif backend == "memory":
+            self.backend = MemoryLimiterBackend(
+                max_keys=app.config["LOGIN_RATELIMIT_MAX_KEYS"],
+                max_hits=max(self.max_per_user, self.max_per_ip),
+            )
+        else:
+            raise ValueError(f"未知的限流后端: {backend}")
+
+    def allowed(self, username: str, ip: str | None = None) -> bool:
+        now = time.time()
+        if self.backend.count(f"user:{username}", self.window, now) >= self.max_per_user:
+            return False
+        if ip and self.backend.count(f"ip:{ip}", self.window, now) >= self.max_per_ip:
+            return False
+        return True
+
+    def record_failure(self, username: str, ip: str | None = None) -> None:
+        now = time.time()
+        self.backend.hit(f"user:{username}", now)
+        if ip:
+            self.backend.hit(f"ip:{ip}", now)
+
+    def reset(self, username: str) -> None:
+        self.backend.reset(f"user:{username}")
+
+
+login_limiter = LoginRateLimiter()
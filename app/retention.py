@@ -0,0 +1,170 @@
+"""数据保留：后台线程定期清理过期的听歌 / 参与记录，并把每个房间的聊天记录截到上限。
+
+删除按小批次进行，每批一个短事务：先用索引选出一批 id 再按主键删除，
+写锁只持有一批的时间，批与批之间让出给聊天、播放控制等在线写入。
+"""
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, select, tuple_
+
+
+def _delete_batch(session, model, condition, order_by, batch_size: int) -> int:
+    ids = select(model.id).where(condition).order_by(*order_by).limit(batch_size)
+    result = session.execute(delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False))
+    session.commit()
+    return result.rowcount or 0
+
+
+class RetentionWorker:
+    """单个后台线程按固定间隔执行一轮清理；flask prune-records 可手动执行同样的逻辑。
+
+    多进程部署时每个进程都会清理，删除本身幂等，首轮启动加随机延迟错开。
+    """
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._totals = {"listen_record": 0, "room_participation_record": 0, "room_message": 0}
+        self._runs = 0
+        self._last_run = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        app.cli.add_command(prune_records_command)
+        if app.config["RETENTION_ENABLED"] and not app.testing:
+            self.start()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def metrics(self) -> dict:
+        """累计删除行数与最近一轮的结果，供日志与排查使用。"""
+        with self._lock:
+            return {"runs": self._runs, "pruned": dict(self._totals), "last_run": self._last_run}
+
+    def run_once(self) -> dict:
+        """执行一轮清理，返回本轮各表删除的行数。"""
+        from . import db
+        from .models import ListenRecord, RoomParticipationRecord
+
+        config = self.app.config
+        batch_size = config["RETENTION_BATCH_SIZE"]
+        cutoff = datetime.utcnow() - timedelta(days=config["LISTEN_RECORD_WINDOW_DAYS"])
+        started = time.monotonic()
+        pruned = {
+            "listen_record": self._prune_before(
+                db.session, ListenRecord, ListenRecord.played_at, cutoff, batch_size
+            ),
+            "room_participation_record": self._prune_before(
+                db.session,
+                RoomParticipationRecord,
+                RoomParticipationRecord.participated_at,
+                cutoff,
+                batch_size,
+            ),
+            "room_message": self._cap_room_messages(db.session, config["ROOM_MESSAGE_HISTORY_LIMIT"], batch_size),
+        }
+        with self._lock:
+            self._runs += 1
+            for table, count in pruned.items():
+                self._totals[table] += count
+            self._last_run = {
+                "at": datetime.utcnow().isoformat(timespec="seconds"),
+                "seconds": round(time.monotonic() - started, 3),
+                "pruned": pruned,
+            }
+        return pruned
+
+    def _pause(self) -> None:
+        self._stopped.wait(self.app.config["RETENTION_BATCH_PAUSE"])
+
+    def _prune_before(self, session, model, column, cutoff: datetime, batch_size: int) -> int:
+        total = 0
+        while not self._stopped.is_set():
+            deleted = _delete_batch(session, model, column < cutoff, (column,), batch_size)
+            total += deleted
+            if deleted < batch_size:
+                break
+            self._pause()
+        return total
+
+    def _cap_room_messages(self, session, limit: int, batch_size: int) -> int:
+        """每个房间只保留最新的 limit 条消息；limit 为 0 表示不限制。"""
+        from .models import RoomMessage
+
+        if not limit:
+            return 0
+        over = session.execute(
+            select(RoomMessage.room_id).group_by(RoomMessage.room_id).having(func.count() > limit)
+        ).scalars().all()
+        total = 0
+        for room_id in over:
+            # 第 limit+1 新的消息即为分界点，它和更早的全部删除
+            boundary = session.execute(
+                select(RoomMessage.created_at, RoomMessage.id)
+                .where(RoomMessage.room_id == room_id)
+                .order_by(RoomMessage.created_at.desc(), RoomMessage.id.desc())
+                .offset(limit)
+                .limit(1)
+            ).first()
+            if boundary is None:
+                continue
+            condition = (RoomMessage.room_id == room_id) & (
+                tuple_(RoomMessage.created_at, RoomMessage.id) <= tuple_(*boundary)
+            )
+            while not self._stopped.is_set():
+                deleted = _delete_batch(
+                    session, RoomMessage, condition, (RoomMessage.created_at, RoomMessage.id), batch_size
+                )
+                total += deleted
+                if deleted < batch_size:
+                    break
+                self._pause()
+        return total
+
+    def _run(self) -> None:
+        interval = self.app.config["RETENTION_INTERVAL_SECONDS"]
+        delay = random.uniform(0, min(interval, 300))
+        while not self._stopped.wait(delay):
+            delay = interval
+            with self.app.app_context():
+                try:
+                    pruned = self.run_once()
+                except Exception:
+                    self.app.logger.exception("数据保留清理失败")
+                    continue
+                finally:
+                    from . import db
+
+                    db.session.remove()
+            if any(pruned.values()):
+                self.app.logger.info("数据保留清理完成 %s", pruned)
+
+
+retention = RetentionWorker()
+
+
+@click.command("prune-records")
+@with_appcontext
+def prune_records_command():
+    """立即执行一轮过期记录清理。"""
+    pruned = retention.run_once()
+    for table, count in pruned.items():
+        click.echo(f"{table}: 删除 {count} 行")
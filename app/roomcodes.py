@@ -0,0 +1,113 @@
+"""房间号分配：数据库里的单调序号经带密钥的 Feistel 置换映射到 6 位号码空间。
+
+置换是 [0, 10^6) 上的双射，不同序号必然得到不同号码，无需随机试探再查重；
+序号自增与空闲号码出队都是 SQLite 写事务内的一条 UPDATE / DELETE ... RETURNING，
+多个 worker 并发创建房间时由数据库写锁串行化，不会分到同一个号码。
+删除房间的号码进入空闲表，冷却期过后优先复用，避免旧链接立刻指向别人的新房间。
+"""
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db
+from .models import Room, RoomCodeFree, RoomCodeSequence
+
+CODE_SPACE = 10 ** 6
+_HALF_BITS = 10  # 2^20 = 1048576 覆盖 10^6，超出部分靠循环行走回到号码空间
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+class RoomCodesExhausted(RuntimeError):
+    """序号用完且没有可复用的空闲号码。"""
+
+
+def _round(key: bytes, round_no: int, value: int) -> int:
+    digest = hashlib.blake2b(value.to_bytes(2, "big"), key=key, digest_size=4, person=bytes([round_no]) * 16)
+    return int.from_bytes(digest.digest(), "big") & _HALF_MASK
+
+
+def permute(index: int, key: bytes) -> int:
+    """把序号 index 映射为 [0, CODE_SPACE) 中的号码，同一 key 下为一一映射。"""
+    value = index
+    while True:
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for round_no in range(_ROUNDS):
+            left, right = right, left ^ _round(key, round_no, right)
+        value = (left << _HALF_BITS) | right
+        # 循环行走：落在号码空间之外就再置换一次，仍保持双射
+        if value < CODE_SPACE:
+            return value
+
+
+def _key() -> bytes:
+    secret = current_app.config.get("ROOM_CODE_KEY") or current_app.config["SECRET_KEY"]
+    return hashlib.blake2b(str(secret).encode(), digest_size=32).digest()
+
+
+def _pop_free_code() -> str | None:
+    cooldown = timedelta(days=current_app.config["ROOM_CODE_REUSE_AFTER_DAYS"])
+    oldest = (
+        select(RoomCodeFree.code)
+        .where(RoomCodeFree.released_at <= datetime.utcnow() - cooldown)
+        # 旧版随机号码可能既在空闲表里、又被序号分配给了新房间，这样的号码跳过
+        .where(~select(Room.id).where(Room.code == RoomCodeFree.code).exists())
+        .order_by(RoomCodeFree.released_at)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return db.session.execute(
+        delete(RoomCodeFree).where(RoomCodeFree.code == oldest).returning(RoomCodeFree.code)
+    ).scalar()
+
+
+def _next_sequence() -> int:
+    bump = (
+        update(RoomCodeSequence)
+        .where(RoomCodeSequence.id == 1)
+        .values(value=RoomCodeSequence.value + 1)
+        .returning(RoomCodeSequence.value)
+        .execution_options(synchronize_session=False)
+    )
+    value = db.session.execute(bump).scalar()
+    if value is None:
+        # 首次使用时建立计数行；并发首建由 ON CONFLICT 兜底
+        db.session.execute(sqlite_insert(RoomCodeSequence).values(id=1, value=0).on_conflict_do_nothing())
+        value = db.session.execute(bump).scalar()
+    return value - 1
+
+
+def allocate_room_code() -> str:
+    """在调用方的事务内分配一个房间号；事务回滚时序号 / 空闲号码一并回滚。"""
+    code = _pop_free_code()
+    if code is not None:
+        return code
+    key = _key()
+    while True:
+        index = _next_sequence()
+        if index >= CODE_SPACE:
+            raise RoomCodesExhausted("房间号已分配完")
+        code = f"{permute(index, key):06d}"
+        # 旧版随机分配的号码可能恰好被占用或已进入空闲表，跳过即可（只在迁移初期偶尔发生）
+        if not _code_known(code):
+            return code
+
+
+def _code_known(code: str) -> bool:
+    in_use = select(Room.id).where(Room.code == code).exists()
+    released = select(RoomCodeFree.code).where(RoomCodeFree.code == code).exists()
+    return db.session.execute(select(db.or_(in_use, released))).scalar()
+
+
+def release_room_code(code: str) -> None:
+    """删除房间时在同一事务内调用，号码冷却后重新分配。"""
+    released_at = datetime.utcnow()
+    # 号码已在空闲表中（旧数据）时重新计算冷却期，而不是主键冲突
+    db.session.execute(
+        sqlite_insert(RoomCodeFree)
+        .values(code=code, released_at=released_at)
+        .on_conflict_do_update(index_elements=[RoomCodeFree.code], set_={"released_at": released_at})
+    )
@@ -1,19 +1,51 @@
+import json
+import math
+import queue
+import secrets
+import threading
+import time
+from collections import deque
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
+from types import SimpleNamespace
 
 from flask import (
     Blueprint,
+    Response,
     abort,
+    current_app,
     flash,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
+    send_file,
     url_for,
 )
 from flask_login import current_user, login_required
-
-from . import db
+from sqlalchemy.orm import joinedload
+
+from . import db, sock
+from .avatars import avatar_pipeline
+from .cache import RoomSnapshot, room_cache
+from .events import broker, format_sse
+from .scheduler import scheduler
+from .mp3 import Mp3FormatError
+from .pagination import paginate
+from .presence import presence
+from .roomcodes import RoomCodesExhausted, allocate_room_code, release_room_code
+from .search import search_library
+from .storage import (
+    StagedMusic,
+    chunk_path,
+    discard_chunks,
+    forget_chunk_hash,
+    probe_chunks,
+    release as release_music_file,
+    stage_chunks,
+    write_chunk,
+)
 from .forms import MusicUploadForm, ProfileForm, RoomCreateForm, RoomJoinForm
 from .models import (
     ListenRecord,
@@ -23,12 +55,162 @@ from .models import (
     RoomMessage,
     RoomParticipationRecord,
     RoomPlaylist,
+    UploadSession,
     User,
 )
-from .utils import generate_room_code, generate_room_name, save_avatar, save_music, format_datetime
+from .utils import generate_room_name, save_avatar, save_music, format_datetime
+from .writebehind import write_behind
 
 main_bp = Blueprint("main", __name__)
 
+ROOM_MESSAGES_PER_PAGE = 50
+
+
+def _notify_room(room: Room, event: str, **data) -> None:
+    """写操作 commit 之后调用：写穿房间状态缓存，并把变更信号推送给房间内的实时连接。"""
+    version = room.state_version
+    if event in {"playback", "availability"}:
+        fields = _playback_fields(room)
+        room_cache.update(room.code, version, **fields)
+        scheduler.schedule_room(room, fields["current_track_duration"])
+        if event == "playback":
+            # 推送里直接带上完整播放状态，客户端无需再拉一次
+            data["playback"] = _playback_payload(SimpleNamespace(**fields))
+    elif event == "message":
+        room_cache.update(room.code, version, message=data["message"])
+    elif event == "playlist":
+        room_cache.update(
+            room.code,
+            version,
+            playlist_version=room.playlist_version,
+            playlist=_playlist_payload(room.id),
+        )
+    else:
+        # 成员变化同时伴随系统消息与人数变化，直接失效由下一次读取重建
+        room_cache.invalidate(room.code, version)
+    broker.publish(room.code, event, {"version": version, **data})
+
+
+def _playback_fields(room: Room) -> dict:
+    duration = None
+    if room.current_playlist_item_id is not None:
+        duration = (
+            db.session.query(Music.duration)
+            .join(RoomPlaylist, RoomPlaylist.music_id == Music.id)
+            .filter(RoomPlaylist.id == room.current_playlist_item_id)
+            .scalar()
+        )
+    return {
+        "playback_status": room.playback_status,
+        "current_track_name": room.current_track_name,
+        "current_track_file": room.current_track_file,
+        "current_position": room.current_position,
+        "updated_at": room.updated_at,
+        "is_active": room.is_active,
+        "current_playlist_item_id": room.current_playlist_item_id,
+        "current_track_duration": duration,
+    }
+
+
+def _playback_payload(room: RoomSnapshot | SimpleNamespace) -> dict:
+    # 智能进度计算：播放中时补上自 updated_at 以来经过的时间
+    current_pos = room.current_position or 0.0
+    playing = room.playback_status == 'playing' and room.updated_at is not None
+    timeline = {
+        "track": room.current_track_file,
+        "rate": 1.0 if playing else 0.0,
+        "position": current_pos,
+        "start_ms": None,
+    }
+    if playing:
+        # room.updated_at 可能是 naive（按 UTC 存储），为安全起见将其视为 UTC
+        if room.updated_at.tzinfo is None:
+            updated_at_utc = room.updated_at.replace(tzinfo=timezone.utc)
+        else:
+            updated_at_utc = room.updated_at.astimezone(timezone.utc)
+        elapsed = (datetime.now(timezone.utc) - updated_at_utc).total_seconds()
+        # 权威时间线：曲目第 0 秒对应的服务端时刻（毫秒），客户端按校准后的时钟自行推算进度
+        timeline["start_ms"] = updated_at_utc.timestamp() * 1000 - current_pos * 1000
+        current_pos += elapsed
+    return {
+        "playback_status": room.playback_status,
+        "current_track_name": room.current_track_name,
+        "current_track_file": room.current_track_file,
+        "current_item_id": room.current_playlist_item_id,
+        "current_track_duration": room.current_track_duration,
+        "current_position": current_pos,
+        "is_active": room.is_active,
+        "updated_at": format_datetime(room.updated_at, None),
+        "timeline": timeline,
+    }
+
+
+def _server_time_ms() -> float:
+    return time.time() * 1000
+
+
+def _playlist_payload(room_id: int) -> list[dict]:
+    # 只投影需要的三列，一条 JOIN 查询取完整个歌单
+    rows = (
+        db.session.query(RoomPlaylist.id, Music.id, Music.title)
+        .join(Music, RoomPlaylist.music_id == Music.id)
+        .filter(RoomPlaylist.room_id == room_id)
+        .order_by(RoomPlaylist.created_at.asc())
+        .all()
+    )
+    return [
+        {"id": item_id, "music_id": music_id, "title": title}
+        for item_id, music_id, title in rows
+    ]
+
+
+def _presence_identity() -> tuple[int, str, str]:
+    return current_user.id, current_user.nickname or current_user.username, current_user.avatar_url_for(40)
+
+
+def _touch_presence(code: str) -> None:
+    presence.touch(code, *_presence_identity())
+
+
+def _load_room_snapshot(code: str) -> RoomSnapshot | None:
+    profile_epoch = room_cache.profile_epoch
+    room = Room.query.filter_by(code=code).first()
+    if room is None:
+        return None
+    recent_msgs = RoomMessage.query.options(joinedload(RoomMessage.author)) \
+        .filter_by(room_id=room.id) \
+        .order_by(RoomMessage.created_at.desc()) \
+        .limit(room_cache.max_messages).all()
+    recent_msgs.reverse()
+    changed_at = room.updated_at
+    if recent_msgs and (changed_at is None or recent_msgs[-1].created_at > changed_at):
+        changed_at = recent_msgs[-1].created_at
+    return RoomSnapshot(
+        room_id=room.id,
+        owner_id=room.owner_id,
+        state_version=room.state_version,
+        playlist_version=room.playlist_version,
+        **_playback_fields(room),
+        playlist=_playlist_payload(room.id),
+        messages=deque(
+            (_message_payload(m) for m in recent_msgs), maxlen=room_cache.max_messages
+        ),
+        changed_at=changed_at,
+        profile_epoch=profile_epoch,
+    )
+
+
+def _message_payload(message: RoomMessage) -> dict:
+    return {
+        "id": message.id,
+        "author_id": message.author.id,
+        "author_name": message.author.nickname or message.author.username,
+        "author_avatar": message.author.avatar_url_for(40),
+        "author_avatar_2x": message.author.avatar_url_for(80),
+        "created_at": format_datetime(message.created_at, '%H:%M'),
+        "content": message.content,
+    }
+
 
 @main_bp.route("/")
 def index():
@@ -75,15 +257,53 @@ def profile():
                 flash("仅支持常见图片格式，大小请控制在 5MB 内", "error")
                 return render_template("profile.html", form=form)
             current_user.avatar_path = stored_name
+            current_user.avatar_key = None
         db.session.commit()
+        if avatar_file and avatar_file.filename:
+            # 缩放与重编码交给后台线程池，请求立即返回，处理完成前先展示原图
+            avatar_pipeline.submit(current_user.id, current_user.avatar_path)
         flash("个人信息已更新", "success")
         return redirect(url_for("main.profile"))
     return render_template("profile.html", form=form)
 
 
+def _create_music(user_id: int, title: str, original_filename: str, staged: StagedMusic) -> Music:
+    """为暂存好的上传建 Music 行并把文件发布到内容地址，一次提交完成。"""
+    info = staged.info
+    music = Music(
+        user_id=user_id,
+        title=title,
+        original_filename=original_filename,
+        stored_filename=staged.stored_name,
+        duration=info.duration,
+        bitrate=info.bitrate,
+        sample_rate=info.sample_rate,
+        seek_index=info.pack_seek_table(),
+    )
+    # 同一内容此前被驳回过：直接沿用驳回结论，不再进审核队列
+    rejected = (
+        db.session.query(Music.rejection_reason)
+        .filter(Music.stored_filename == staged.stored_name, Music.status == "rejected")
+        .first()
+    )
+    if rejected is not None:
+        music.status = "rejected"
+        music.rejection_reason = rejected.rejection_reason
+    try:
+        db.session.add(music)
+        db.session.flush()  # 先拿到写锁再发布文件，见 StagedMusic.publish
+        staged.publish()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        staged.discard()
+        raise
+    return music
+
+
 @main_bp.route("/music", methods=["GET", "POST"])
 @login_required
-#增加按上传时间范围（from/to ISO 字符串）过滤和分页（page 参数），查询按 Music.uploaded_at 索引排序并使用 LIMIT/OFFSET。
+#增加按上传时间范围（from/to ISO 字符串）过滤和游标分页（cursor 参数）。
 def music():
     if current_user.is_admin:
         abort(403)
@@ -93,27 +313,21 @@ def music():
         if not file or not file.filename:
             flash("请选择 MP3 文件", "error")
         else:
-            stored_name, error = save_music(file)
+            staged, error = save_music(file)
             if error:
                 flash(error, "error")
             else:
                 title = (upload_form.title.data or "").strip()
                 if not title:
                     title = Path(file.filename).stem or "未命名歌曲"
-                music = Music(
-                    user_id=current_user.id,
-                    title=title,
-                    original_filename=file.filename,
-                    stored_filename=stored_name,
-                )
-                db.session.add(music)
-                db.session.commit()
+                music = _create_music(current_user.id, title, file.filename, staged)
                 flash("请确保上传音乐拥有合法使用权限", "info")
-                flash("音乐已进入待审核队列", "success")
+                if music.status == "rejected":
+                    flash("该文件与已被驳回的内容相同，已自动驳回", "warning")
+                else:
+                    flash("音乐已进入待审核队列", "success")
                 return redirect(url_for("main.music"))
-    # 支持按上传时间范围查询与分页，利用 uploaded_at 索引
-    page = int(request.args.get("page", 1))
-    per_page = 20
+    # 支持按上传时间范围查询，按 (uploaded_at, id) 游标分页，走 (user_id, uploaded_at) 索引
     date_from = request.args.get("from")
     date_to = request.args.get("to")
     q = Music.query.filter_by(user_id=current_user.id)
@@ -129,8 +343,170 @@ def music():
             q = q.filter(Music.uploaded_at <= dt_to)
         except Exception:
             pass
-    my_music = q.order_by(Music.uploaded_at.desc()).limit(per_page).offset((page - 1) * per_page).all()
-    return render_template("music.html", upload_form=upload_form, musics=my_music, page=page)
+    music_page = paginate(q, Music.uploaded_at, Music.id, cursor=request.args.get("cursor"), per_page=20)
+    return render_template("music.html", upload_form=upload_form, musics=music_page.items, music_page=music_page)
+
+
+def _upload_session_payload(session: UploadSession) -> dict:
+    return {
+        "id": session.id,
+        "offset": session.received,
+        "size": session.total_size,
+        "chunk_size": current_app.config["MUSIC_UPLOAD_CHUNK_MB"] * 1024 * 1024,
+    }
+
+
+def _get_upload_session(session_id: str) -> UploadSession:
+    session = UploadSession.query.filter_by(id=session_id, user_id=current_user.id).first()
+    if session is None:
+        abort(404)
+    return session
+
+
+def _purge_expired_uploads(user_id: int) -> None:
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config["UPLOAD_SESSION_TTL_HOURS"])
+    expired = UploadSession.query.filter(
+        UploadSession.user_id == user_id, UploadSession.updated_at < cutoff
+    ).all()
+    for session in expired:
+        discard_chunks(session.id)
+        db.session.delete(session)
+
+
+def _drop_upload_session(session_id: str) -> None:
+    """分块数据已不可用时连同会话行一起删除，客户端只能重新上传，而不是带着不存在的分块续传。"""
+    discard_chunks(session_id)
+    try:
+        UploadSession.query.filter_by(id=session_id).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception("删除上传会话 %s 失败，留待过期清理", session_id)
+
+
+@main_bp.route("/music/uploads", methods=["POST"])
+@login_required
+def create_upload():
+    """分块上传第一步：登记文件名与总大小，返回会话 id 与建议分块大小。"""
+    if current_user.is_admin:
+        abort(403)
+    payload = request.get_json(silent=True) or request.form
+    original_name = (payload.get("filename") or "").strip()
+    size = payload.get("size")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        return jsonify({"error": "缺少文件大小"}), 400
+    ext = Path(original_name).suffix.lower().lstrip(".")
+    if ext not in current_app.config["ALLOWED_MUSIC_EXTENSIONS"]:
+        return jsonify({"error": "仅支持 MP3 格式文件"}), 400
+    limit_mb = current_app.config["MAX_MUSIC_FILE_MB"]
+    if size <= 0 or size > limit_mb * 1024 * 1024:
+        return jsonify({"error": f"文件大小需在 {limit_mb} MB 以内"}), 400
+    title = (payload.get("title") or "").strip()[:64] or Path(original_name).stem[:64] or "未命名歌曲"
+    _purge_expired_uploads(current_user.id)
+    session = UploadSession(
+        id=secrets.token_hex(16),
+        user_id=current_user.id,
+        title=title,
+        original_filename=original_name[:255],
+        total_size=size,
+    )
+    db.session.add(session)
+    db.session.commit()
+    return jsonify(_upload_session_payload(session)), 201
+
+
+@main_bp.route("/music/uploads/<session_id>", methods=["GET"])
+@login_required
+def upload_status(session_id):
+    """断线后查询已确认的偏移，客户端从这里继续。"""
+    return jsonify(_upload_session_payload(_get_upload_session(session_id)))
+
+
+@main_bp.route("/music/uploads/<session_id>", methods=["PUT"])
+@login_required
+def upload_chunk(session_id):
+    """写入 ?offset= 处的一个分块；请求体直接流式写入临时文件，不经表单解析。"""
+    session = _get_upload_session(session_id)
+    offset = request.args.get("offset", type=int)
+    length = request.content_length
+    if length is None:
+        return jsonify({"error": "缺少 Content-Length"}), 411
+    if length > current_app.config["MUSIC_UPLOAD_CHUNK_MB"] * 1024 * 1024:
+        return jsonify({"error": "分块过大"}), 413
+    if offset != session.received:
+        # 重传或乱序：告诉客户端服务端实际已收到多少
+        return jsonify({"error": "偏移不匹配", **_upload_session_payload(session)}), 409
+    if offset + length > session.total_size:
+        return jsonify({"error": "超出声明的文件大小"}), 400
+    written = write_chunk(session.id, offset, request.stream, length)
+    if written != length:
+        forget_chunk_hash(session.id)
+        return jsonify({"error": "分块不完整，请重试", **_upload_session_payload(session)}), 400
+    # 按旧偏移做条件更新，同一会话的并发分块只有一个能推进偏移
+    updated = UploadSession.query.filter_by(id=session.id, received=offset).update(
+        {"received": offset + written, "updated_at": datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+    if not updated:
+        forget_chunk_hash(session.id)
+        db.session.refresh(session)
+        return jsonify({"error": "偏移不匹配", **_upload_session_payload(session)}), 409
+    session.received = offset + written
+    # 首块足够长时提前校验帧结构，明显不是 MP3 的文件不必等传完
+    if offset == 0 and (written >= 64 * 1024 or written == session.total_size):
+        try:
+            probe_chunks(session.id)
+        except Mp3FormatError:
+            discard_chunks(session.id)
+            db.session.delete(session)
+            db.session.commit()
+            return jsonify({"error": "文件内容不是有效的 MP3 音频，请导出为常见 MP3 再上传"}), 422
+    return jsonify(_upload_session_payload(session))
+
+
+@main_bp.route("/music/uploads/<session_id>/finalize", methods=["POST"])
+@login_required
+def finalize_upload(session_id):
+    """全部分块到达后校验整文件，原子移动到内容地址并创建 Music。"""
+    session = _get_upload_session(session_id)
+    if session.received != session.total_size:
+        return jsonify({"error": "文件尚未传完", **_upload_session_payload(session)}), 409
+    if not chunk_path(session.id).exists():
+        _drop_upload_session(session.id)
+        return jsonify({"error": "上传数据已丢失，请重新上传"}), 410
+    try:
+        staged = stage_chunks(session.id, session.total_size)
+    except Mp3FormatError:
+        discard_chunks(session.id)
+        db.session.delete(session)
+        db.session.commit()
+        return jsonify({"error": "文件内容不是有效的 MP3 音频，请导出为常见 MP3 再上传"}), 422
+    title, original_name, user_id = session.title, session.original_filename, session.user_id
+    db.session.delete(session)
+    try:
+        music = _create_music(user_id, title, original_name, staged)
+    except Exception:
+        # 回滚会恢复会话行，但 _create_music 已删掉（或发布走了）分块文件
+        _drop_upload_session(session_id)
+        raise
+    flash("请确保上传音乐拥有合法使用权限", "info")
+    if music.status == "rejected":
+        flash("该文件与已被驳回的内容相同，已自动驳回", "warning")
+    else:
+        flash("音乐已进入待审核队列", "success")
+    return jsonify({"music_id": music.id, "status": music.status})
+
+
+@main_bp.route("/music/uploads/<session_id>", methods=["DELETE"])
+@login_required
+def cancel_upload(session_id):
+    session = _get_upload_session(session_id)
+    discard_chunks(session.id)
+    db.session.delete(session)
+    db.session.commit()
+    return jsonify({"ok": True})
 
 
 @main_bp.route("/music/<int:music_id>/delete", methods=["POST"])
@@ -139,14 +515,82 @@ def delete_music(music_id):
     if current_user.is_admin:
         abort(403)
     music = Music.query.filter_by(id=music_id, user_id=current_user.id).first_or_404()
-    # 同时删除在任何房间播放列表中的引用
+    # 同时删除在任何房间播放列表中的引用，并通知受影响的房间刷新歌单
+    affected_room_ids = [
+        room_id
+        for (room_id,) in db.session.query(RoomPlaylist.room_id)
+        .filter_by(music_id=music.id)
+        .distinct()
+    ]
     RoomPlaylist.query.filter_by(music_id=music.id).delete()
+    Room.bump_versions(affected_room_ids, playlist=True)
+    stored_name = music.stored_filename
     db.session.delete(music)
     db.session.commit()
+    # 只删除本条引用；提交成功后、同一内容没有其他 Music 行时才删除文件
+    release_music_file(stored_name)
+    if affected_room_ids:
+        for room in Room.query.filter(Room.id.in_(affected_room_ids)):
+            _notify_room(room, "playlist")
     flash("音乐已删除", "info")
     return redirect(url_for("main.music"))
 
 
+@main_bp.before_app_request
+def _block_static_music():
+    # 音频只能经由 stream_music 访问，静态目录直链不再对外
+    if request.path.startswith("/static/uploads/music/"):
+        abort(404)
+
+
+@main_bp.route("/music/search")
+@login_required
+def music_search():
+    """点歌面板的输入联想：在自己已审核的曲目中按标题 / 文件名检索。"""
+    results = search_library(current_user.id, request.args.get("q", "")[:64])
+    return jsonify({
+        "results": [
+            {"id": music.id, "title": music.title, "duration": music.duration} for music in results
+        ]
+    })
+
+
+@main_bp.route("/music/stream/<path:filename>")
+@login_required
+def stream_music(filename):
+    """音频流：Range/206 与条件请求交给 send_file，可配置由前置代理直接发送文件。"""
+    query = db.session.query(Music.id).filter(Music.stored_filename == filename)
+    if not current_user.is_admin:
+        # 已审核的歌曲房间成员都能听；未审核的只有上传者本人能试听
+        query = query.filter(db.or_(Music.status == "approved", Music.user_id == current_user.id))
+    if query.first() is None:
+        abort(404)
+    folder = Path(current_app.config["MUSIC_FOLDER"])
+    path = folder / filename
+    if path.parent != folder or not path.is_file():
+        abort(404)
+    # 存储名即内容摘要（旧数据为每次上传唯一的时间戳名），文件不会被改写，可按文件名做强校验器并长期缓存
+    etag = Path(filename).stem
+    cache_control = "private, max-age=31536000, immutable"
+    mode = current_app.config["MUSIC_SENDFILE_MODE"]
+    if mode in {"x-accel", "x-sendfile"}:
+        # 由前置代理读文件并处理 Range，Python 进程只返回一个空响应
+        response = make_response("")
+        if mode == "x-accel":
+            response.headers["X-Accel-Redirect"] = current_app.config["MUSIC_ACCEL_REDIRECT_PREFIX"] + filename
+        else:
+            response.headers["X-Sendfile"] = str(path.resolve())
+        response.headers["Content-Type"] = "audio/mpeg"
+        response.headers["Accept-Ranges"] = "bytes"
+    else:
+        # conditional=True 时 send_file 处理 Range / If-Range / If-None-Match，
+        # 文件体经 wsgi.file_wrapper 交给服务器 sendfile，不在 Python 里逐块复制
+        response = send_file(path, mimetype="audio/mpeg", conditional=True, etag=etag, max_age=None)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
 @main_bp.route("/my-rooms")
 @login_required
 def my_rooms():
@@ -156,7 +600,8 @@ def my_rooms():
         Room.query.filter_by(owner_id=current_user.id).order_by(Room.created_at.desc()).all()
     )
     memberships = (
-        RoomMember.query.filter_by(user_id=current_user.id)
+        RoomMember.query.options(joinedload(RoomMember.room).joinedload(Room.owner))
+        .filter_by(user_id=current_user.id)
         .order_by(RoomMember.joined_at.desc())
         .all()
     )
@@ -167,13 +612,6 @@ def my_rooms():
     )
 
 
-def _generate_unique_room_code():
-    while True:
-        code = generate_room_code()
-        if not Room.query.filter_by(code=code).first():
-            return code
-
-
 @main_bp.route("/rooms/create", methods=["POST"])
 @login_required
 def create_room():
@@ -193,12 +631,16 @@ def create_room():
         return redirect(url_for("main.dashboard"))
     # ========================== [结束插入修改代码] ==========================
 
-    code = _generate_unique_room_code()
+    try:
+        code = allocate_room_code()
+    except RoomCodesExhausted:
+        db.session.rollback()
+        flash("创建失败：暂无可用的房间号，请稍后再试", "error")
+        return redirect(url_for("main.dashboard"))
     room = Room(owner_id=current_user.id, name=form.name.data or generate_room_name(), code=code)
     db.session.add(room)
-    db.session.commit()
-    participation = RoomParticipationRecord(user_id=current_user.id, room_code=code)
-    db.session.add(participation)
+    # 延迟写入未启用时退化为加入当前会话，必须排在提交之前
+    write_behind.add(RoomParticipationRecord, user_id=current_user.id, room_code=code)
     db.session.commit()
     flash(f"房间创建成功，房间号 {code}", "success")
     return redirect(url_for("main.room_detail", code=code))
@@ -240,11 +682,15 @@ def _attach_member(room: Room, user: User, *, record_participation: bool = True)
         # [新增] 插入进入房间的消息
         join_msg = RoomMessage(room_id=room.id, user_id=user.id, content="进入了房间")
         db.session.add(join_msg)
+        room.bump_version()
 
     if record_participation or created_now:
-        record = RoomParticipationRecord(user_id=user.id, room_code=room.code)
-        db.session.add(record)
-    db.session.commit()
+        write_behind.add(RoomParticipationRecord, user_id=user.id, room_code=room.code)
+    # 成员关系与系统消息必须随版本号一起可见，仍在请求内提交；参与记录走延迟写入
+    if created_now or not write_behind.enabled:
+        db.session.commit()
+    if created_now:
+        _notify_room(room, "members")
 
 
 @main_bp.route("/rooms/<code>")
@@ -252,34 +698,32 @@ def _attach_member(room: Room, user: User, *, record_participation: bool = True)
 def room_detail(code):
     if current_user.is_admin:
         abort(403)
-    room = Room.query.filter_by(code=code).first_or_404()
+    room = Room.query.options(joinedload(Room.owner)).filter_by(code=code).first_or_404()
     if not room.is_active and room.owner_id != current_user.id:
         flash("房间已关闭，无法进入", "error")
         return redirect(url_for("main.dashboard"))
     if room.owner_id != current_user.id:
         _attach_member(room, current_user, record_participation=False)
-    #成员计数（用于显示）改为 db.session.query(db.func.count(...)) 的聚合计数，利用 RoomMember.room_id 索引。
-    member_count = db.session.query(db.func.count(RoomMember.id)).filter(RoomMember.room_id == room.id).scalar() or 0
-    member_count = member_count + 1
-    # 获取房间播放列表
-    room_playlist = RoomPlaylist.query.filter_by(room_id=room.id).order_by(RoomPlaylist.created_at.asc()).all()
-
-    # 获取用户自己的已审核音乐（用于添加到房间）
-    my_approved_music = (
-        Music.query.filter_by(user_id=current_user.id, status="approved")
-        .order_by(Music.uploaded_at.desc())
-        .all()
-    )
+    # 在线人数来自内存中的心跳登记，打开页面本身就算一次心跳
+    _touch_presence(room.code)
+    member_count = presence.count(room.code)
+    # 播放队列不在服务端渲染：页面打开后由 /state 下发歌单、前端绘制，这里不再整表查询
 
-    messages = RoomMessage.query.filter_by(room_id=room.id).order_by(RoomMessage.created_at.asc()).all()
+    # 点歌面板只预渲染最近上传的一小批，其余通过 music_search 按需检索
+    my_approved_music = search_library(current_user.id, "")
+
+    # 只渲染最近一页消息，更早的由前端滚动到顶部时从 message_history 按游标加载
+    messages_page = _message_history(room.id, request.args.get("messages_cursor"))
+    messages = list(reversed(messages_page.items))
 
     return render_template(
         "room.html",
+        socket_url=url_for("main.room_socket", code=room.code) if sock is not None else None,
         room=room,
         is_owner=room.owner_id == current_user.id,
-        room_playlist=room_playlist,
         my_library=my_approved_music,
         messages=messages,
+        messages_page=messages_page,
         member_count=member_count,
     )
 
@@ -305,7 +749,9 @@ def add_to_playlist(code):
 
     item = RoomPlaylist(room_id=room.id, music_id=music.id)
     db.session.add(item)
+    room.bump_version(playlist=True)
     db.session.commit()
+    _notify_room(room, "playlist")
 
     flash(f"已将《{music.title}》添加到房间播放列表", "success")
     return redirect(url_for("main.room_detail", code=code))
@@ -328,7 +774,10 @@ def leave_room(code):
         # ========================== [结束插入修改代码] ==========================
 
         db.session.delete(membership)
+        room.bump_version()
         db.session.commit()
+        presence.leave(room.code, current_user.id)
+        _notify_room(room, "members")
         flash("你已退出房间，可随时再次通过房间号加入", "info")
     else:
         flash("当前未在该房间中", "warning")
@@ -352,7 +801,9 @@ def room_availability(code):
     else:
         flash("未知操作", "error")
         return redirect(url_for("main.room_detail", code=code))
+    room.bump_version()
     db.session.commit()
+    _notify_room(room, "availability", is_active=room.is_active)
     flash(message, "success")
     return redirect(url_for("main.room_detail", code=code))
 
@@ -366,9 +817,16 @@ def delete_room(code):
     RoomMessage.query.filter_by(room_id=room.id).delete(synchronize_session=False)
     RoomMember.query.filter_by(room_id=room.id).delete(synchronize_session=False)
     RoomPlaylist.query.filter_by(room_id=room.id).delete(synchronize_session=False)
+    room_id = room.id
     db.session.delete(room)
+    release_room_code(code)
     db.session.commit()
-    flash("房间已删除，房间号不再可用", "info")
+    room_cache.forget(code)
+    presence.drop_room(code)
+    scheduler.cancel_room(room_id)
+    broker.publish(code, "deleted")
+    cooldown = current_app.config["ROOM_CODE_REUSE_AFTER_DAYS"]
+    flash(f"房间已删除，房间号 {code} 已释放，{cooldown} 天后可能分配给新房间", "info")
     return redirect(url_for("main.my_rooms"))
 
 
@@ -376,7 +834,7 @@ def delete_room(code):
 
 @main_bp.route("/records")
 @login_required
-#支持 days、或 start/end ISO 日期过滤与分页，查询按 ListenRecord.played_at 索引排序并使用 LIMIT/OFFSET。
+#支持 days、或 start/end ISO 日期过滤与游标分页，查询走 (user_id, played_at) 复合索引。
 def records():
     if current_user.is_admin:
         abort(403)
@@ -384,10 +842,16 @@ def records():
     days = request.args.get("days", type=int)
     start = request.args.get("start")
     end = request.args.get("end")
-    page = int(request.args.get("page", 1))
     per_page = 50
-    listen_q = ListenRecord.query.filter(ListenRecord.user_id == current_user.id)
-    room_q = RoomParticipationRecord.query.filter(RoomParticipationRecord.user_id == current_user.id)
+    # 保留窗口之外的记录等待后台清理，期间也不再展示
+    window_start = datetime.utcnow() - timedelta(days=current_app.config["LISTEN_RECORD_WINDOW_DAYS"])
+    listen_q = ListenRecord.query.filter(
+        ListenRecord.user_id == current_user.id, ListenRecord.played_at >= window_start
+    )
+    room_q = RoomParticipationRecord.query.filter(
+        RoomParticipationRecord.user_id == current_user.id,
+        RoomParticipationRecord.participated_at >= window_start,
+    )
 
     if days:
         cutoff = datetime.utcnow() - timedelta(days=days)
@@ -409,115 +873,432 @@ def records():
             except Exception:
                 pass
 
-    listen_records = listen_q.order_by(ListenRecord.played_at.desc()).limit(per_page).offset((page - 1) * per_page).all()
-    room_records = room_q.order_by(RoomParticipationRecord.participated_at.desc()).limit(per_page).offset((page - 1) * per_page).all()
-    return render_template("records.html", listen_records=listen_records, room_records=room_records, page=page)
+    # 两个列表各自一个游标，互不影响
+    listen_page = paginate(
+        listen_q, ListenRecord.played_at, ListenRecord.id,
+        cursor=request.args.get("listen_cursor"), per_page=per_page,
+    )
+    room_page = paginate(
+        room_q, RoomParticipationRecord.participated_at, RoomParticipationRecord.id,
+        cursor=request.args.get("room_cursor"), per_page=per_page,
+    )
+    return render_template(
+        "records.html",
+        listen_records=listen_page.items,
+        room_records=room_page.items,
+        listen_page=listen_page,
+        room_page=room_page,
+    )
+
+
 
+def _poll_after_ms(snapshot: RoomSnapshot) -> int:
+    """建议客户端多久后再轮询：刚有变化时加密，播放中常规，暂停、空闲、打烊的房间逐级放缓。"""
+    config = current_app.config
+    if not snapshot.is_active:
+        return config["ROOM_POLL_CLOSED_MS"]
+    quiet = (datetime.utcnow() - snapshot.changed_at).total_seconds() if snapshot.changed_at else None
+    if quiet is not None and quiet < config["ROOM_POLL_BURST_SECONDS"]:
+        return config["ROOM_POLL_BURST_MS"]
+    if snapshot.playback_status == "playing":
+        return config["ROOM_POLL_PLAYING_MS"]
+    if quiet is None or quiet >= config["ROOM_POLL_IDLE_AFTER_SECONDS"]:
+        return config["ROOM_POLL_IDLE_MS"]
+    return config["ROOM_POLL_PAUSED_MS"]
 
 
 @main_bp.route("/rooms/<code>/state")
 @login_required
 def room_state(code):
-    room = Room.query.filter_by(code=code).first_or_404()
-    if not room.is_active and room.owner_id != current_user.id:
+    """房间状态轮询接口。
+
+    支持增量模式：客户端带上 since_version / since_message_id，
+    版本未变化时直接返回 304；否则只返回新消息，歌单仅在变化后下发。
+    同时支持标准的 ETag / If-None-Match 协商。
+    命中房间状态缓存时整个请求不访问数据库。
+    建议的下次轮询间隔放在 X-Poll-After 头（毫秒）里，304 响应同样携带。
+    """
+    snapshot = room_cache.get(code)
+    if snapshot is None:
+        snapshot = _load_room_snapshot(code)
+        if snapshot is None:
+            abort(404)
+        room_cache.put(code, snapshot)
+    if not snapshot.is_active and snapshot.owner_id != current_user.id:
         abort(403)
 
-    # 1. 智能进度计算
-    current_pos = room.current_position
-    if room.playback_status == 'playing' and room.updated_at:
-        # room.updated_at 可能是 naive（按 UTC 存储），为安全起见将其视为 UTC
-        if room.updated_at.tzinfo is None:
-            updated_at_utc = room.updated_at.replace(tzinfo=timezone.utc)
-        else:
-            updated_at_utc = room.updated_at.astimezone(timezone.utc)
-        elapsed = (datetime.now(timezone.utc) - updated_at_utc).total_seconds()
-        current_pos += elapsed
-    current_member_count = RoomMember.query.filter_by(room_id=room.id).count() + 1
-    # 2. 聊天记录 (修复：必须返回 messages 字段)
-    recent_msgs = RoomMessage.query.filter_by(room_id=room.id) \
-        .order_by(RoomMessage.created_at.desc()) \
-        .limit(50).all()
-    recent_msgs.reverse()
-    messages_data = [{
-        "id": m.id,
-        "author_id": m.author.id,
-        "author_name": m.author.nickname or m.author.username,
-        "author_avatar": m.author.avatar_url,
-        "created_at": format_datetime(m.created_at, '%H:%M'),
-        "content": m.content
-    } for m in recent_msgs]
-
-    # 3. 播放列表 (修复：必须返回 playlist 字段)
-    playlist_items = RoomPlaylist.query.filter_by(room_id=room.id) \
-        .order_by(RoomPlaylist.created_at.asc()).all()
-    playlist_data = [{
-        "id": item.id,
-        "music_id": item.music.id,
-        "title": item.music.title
-    } for item in playlist_items]
-
-    updated_iso = format_datetime(room.updated_at, None) if room.updated_at else None
-    
-    return jsonify({
-        "playback_status": room.playback_status,
-        "current_track_name": room.current_track_name,
-        "current_track_file": room.current_track_file,
-        "current_position": current_pos,
-        "is_active": room.is_active,
-        "updated_at": updated_iso,
-        "messages": messages_data,  # 确保前端能收到消息
-        "playlist": playlist_data,  # 确保前端能收到歌单
-        "member_count": current_member_count
-    })
+    _touch_presence(code)
+    presence_version = presence.version(code)
+    since_version = request.args.get("since_version", type=int)
+    since_message_id = request.args.get("since_message_id", type=int)
+    since_presence = request.args.get("since_presence", type=int)
+    etag = f"{code}-{snapshot.state_version}-{presence_version}"
+    presence_unchanged = since_presence is None or since_presence == presence_version
+    poll_after = _poll_after_ms(snapshot)
+    if (since_version == snapshot.state_version and presence_unchanged) or request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        response.headers["X-Poll-After"] = str(poll_after)
+        return response
+
+    # 聊天记录：增量模式下只取客户端尚未收到的消息
+    messages = list(snapshot.messages)
+    if since_message_id:
+        messages = [m for m in messages if m["id"] > since_message_id]
+
+    payload = {
+        "version": snapshot.state_version,
+        "playlist_version": snapshot.playlist_version,
+        **_playback_payload(snapshot),
+        "messages": messages,
+        "member_count": presence.count(code),
+        "presence_version": presence_version,
+        "poll_after_ms": poll_after,
+    }
+    # 在线列表只在成员进出后下发
+    if since_presence != presence_version:
+        payload["online"] = presence.members(code)
+    # 播放列表：客户端已持有的版本不早于歌单最近一次变化时跳过
+    if since_version is None or snapshot.playlist_version > since_version:
+        payload["playlist"] = snapshot.playlist
+
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Poll-After"] = str(poll_after)
+    return response
+
+
+@main_bp.route("/time")
+@login_required
+def server_time():
+    """NTP 式对时：t1 为收到请求的服务端时刻，t2 为发出响应的时刻（毫秒）。
 
+    客户端据 (t0, t1, t2, t3) 计算 offset = ((t1 - t0) + (t2 - t3)) / 2，
+    RTT = (t3 - t0) - (t2 - t1)，取多次采样中 RTT 最小的一次。
+    """
+    received = _server_time_ms()
+    response = jsonify({"t0": request.args.get("t0", type=float), "t1": received, "t2": _server_time_ms()})
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
-@main_bp.route("/rooms/<code>/toggle", methods=["POST"])
+
+@main_bp.route("/rooms/<code>/events")
 @login_required
-def toggle_playback(code):
+def room_events(code):
+    """SSE 推送通道：只推送“某部分有变化”的信号，客户端收到后走增量轮询接口拉取。"""
     room = Room.query.filter_by(code=code).first_or_404()
-    if room.owner_id != current_user.id:
+    is_owner = room.owner_id == current_user.id
+    if not room.is_active and not is_owner:
         abort(403)
+    heartbeat = current_app.config["ROOM_EVENTS_HEARTBEAT_SECONDS"]
+    version = room.state_version
+    subscription = broker.subscribe(code)
+    identity = _presence_identity()
 
-    music_id = request.form.get("music_id")
-    action = request.form.get("action")
+    # 生成器运行时请求上下文已结束，这里不能再访问 db / current_user
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            yield format_sse("hello", {"version": version})
+            while True:
+                # 连接保持期间每次唤醒都算一次心跳，保活间隔须小于 PRESENCE_TTL_SECONDS
+                presence.touch(code, *identity)
+                try:
+                    event, data = subscription.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event, data)
+                if event == "deleted":
+                    break
+                if event == "availability" and not data.get("is_active") and not is_owner:
+                    break
+        finally:
+            broker.unsubscribe(code, subscription)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    try:
-        position = request.form.get("position", type=float)
-    except (ValueError, TypeError):
-        position = None
 
-    # 1. 切歌逻辑
+def _apply_playback_command(
+    room: Room, user_id: int, *, action=None, music_id=None, item_id=None, position=None, duration=None
+):
+    """房主播放控制（HTTP 表单与 WebSocket 共用），返回错误信息或 None。
+
+    调用方负责权限校验；成功时已 commit 并向房间广播。
+    """
+    # 0. 播完切下一首 / 回填时长：都以当前歌单条目为准，不依赖歌名匹配
+    if action == "next":
+        _advance_room(room.id, item_id)
+        return None
+    if action == "duration":
+        if duration and duration > 0 and room.current_item is not None:
+            music = room.current_item.music
+            if music.duration is None:
+                music.duration = float(duration)
+                db.session.commit()
+                scheduler.schedule_room(room, music.duration)
+        return None
+
+    # 1. 切歌逻辑：优先按歌单条目定位，旧表单只带 music_id 时取歌单里第一条匹配
+    item = None
+    if item_id:
+        item = db.session.get(RoomPlaylist, item_id)
+        if item is None or item.room_id != room.id:
+            return "歌单中没有这首歌"
+        music_id = item.music_id
+    elif music_id:
+        item = RoomPlaylist.query.filter_by(room_id=room.id, music_id=music_id) \
+            .order_by(RoomPlaylist.created_at.asc()).first()
     if music_id:
-        music = Music.query.get(music_id)
-        if music and music.status == "approved":
-            room.current_track_name = music.title
-            room.current_track_file = music.stored_filename
-            room.playback_status = "playing"
-            room.current_position = 0.0
-            room.updated_at = datetime.utcnow()
-            db.session.add(ListenRecord(user_id=current_user.id, song_name=music.title))
-        else:
-            flash("无法播放该歌曲", "error")
+        music = db.session.get(Music, music_id)
+        if not music or music.status != "approved":
+            return "无法播放该歌曲"
+        room.current_playlist_item_id = item.id if item else None
+        room.current_track_name = music.title
+        room.current_track_file = music.stored_filename
+        room.playback_status = "playing"
+        room.current_position = 0.0
+        room.updated_at = datetime.utcnow()
+        write_behind.add(ListenRecord, user_id=user_id, song_name=music.title)
 
-    # 2. 播放/暂停/停止逻辑
-    elif action in {"play", "pause", "stop"}:
+    # 2. 播放/暂停/停止/跳转逻辑
+    elif action in {"play", "pause", "stop", "seek"}:
         if action == "stop":
             # 【新增】播放结束或清空状态
             room.playback_status = "paused"
+            room.current_playlist_item_id = None
             room.current_track_name = None  # 清空歌名
             room.current_track_file = None  # 清空文件
             room.current_position = 0.0
         else:
-            room.playback_status = "playing" if action == "play" else "paused"
+            if action != "seek":
+                room.playback_status = "playing" if action == "play" else "paused"
             if position is not None and position >= 0:
                 room.current_position = position
 
         room.updated_at = datetime.utcnow()
+    else:
+        return "未知操作"
+
+    room.bump_version()
+    db.session.commit()
+    _notify_room(room, "playback")
+    return None
+
+
+def _next_playlist_item(room_id: int, item_id: int | None) -> RoomPlaylist | None:
+    """歌单中排在 item_id 之后的条目（按加入时间、ID 排序）。"""
+    if item_id is None:
+        return None
+    current = db.session.get(RoomPlaylist, item_id)
+    if current is None or current.room_id != room_id:
+        return None
+    return (
+        RoomPlaylist.query.options(joinedload(RoomPlaylist.music))
+        .filter(RoomPlaylist.room_id == room_id)
+        .filter(
+            db.or_(
+                RoomPlaylist.created_at > current.created_at,
+                db.and_(RoomPlaylist.created_at == current.created_at, RoomPlaylist.id > current.id),
+            )
+        )
+        .order_by(RoomPlaylist.created_at.asc(), RoomPlaylist.id.asc())
+        .first()
+    )
+
+
+def _advance_room(room_id: int, from_item_id: int | None, anchor: datetime | None = None) -> bool:
+    """切到 from_item_id 的下一首；没有下一首则停止。
+
+    用条件 UPDATE 做 CAS：当前条目（以及排程时记录的播放锚点）未变化才生效，
+    房主客户端的 ended 事件与各进程的排程器同时触发时只有一方成功。
+    """
+    room = db.session.get(Room, room_id)
+    if room is None or room.current_playlist_item_id != from_item_id:
+        return False
+    next_item = _next_playlist_item(room_id, from_item_id)
+    now = datetime.utcnow()
+    if next_item is not None:
+        values = {
+            Room.current_playlist_item_id: next_item.id,
+            Room.current_track_name: next_item.music.title,
+            Room.current_track_file: next_item.music.stored_filename,
+            Room.playback_status: "playing",
+        }
+    else:
+        values = {
+            Room.current_playlist_item_id: None,
+            Room.current_track_name: None,
+            Room.current_track_file: None,
+            Room.playback_status: "paused",
+        }
+    values.update({
+        Room.current_position: 0.0,
+        Room.updated_at: now,
+        Room.state_version: Room.state_version + 1,
+    })
+    claim = Room.query.filter(Room.id == room_id)
+    claim = claim.filter(
+        Room.current_playlist_item_id.is_(None)
+        if from_item_id is None
+        else Room.current_playlist_item_id == from_item_id
+    )
+    if anchor is not None:
+        claim = claim.filter(Room.updated_at == anchor)
+    if not claim.update(values, synchronize_session=False):
+        db.session.rollback()
+        return False
+    if next_item is not None:
+        write_behind.add(ListenRecord, user_id=room.owner_id, song_name=next_item.music.title)
+    db.session.commit()
+    db.session.refresh(room)
+    _notify_room(room, "playback")
+    return True
+
+
+def _same_origin() -> bool:
+    # WebSocket 握手不受 CSRF 令牌保护，只接受同源页面发起的连接
+    origin = request.headers.get("Origin")
+    if not origin:
+        return True
+    return origin.split("://", 1)[-1] == request.host
+
+
+def _socket_event(event: str, data: dict) -> str:
+    return json.dumps({"t": "ev", "e": event, **data}, ensure_ascii=False, separators=(",", ":"))
 
+
+def _frame_number(value) -> float | None:
+    """上行帧中的数值字段；JSON 的 true/false（bool 是 int 的子类）与 NaN、无穷大都视为缺失。"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        return None
+    return value
+
+
+def _frame_id(value) -> int | None:
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _handle_socket_frame(room_id: int, user_id: int, raw: str) -> dict | None:
+    """处理客户端上行帧，返回需要单独回给该连接的应答（广播由业务函数完成）。
+
+    上行格式：
+      {"t": "ctl", "a": "play|pause|stop|seek|switch|next|duration",
+       "p": 位置秒数, "m": 音乐 ID, "i": 歌单条目 ID, "d": 时长秒数}
+      {"t": "msg", "c": "聊天内容"}
+      {"t": "ping", "c0": 客户端发送时刻毫秒}
+    """
+    try:
+        frame = json.loads(raw)
+    except (TypeError, ValueError):
+        return {"t": "err", "c": "bad_frame"}
+    if not isinstance(frame, dict):
+        return {"t": "err", "c": "bad_frame"}
+    kind = frame.get("t")
+    if kind == "ping":
+        # 兼作时钟同步：回显客户端发送时刻 c0，附带服务端时刻 s
+        return {"t": "pong", "c0": _frame_number(frame.get("c0")), "s": _server_time_ms()}
+
+    room = db.session.get(Room, room_id)
+    if room is None:
+        return {"t": "err", "c": "room_gone"}
+    is_owner = room.owner_id == user_id
+    if not room.is_active and not is_owner:
+        return {"t": "err", "c": "room_closed"}
+
+    if kind == "ctl":
+        if not is_owner:
+            return {"t": "err", "c": "forbidden"}
+        action = frame.get("a")
+        music_id = _frame_id(frame.get("m")) if action == "switch" else None
+        item_id = _frame_id(frame.get("i")) if action in {"switch", "next"} else None
+        if action == "switch" and music_id is None and item_id is None:
+            return {"t": "err", "c": "bad_frame"}
+        error = _apply_playback_command(
+            room,
+            user_id,
+            action=None if action == "switch" else action,
+            music_id=music_id,
+            item_id=item_id,
+            position=_frame_number(frame.get("p")),
+            duration=_frame_number(frame.get("d")),
+        )
+        return {"t": "err", "c": error} if error else None
+    if kind == "msg":
+        content = str(frame.get("c") or "").strip()
+        if not content:
+            return {"t": "err", "c": "内容不能为空"}
+        _post_message(room, user_id, content)
+        return None
+    return {"t": "err", "c": "bad_frame"}
+
+
+def _post_message(room: Room, user_id: int, content: str) -> RoomMessage:
+    message = RoomMessage(room_id=room.id, user_id=user_id, content=content)
+    db.session.add(message)
+    room.bump_version()
     db.session.commit()
+    _notify_room(room, "message", message=_message_payload(message))
+    return message
+
+
+@main_bp.route("/rooms/<code>/toggle", methods=["POST"])
+@login_required
+def toggle_playback(code):
+    room = Room.query.filter_by(code=code).first_or_404()
+    if room.owner_id != current_user.id:
+        abort(403)
+
+    try:
+        position = request.form.get("position", type=float)
+    except (ValueError, TypeError):
+        position = None
+
+    error = _apply_playback_command(
+        room,
+        current_user.id,
+        action=request.form.get("action"),
+        music_id=request.form.get("music_id", type=int),
+        item_id=request.form.get("item_id", type=int),
+        position=position,
+        duration=request.form.get("duration", type=float),
+    )
+    if error:
+        flash(error, "error")
     return jsonify({"status": "success"})
 
 
+def _message_history(room_id: int, cursor: str | None, per_page: int = ROOM_MESSAGES_PER_PAGE):
+    """从新到旧的一页聊天记录；next_cursor 指向更早的一页。"""
+    return paginate(
+        RoomMessage.query.options(joinedload(RoomMessage.author)).filter_by(room_id=room_id),
+        RoomMessage.created_at,
+        RoomMessage.id,
+        cursor=cursor,
+        per_page=per_page,
+    )
+
+
+@main_bp.route("/rooms/<code>/messages", methods=["GET"])
+@login_required
+def message_history(code):
+    """聊天记录向前翻页：before 为上一次返回的游标，消息按时间正序返回，便于直接插到列表顶部。"""
+    room = Room.query.filter_by(code=code).first_or_404()
+    if not room.is_active and room.owner_id != current_user.id:
+        abort(403)
+    per_page = min(request.args.get("limit", ROOM_MESSAGES_PER_PAGE, type=int), ROOM_MESSAGES_PER_PAGE)
+    page = _message_history(room.id, request.args.get("before"), max(per_page, 1))
+    return jsonify({
+        "messages": [_message_payload(message) for message in reversed(page.items)],
+        "next_cursor": page.next_cursor,
+    })
+
+
 @main_bp.route("/rooms/<code>/messages", methods=["POST"])
 @login_required
 def send_message(code):
@@ -525,12 +1306,94 @@ def send_message(code):
     content = request.form.get("content", "").strip()
     if not content:
         return jsonify({"error": "内容不能为空"}), 400
-    message = RoomMessage(room_id=room.id, user_id=current_user.id, content=content)
-    db.session.add(message)
-    db.session.commit()
+    _post_message(room, current_user.id, content)
     return jsonify({"status": "success"})
 
 
+if sock is not None:
+
+    @sock.route("/rooms/<code>/ws", bp=main_bp)
+    def room_socket(ws, code):
+        """房间双向通道：房主控制与成员聊天走同一条长连接，服务端变更直接扇出。
+
+        鉴权规则与表单接口一致：仅房主可控制播放，已关闭的房间拒绝非房主连接。
+        """
+        if not current_user.is_authenticated or current_user.is_admin or not _same_origin():
+            ws.close(reason=1008, message="forbidden")
+            return
+        room = Room.query.filter_by(code=code).first()
+        if room is None:
+            ws.close(reason=1008, message="room_gone")
+            return
+        is_owner = room.owner_id == current_user.id
+        if not room.is_active and not is_owner:
+            ws.close(reason=1008, message="room_closed")
+            return
+        room_id, user_id = room.id, current_user.id
+        identity = _presence_identity()
+        heartbeat = current_app.config["ROOM_EVENTS_HEARTBEAT_SECONDS"]
+        subscription = broker.subscribe(code)
+        ws.send(json.dumps({"t": "hello", "v": room.state_version}))
+        db.session.close()
+
+        # 上行帧走独立的队列：广播队列满时会丢弃最旧的事件，客户端指令与聊天不能被挤掉。
+        # 读线程放入上行帧后再往广播队列投一个唤醒标记；标记即使因队列满被丢弃，
+        # 此时广播队列非空，处理循环每一轮都会先检查上行队列，不会漏掉指令。
+        inbound = queue.Queue(maxsize=100)
+        finished = threading.Event()
+
+        def enqueue(item):
+            # 处理跟不上时阻塞读线程，由 TCP 对客户端形成背压；处理循环退出后不再等待
+            while not finished.is_set():
+                try:
+                    inbound.put(item, timeout=1)
+                    break
+                except queue.Full:
+                    continue
+            try:
+                subscription.put_nowait(("_wake", None))
+            except queue.Full:
+                pass
+
+        def pump():
+            try:
+                while True:
+                    enqueue(("_frame", ws.receive()))
+            except Exception:
+                pass
+            enqueue(("_closed", None))
+
+        threading.Thread(target=pump, daemon=True).start()
+        try:
+            while True:
+                presence.touch(code, *identity)
+                try:
+                    event, data = inbound.get_nowait()
+                except queue.Empty:
+                    try:
+                        event, data = subscription.get(timeout=heartbeat)
+                    except queue.Empty:
+                        continue
+                if event == "_wake":
+                    continue
+                if event == "_closed":
+                    break
+                if event == "_frame":
+                    reply = _handle_socket_frame(room_id, user_id, data)
+                    db.session.close()
+                    if reply:
+                        ws.send(json.dumps(reply, ensure_ascii=False))
+                    continue
+                ws.send(_socket_event(event, data))
+                if event == "deleted":
+                    break
+                if event == "availability" and not data.get("is_active") and not is_owner:
+                    break
+        finally:
+            finished.set()
+            broker.unsubscribe(code, subscription)
+
+
 @main_bp.route("/rooms/<code>/playlist/delete", methods=["POST"])
 @login_required
 def delete_from_playlist(code):
@@ -542,7 +1405,9 @@ def delete_from_playlist(code):
         entry = RoomPlaylist.query.get(item_id)
         if entry and entry.room_id == room.id:
             db.session.delete(entry)
+            room.bump_version(playlist=True)
             db.session.commit()
+            _notify_room(room, "playlist")
     return jsonify({"status": "success"})
 
 
@@ -0,0 +1,145 @@
+"""服务端播放排程：按曲目时长在时间轮上登记“播完”时刻，到点自动切到歌单下一首。"""
+import threading
+import time
+from datetime import timezone
+
+
+class TimerWheel:
+    """单层哈希时间轮：固定粒度的槽位环，登记 / 取消都是 O(1)。
+
+    超过一圈的定时记录剩余圈数，每转到该槽位减一；同一 key 重复登记会覆盖旧定时。
+    """
+
+    def __init__(self, slots: int = 512, tick: float = 1.0):
+        self.slots = slots
+        self.tick = tick
+        self._buckets: list[dict] = [{} for _ in range(slots)]
+        self._index: dict = {}
+        self._cursor = 0
+
+    def schedule(self, key, delay: float, payload=None) -> None:
+        self.cancel(key)
+        ticks = max(1, int(-(-delay // self.tick)))  # 向上取整，至少等一个 tick
+        slot = (self._cursor + ticks) % self.slots
+        rounds = (ticks - 1) // self.slots
+        self._buckets[slot][key] = [rounds, payload]
+        self._index[key] = slot
+
+    def cancel(self, key) -> None:
+        slot = self._index.pop(key, None)
+        if slot is not None:
+            self._buckets[slot].pop(key, None)
+
+    def advance(self) -> list[tuple]:
+        """前进一个 tick，返回到期的 (key, payload)。"""
+        self._cursor = (self._cursor + 1) % self.slots
+        bucket = self._buckets[self._cursor]
+        expired = []
+        for key, entry in list(bucket.items()):
+            if entry[0] > 0:
+                entry[0] -= 1
+                continue
+            del bucket[key]
+            self._index.pop(key, None)
+            expired.append((key, entry[1]))
+        return expired
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+class PlaybackScheduler:
+    """所有活跃房间共用一个时间轮和一个后台线程。
+
+    到期回调 advance(room_id, item_id, anchor) 由业务层提供，需要自行做 CAS 校验：
+    多进程部署时每个进程都会排程，同一首歌只会有一个进程切歌成功。
+    """
+
+    def __init__(self):
+        self.app = None
+        self._advance = None
+        self._wheel = TimerWheel()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def init_app(self, app, advance) -> None:
+        self.app = app
+        self._advance = advance
+        self._wheel = TimerWheel(
+            slots=app.config["PLAYBACK_SCHEDULER_SLOTS"],
+            tick=app.config["PLAYBACK_SCHEDULER_TICK"],
+        )
+        if app.config["PLAYBACK_SCHEDULER_ENABLED"] and not app.testing:
+            self.start()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="playback-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def schedule_room(self, room, duration: float | None) -> None:
+        """播放状态变化后调用：播放中且时长已知则登记到点切歌，否则取消。"""
+        if (
+            room.playback_status != "playing"
+            or not room.is_active
+            or not duration
+            or room.current_playlist_item_id is None
+            or room.updated_at is None
+        ):
+            self.cancel_room(room.id)
+            return
+        anchor = room.updated_at
+        started = anchor.replace(tzinfo=timezone.utc).timestamp() - (room.current_position or 0.0)
+        remaining = started + duration - time.time()
+        with self._lock:
+            self._wheel.schedule(room.id, remaining, (room.current_playlist_item_id, anchor))
+
+    def cancel_room(self, room_id: int) -> None:
+        with self._lock:
+            self._wheel.cancel(room_id)
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._wheel)
+
+    def _run(self) -> None:
+        with self.app.app_context():
+            self._bootstrap()
+        next_tick = time.monotonic() + self._wheel.tick
+        while not self._stopped.wait(max(0.0, next_tick - time.monotonic())):
+            next_tick += self._wheel.tick
+            with self._lock:
+                expired = self._wheel.advance()
+            for room_id, (item_id, anchor) in expired:
+                with self.app.app_context():
+                    try:
+                        self._advance(room_id, item_id, anchor)
+                    except Exception:
+                        self.app.logger.exception("自动切歌失败 room_id=%s", room_id)
+
+    def _bootstrap(self) -> None:
+        # 进程启动时把正在播放的房间补登记到时间轮上
+        from .models import Music, Room, RoomPlaylist
+        from . import db
+
+        rows = (
+            db.session.query(Room, Music.duration)
+            .join(RoomPlaylist, RoomPlaylist.id == Room.current_playlist_item_id)
+            .join(Music, Music.id == RoomPlaylist.music_id)
+            .filter(Room.playback_status == "playing", Room.is_active.is_(True))
+            .all()
+        )
+        for room, duration in rows:
+            self.schedule_room(room, duration)
+
+
+scheduler = PlaybackScheduler()
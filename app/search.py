@@ -0,0 +1,59 @@
+"""曲库全文检索：SQLite FTS5 trigram 索引覆盖已审核曲目的标题与原始文件名。
+
+索引表 music_search 以 musics.id 为 rowid，带 user_id 以便在索引内按用户过滤；
+由迁移 4 建立的触发器随 musics 的增删改自动同步，上传、审核、驳回、删除等代码路径无需各自维护。trigram 分词对中文同样按子串匹配；
+不足 3 个字符的查询无法走 trigram，退回到按用户过滤后的 LIKE，范围只是单个用户的曲库。
+"""
+from sqlalchemy import text
+
+from . import db
+from .models import Music
+
+SEARCH_RESULT_LIMIT = 20
+
+_fts_available = None
+
+
+def fts_available() -> bool:
+    """索引表是否存在（SQLite 未编译 FTS5 时迁移会跳过建表）；结果按进程缓存。"""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = bool(
+            db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'music_search'")
+            ).first()
+        ) if db.engine.dialect.name == "sqlite" else False
+    return _fts_available
+
+
+def _phrase(query: str) -> str:
+    # 整体作为一个短语匹配，用户输入里的引号、运算符都不会被解释为 FTS 语法
+    return '"' + query.replace('"', '""') + '"'
+
+
+def search_library(user_id: int, query: str, limit: int = SEARCH_RESULT_LIMIT) -> list[Music]:
+    """用户自己已审核曲目中与 query 匹配的结果，按相关度排序；query 为空时返回最近上传的曲目。"""
+    query = " ".join(query.split())
+    base = Music.query.filter(Music.user_id == user_id, Music.status == "approved")
+    if not query:
+        return base.order_by(Music.uploaded_at.desc(), Music.id.desc()).limit(limit).all()
+    if len(query) >= 3 and fts_available():
+        # 标题命中的权重高于文件名；user_id 为 UNINDEXED 列，只参与过滤
+        rows = db.session.execute(
+            text(
+                "SELECT rowid FROM music_search WHERE music_search MATCH :phrase AND user_id = :user_id "
+                "ORDER BY bm25(music_search, 10.0, 1.0, 0.0) LIMIT :limit"
+            ),
+            {"phrase": _phrase(query), "user_id": user_id, "limit": limit},
+        ).scalars().all()
+        if not rows:
+            return []
+        ranked = {music.id: music for music in base.filter(Music.id.in_(rows)).all()}
+        return [ranked[row] for row in rows if row in ranked]
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return (
+        base.filter(db.or_(Music.title.like(pattern, escape="\\"), Music.original_filename.like(pattern, escape="\\")))
+        .order_by(Music.uploaded_at.desc(), Music.id.desc())
+        .limit(limit)
+        .all()
+    )
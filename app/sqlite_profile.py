@@ -0,0 +1,48 @@
+"""SQLite 引擎配置：连接池参数与每个新连接上执行的 PRAGMA。
+
+WAL 模式下读写互不阻塞，大量轮询读不再被聊天 / 播放控制的写事务串行化；
+busy_timeout 让偶发的写写冲突排队等待，而不是立刻报 database is locked。
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+def is_file_sqlite(uri: str) -> bool:
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def configure(app) -> None:
+    """须在 db.init_app 之前调用，把连接池参数写入 SQLALCHEMY_ENGINE_OPTIONS。"""
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config)
+
+
+def engine_options(config) -> dict:
+    """按配置生成 SQLALCHEMY_ENGINE_OPTIONS；内存库或非 SQLite 时保持原样。"""
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    if not is_file_sqlite(str(config["SQLALCHEMY_DATABASE_URI"])):
+        return options
+    options.setdefault("pool_size", config["SQLITE_POOL_SIZE"])
+    options.setdefault("max_overflow", config["SQLITE_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", config["SQLITE_POOL_TIMEOUT"])
+    connect_args = dict(options.get("connect_args") or {})
+    # 驱动层超时与 busy_timeout 保持一致（秒）
+    connect_args.setdefault("timeout", config["SQLITE_PRAGMAS"].get("busy_timeout", 5000) / 1000)
+    connect_args.setdefault("check_same_thread", False)
+    options["connect_args"] = connect_args
+    return options
+
+
+def apply_pragmas(engine, pragmas: dict) -> None:
+    """在每个新建的 DBAPI 连接上执行 PRAGMA（连接池复用的连接只执行一次）。"""
+    if not pragmas or engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
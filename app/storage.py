@@ -0,0 +1,184 @@
+"""内容寻址的音乐存储：文件按 SHA-256 命名只存一份，Music 行即引用，引用数归零时删除文件。"""
+import hashlib
+import os
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from flask import current_app
+
+from . import db
+from .mp3 import Mp3Info, scan_mp3
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+def music_folder() -> Path:
+    return Path(current_app.config["MUSIC_FOLDER"])
+
+
+class _TeeReader:
+    """读取上游流的同时计算摘要并写入临时文件，扫描、哈希、落盘共用一次读取。"""
+
+    def __init__(self, stream, sink=None, hasher=None):
+        self.stream = stream
+        self.sink = sink
+        self.hasher = hasher
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        if data:
+            if self.hasher is not None:
+                self.hasher.update(data)
+            if self.sink is not None:
+                self.sink.write(data)
+        return data
+
+    def drain(self) -> None:
+        while self.read(_CHUNK_SIZE):
+            pass
+
+
+@dataclass
+class StagedMusic:
+    """已写入临时文件、尚未发布到内容地址的上传。"""
+
+    temp_path: Path
+    digest: str
+    info: Mp3Info
+
+    @property
+    def stored_name(self) -> str:
+        return f"{self.digest}.mp3"
+
+    def publish(self) -> None:
+        """移动到内容地址；须在插入引用它的 Music 行之后、提交之前调用。
+
+        SQLite 同一时刻只有一个写事务，发布与 release() 的“计数 + 删除”因此不会交错：
+        要么删除方先删完、这里重新放回文件，要么删除方能数到这条新引用。
+        同名文件已存在时内容必然相同，覆盖也无妨，用 os.replace 保证原子性。
+        """
+        os.replace(self.temp_path, music_folder() / self.stored_name)
+
+    def discard(self) -> None:
+        self.temp_path.unlink(missing_ok=True)
+
+
+def stage_upload(stream) -> StagedMusic:
+    """流式写入临时文件并同时扫描帧、计算摘要；内容无效时抛出 Mp3FormatError 且不留临时文件。"""
+    folder = music_folder()
+    folder.mkdir(parents=True, exist_ok=True)
+    # 临时文件与目标同目录，保证 os.replace 不跨文件系统
+    fd, temp_name = tempfile.mkstemp(dir=folder, prefix=".upload-", suffix=".part")
+    temp_path = Path(temp_name)
+    try:
+        with os.fdopen(fd, "wb") as sink:
+            tee = _TeeReader(stream, sink, hashlib.sha256())
+            info = scan_mp3(tee)
+            # 扫描器遇到尾部标签或残帧会提前停止，剩余字节照样要计入摘要并落盘
+            tee.drain()
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return StagedMusic(temp_path=temp_path, digest=tee.hasher.hexdigest(), info=info)
+
+
+def release(stored_name: str) -> bool:
+    """删除 Music 行的事务提交之后调用：没有其他引用时删除文件，返回是否删除。
+
+    提交失败时行仍在、文件也还在；提交之后再删，文件不会比引用它的行先消失。
+    复查引用与删除在 SQLite 写锁内完成，与 StagedMusic.publish()（flush 之后、提交之前）互斥：
+    复查时看不到的新引用，其文件要等这里释放写锁后才会被发布回来。
+    提交与删除之间进程退出留下的文件由 storage_gc 回收。
+    """
+    connection = db.engine.raw_connection()
+    dbapi = connection.driver_connection
+    isolation_level = dbapi.isolation_level
+    dbapi.isolation_level = None
+    try:
+        cursor = dbapi.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            referenced = cursor.execute(
+                "SELECT 1 FROM musics WHERE stored_filename = ? LIMIT 1", (stored_name,)
+            ).fetchone()
+            if referenced is None:
+                (music_folder() / stored_name).unlink(missing_ok=True)
+        finally:
+            cursor.execute("COMMIT")
+            cursor.close()
+    finally:
+        dbapi.isolation_level = isolation_level
+        connection.close()
+    return referenced is None
+
+
+# 分块上传的增量摘要：session_id -> (已哈希字节数, hasher)。
+# 只在本进程内有效；分块落到别的进程或中途乱序时，finalize 会整文件重新计算。
+_chunk_hashers: dict = {}
+_chunk_hashers_lock = threading.Lock()
+
+
+def chunk_path(session_id: str) -> Path:
+    return music_folder() / f".upload-{session_id}.part"
+
+
+def write_chunk(session_id: str, offset: int, stream, length: int) -> int:
+    """把请求体中的 length 字节写到临时文件 offset 处（覆盖其后内容），返回实际写入字节数。"""
+    path = chunk_path(session_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch(exist_ok=True)
+    with _chunk_hashers_lock:
+        state = _chunk_hashers.pop(session_id, None)
+    if state is not None and state[0] == offset:
+        hasher = state[1]
+    else:
+        hasher = hashlib.sha256() if offset == 0 else None
+    written = 0
+    with open(path, "r+b") as sink:
+        sink.seek(offset)
+        sink.truncate()
+        while written < length:
+            data = stream.read(min(_CHUNK_SIZE, length - written))
+            if not data:
+                break
+            sink.write(data)
+            if hasher is not None:
+                hasher.update(data)
+            written += len(data)
+    if hasher is not None:
+        with _chunk_hashers_lock:
+            _chunk_hashers[session_id] = (offset + written, hasher)
+    return written
+
+
+def forget_chunk_hash(session_id: str) -> None:
+    with _chunk_hashers_lock:
+        _chunk_hashers.pop(session_id, None)
+
+
+def probe_chunks(session_id: str) -> None:
+    """首个分块到达后提前校验帧结构，内容不对时不必等整文件传完；无效时抛出 Mp3FormatError。"""
+    with open(chunk_path(session_id), "rb") as source:
+        scan_mp3(source)
+
+
+def stage_chunks(session_id: str, total_size: int) -> StagedMusic:
+    """分块全部到达后扫描整文件并取得摘要，返回可发布的 StagedMusic；无效时抛出 Mp3FormatError。"""
+    path = chunk_path(session_id)
+    with _chunk_hashers_lock:
+        state = _chunk_hashers.pop(session_id, None)
+    incremental = state is not None and state[0] == total_size
+    with open(path, "rb") as source:
+        tee = _TeeReader(source, hasher=None if incremental else hashlib.sha256())
+        info = scan_mp3(tee)
+        if not incremental:
+            tee.drain()
+    digest = (state[1] if incremental else tee.hasher).hexdigest()
+    return StagedMusic(temp_path=path, digest=digest, info=info)
+
+
+def discard_chunks(session_id: str) -> None:
+    forget_chunk_hash(session_id)
+    chunk_path(session_id).unlink(missing_ok=True)
@@ -0,0 +1,265 @@
+"""上传目录的标记-清除回收：数据库里没有引用、且超过宽限期的文件才会被删除。
+
+标记阶段从数据库收集仍被引用的文件名：
+- 音乐：Music.stored_filename；已驳回的曲目超过 STORAGE_GC_REJECTED_DAYS 后不再算引用（行保留，
+  内容摘要仍用于拦截重复上传）；未过期的分块上传会话对应的 .upload-<id>.part。
+- 头像：User.avatar_path 原图与 avatar_key 的各尺寸缩略图。
+清除阶段只删除修改时间早于宽限期的文件，写入后尚未提交引用的新文件因此不会被误删。
+音乐文件在 SQLite 写锁内复查引用后再删除，与 StagedMusic.publish() 的发布互斥。
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import click
+from flask.cli import with_appcontext
+
+from .avatars import AVATAR_SIZES, variant_name
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"  # 与 SQLAlchemy 在 SQLite 中保存 DateTime 的格式一致
+
+
+@dataclass
+class SweepReport:
+    dry_run: bool = False
+    scanned: int = 0
+    removed: list[str] = field(default_factory=list)
+    freed_bytes: int = 0
+    within_grace: int = 0
+    expired_uploads: int = 0
+
+
+class StorageCollector:
+    """与 RetentionWorker 相同的运行方式：后台线程按间隔执行，flask storage-gc 可手动执行或试运行。"""
+
+    def __init__(self):
+        self.app = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._removed = 0
+        self._freed_bytes = 0
+
+    def init_app(self, app) -> None:
+        self.app = app
+        app.cli.add_command(storage_gc_command)
+        if app.config["STORAGE_GC_ENABLED"] and not app.testing:
+            self.start()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-gc", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {"runs": self._runs, "removed": self._removed, "freed_bytes": self._freed_bytes}
+
+    # ---- 标记 ----
+
+    def _rejected_cutoff(self) -> datetime | None:
+        days = self.app.config["STORAGE_GC_REJECTED_DAYS"]
+        return datetime.utcnow() - timedelta(days=days) if days else None
+
+    def _upload_cutoff(self) -> datetime:
+        return datetime.utcnow() - timedelta(hours=self.app.config["UPLOAD_SESSION_TTL_HOURS"])
+
+    def _live_music(self, dry_run: bool) -> tuple[set[str], int]:
+        from . import db
+        from .models import Music, UploadSession
+        from .storage import chunk_path, forget_chunk_hash
+
+        query = db.session.query(Music.stored_filename).distinct()
+        rejected_cutoff = self._rejected_cutoff()
+        if rejected_cutoff is not None:
+            query = query.filter(db.or_(Music.status != "rejected", Music.updated_at >= rejected_cutoff))
+        live = {name for (name,) in query}
+
+        # 过期的分块上传会话先删行，对应的临时文件随后按未引用处理
+        expired = UploadSession.query.filter(UploadSession.updated_at < self._upload_cutoff())
+        expired_ids = [session_id for (session_id,) in expired.with_entities(UploadSession.id)]
+        if expired_ids and not dry_run:
+            expired.delete(synchronize_session=False)
+            db.session.commit()
+            for session_id in expired_ids:
+                forget_chunk_hash(session_id)
+        active = UploadSession.query.filter(UploadSession.id.notin_(expired_ids))
+        live.update(chunk_path(session_id).name for (session_id,) in active.with_entities(UploadSession.id))
+        return live, len(expired_ids)
+
+    def _live_avatars(self) -> set[str]:
+        from . import db
+        from .models import User
+
+        live = set()
+        rows = db.session.query(User.avatar_path, User.avatar_key).filter(
+            db.or_(User.avatar_path.isnot(None), User.avatar_key.isnot(None))
+        )
+        for avatar_path, avatar_key in rows:
+            if avatar_path:
+                live.add(Path(avatar_path).name)
+            if avatar_key:
+                live.update(variant_name(avatar_key, size) for size in AVATAR_SIZES)
+        return live
+
+    # ---- 清除 ----
+
+    def _candidates(self, folder: Path, live: set[str], cutoff: float, report: SweepReport) -> list[Path]:
+        candidates = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                report.scanned += 1
+                if entry.name in live:
+                    continue
+                if entry.stat().st_mtime > cutoff:
+                    report.within_grace += 1
+                    continue
+                candidates.append(Path(entry.path))
+        return candidates
+
+    def _remove(self, path: Path, cutoff: float, report: SweepReport) -> None:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return
+        # 标记之后被重新写入（同内容再次上传、头像重新生成）的文件留到下一轮
+        if stat.st_mtime > cutoff:
+            report.within_grace += 1
+            return
+        if not report.dry_run:
+            path.unlink(missing_ok=True)
+        report.removed.append(path.name)
+        report.freed_bytes += stat.st_size
+
+    def _still_referenced(self, cursor, name: str, rejected_cutoff: datetime | None) -> bool:
+        if name.startswith(".upload-") and name.endswith(".part"):
+            session_id = name[len(".upload-"):-len(".part")]
+            row = cursor.execute(
+                "SELECT 1 FROM upload_sessions WHERE id = ? AND updated_at >= ?",
+                (session_id, self._upload_cutoff().strftime(_TIME_FORMAT)),
+            ).fetchone()
+            return row is not None
+        if rejected_cutoff is None:
+            sql, params = "SELECT 1 FROM musics WHERE stored_filename = ? LIMIT 1", (name,)
+        else:
+            sql = (
+                "SELECT 1 FROM musics WHERE stored_filename = ? "
+                "AND (status != 'rejected' OR updated_at >= ?) LIMIT 1"
+            )
+            params = (name, rejected_cutoff.strftime(_TIME_FORMAT))
+        return cursor.execute(sql, params).fetchone() is not None
+
+    def _sweep_music(self, candidates: list[Path], cutoff: float, report: SweepReport) -> None:
+        from . import db
+
+        batch_size = self.app.config["STORAGE_GC_BATCH_SIZE"]
+        rejected_cutoff = self._rejected_cutoff()
+        connection = db.engine.raw_connection()
+        dbapi = connection.driver_connection
+        isolation_level = dbapi.isolation_level
+        dbapi.isolation_level = None
+        try:
+            cursor = dbapi.cursor()
+            for start in range(0, len(candidates), batch_size):
+                if self._stopped.is_set():
+                    break
+                # 持有写锁期间没有上传能发布文件，复查引用后的删除不会与发布交错
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    for path in candidates[start:start + batch_size]:
+                        if not self._still_referenced(cursor, path.name, rejected_cutoff):
+                            self._remove(path, cutoff, report)
+                finally:
+                    cursor.execute("COMMIT")
+                self._stopped.wait(self.app.config["STORAGE_GC_BATCH_PAUSE"])
+            cursor.close()
+        finally:
+            dbapi.isolation_level = isolation_level
+            connection.close()
+
+    def _sweep_avatars(self, candidates: list[Path], cutoff: float, report: SweepReport) -> None:
+        batch_size = self.app.config["STORAGE_GC_BATCH_SIZE"]
+        for start in range(0, len(candidates), batch_size):
+            if self._stopped.is_set():
+                break
+            for path in candidates[start:start + batch_size]:
+                self._remove(path, cutoff, report)
+            self._stopped.wait(self.app.config["STORAGE_GC_BATCH_PAUSE"])
+
+    def collect(self, dry_run: bool = False) -> SweepReport:
+        """执行一轮回收；dry_run 时只统计将被删除的文件，不删文件也不删过期上传会话。"""
+        config = self.app.config
+        report = SweepReport(dry_run=dry_run)
+        cutoff = time.time() - config["STORAGE_GC_GRACE_HOURS"] * 3600
+        limit = config["STORAGE_GC_MAX_DELETES"]
+
+        music_live, report.expired_uploads = self._live_music(dry_run)
+        music = self._candidates(Path(config["MUSIC_FOLDER"]), music_live, cutoff, report)
+        avatars = self._candidates(Path(config["AVATAR_FOLDER"]), self._live_avatars(), cutoff, report)
+        # 单轮删除数量有上限，积压较多时分几轮完成，避免长时间占用磁盘 IO
+        music = music[:limit]
+        avatars = avatars[:max(0, limit - len(music))]
+        if music:
+            self._sweep_music(music, cutoff, report)
+        if avatars:
+            self._sweep_avatars(avatars, cutoff, report)
+
+        if not dry_run:
+            with self._lock:
+                self._runs += 1
+                self._removed += len(report.removed)
+                self._freed_bytes += report.freed_bytes
+        return report
+
+    def _run(self) -> None:
+        from . import db
+
+        interval = self.app.config["STORAGE_GC_INTERVAL_SECONDS"]
+        delay = interval
+        while not self._stopped.wait(delay):
+            with self.app.app_context():
+                try:
+                    report = self.collect()
+                except Exception:
+                    self.app.logger.exception("存储回收失败")
+                    continue
+                finally:
+                    db.session.remove()
+            if report.removed or report.expired_uploads:
+                self.app.logger.info(
+                    "存储回收完成：删除 %s 个文件，释放 %s 字节，清理过期上传会话 %s 个",
+                    len(report.removed),
+                    report.freed_bytes,
+                    report.expired_uploads,
+                )
+
+
+storage_collector = StorageCollector()
+
+
+@click.command("storage-gc")
+@click.option("--dry-run", is_flag=True, help="只列出将被删除的文件")
+@with_appcontext
+def storage_gc_command(dry_run):
+    """回收上传目录中没有引用的音乐与头像文件。"""
+    report = storage_collector.collect(dry_run=dry_run)
+    for name in report.removed:
+        click.echo(("将删除 " if dry_run else "已删除 ") + name)
+    click.echo(
+        f"扫描 {report.scanned} 个文件，{'可' if dry_run else '已'}释放 {report.freed_bytes} 字节；"
+        f"{report.within_grace} 个未引用文件仍在宽限期内；过期上传会话 {report.expired_uploads} 个"
+    )
@@ -1,34 +1,25 @@
 import random
-import string
-from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 from pathlib import Path
 
 from flask import current_app
 from werkzeug.utils import secure_filename
 
-FAILED_LOGIN_ATTEMPTS = defaultdict(list)
-LOCKOUT_SECONDS = 60
-MAX_FAILED_ATTEMPTS = 2
+from .mp3 import Mp3FormatError
+from .ratelimit import login_limiter
+from .storage import StagedMusic, stage_upload
 
 
-def can_attempt_login(username: str) -> bool:
-    now = datetime.utcnow()
-    attempts = [
-        ts for ts in FAILED_LOGIN_ATTEMPTS.get(username, []) if now - ts < timedelta(seconds=LOCKOUT_SECONDS)
-    ]
-    FAILED_LOGIN_ATTEMPTS[username] = attempts
-    if len(attempts) >= MAX_FAILED_ATTEMPTS:
-        return False
-    return True
+def can_attempt_login(username: str, ip: str | None = None) -> bool:
+    return login_limiter.allowed(username, ip)
 
 
-def record_failed_login(username: str) -> None:
-    FAILED_LOGIN_ATTEMPTS[username].append(datetime.utcnow())
+def record_failed_login(username: str, ip: str | None = None) -> None:
+    login_limiter.record_failure(username, ip)
 
 
 def clear_failed_logins(username: str) -> None:
-    FAILED_LOGIN_ATTEMPTS.pop(username, None)
+    login_limiter.reset(username)
 
 
 def _extract_extension(filename: str) -> str:
@@ -59,7 +50,8 @@ def save_avatar(file_storage) -> str | None:
     return stored_name
 
 
-def save_music(file_storage) -> tuple[str | None, str | None]:
+def save_music(file_storage) -> tuple[StagedMusic | None, str | None]:
+    """校验并暂存上传；成功时返回待发布的 StagedMusic，由调用方在插入 Music 行后 publish。"""
     if not file_storage:
         return (None, "请选择 MP3 文件")
     original_name = file_storage.filename or ""
@@ -77,9 +69,6 @@ def save_music(file_storage) -> tuple[str | None, str | None]:
             None,
             "文件内容不是标准 MP3，请导出为常见 MP3 再上传",
         )
-    filename = secure_filename(original_name)
-    if not filename:
-        filename = f"music.{ext}"
     file_storage.seek(0, 2)
     size_mb = file_storage.tell() / (1024 * 1024)
     file_storage.seek(0)
@@ -88,16 +77,23 @@ def save_music(file_storage) -> tuple[str | None, str | None]:
             None,
             f"当前文件约 {size_mb:.1f} MB，已超过 {current_app.config['MAX_MUSIC_FILE_MB']} MB 限制",
         )
-    timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
-    safe_stem = Path(filename).stem or "music"
-    stored_name = f"music_{timestamp}_{safe_stem}.{ext}"
-    path = Path(current_app.config["MUSIC_FOLDER"]) / stored_name
-    file_storage.save(path)
-    return stored_name, None
+    # 扩展名和 mimetype 都由客户端决定，只有帧结构可信；扫描、哈希与落盘在同一次读取中完成
+    try:
+        staged = stage_upload(file_storage.stream)
+    except Mp3FormatError:
+        return (None, "文件内容不是有效的 MP3 音频，请导出为常见 MP3 再上传")
+    return staged, None
 
 
-def generate_room_code() -> str:
-    return "".join(random.choices(string.digits, k=6))
+def format_datetime(value: datetime | None, fmt: str | None = "%Y-%m-%d %H:%M") -> str | None:
+    """格式化数据库时间；fmt 为 None 时输出带 UTC 时区的 ISO 字符串（数据库按 UTC naive 存储）。"""
+    if value is None:
+        return None
+    if fmt is None:
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+    return value.strftime(fmt)
 
 
 def generate_room_name() -> str:
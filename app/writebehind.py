@@ -0,0 +1,183 @@
+"""低优先级记录的延迟写入：听歌记录、房间参与记录等不影响当前请求结果的插入先进队列，
+由后台线程按条数或时间阈值合并成一个事务批量写入。
+
+请求路径上少一次（或更小的）事务提交；代价是这些记录最多延迟一个刷新间隔才可见，
+进程被强杀时队列中未刷新的记录会丢失，因此只用于可容忍丢失的统计类数据。
+"""
+import atexit
+import threading
+import time
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+
+class WriteBehindQueue:
+    """进程内队列 + 单个刷新线程；未启用（或测试环境）时退化为加入当前会话，随调用方一起提交。
+
+    批量写入违反约束时改为逐行写入，只丢弃有问题的行；锁超时等暂时性错误整批放回队首，
+    按指数退避重试，每条记录超过 max_retries 次仍未写入则丢弃。
+    """
+
+    def __init__(self):
+        self.app = None
+        self.batch_size = 200
+        self.interval = 1.0
+        self.max_pending = 5000
+        self.max_retries = 5
+        self.max_backoff = 30.0
+        # 每项为 (模型, 列值, 已失败次数)
+        self._pending: list[tuple[type, dict, int]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self.flushed = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        self.batch_size = app.config["WRITE_BEHIND_BATCH_SIZE"]
+        self.interval = app.config["WRITE_BEHIND_FLUSH_INTERVAL"]
+        self.max_pending = app.config["WRITE_BEHIND_MAX_PENDING"]
+        self.max_retries = app.config["WRITE_BEHIND_MAX_RETRIES"]
+        self.max_backoff = app.config["WRITE_BEHIND_MAX_BACKOFF"]
+        if app.config["WRITE_BEHIND_ENABLED"] and not app.testing:
+            self.start()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        # 正常退出时把队列里剩下的记录写完
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout=10)
+        self._thread = None
+        self.flush()
+
+    def add(self, model, **values) -> None:
+        """登记一条待插入的记录；时间戳等默认值在登记时取值，而不是写入时。"""
+        if not self.enabled:
+            from . import db
+
+            db.session.add(model(**values))
+            return
+        for column in model.__table__.columns:
+            if column.key not in values and column.default is not None and column.default.is_callable:
+                values[column.key] = column.default.arg(None)
+        backing_off = self.backing_off()
+        with self._lock:
+            if backing_off and len(self._pending) >= self.max_pending:
+                # 数据库持续不可写时不再无限堆积，也不让请求线程陪着重试
+                self.dropped += 1
+                return
+            self._pending.append((model, values, 0))
+            pending = len(self._pending)
+        if pending >= self.max_pending and not backing_off:
+            # 写入跟不上时由请求线程同步刷新，形成背压而不是无限堆积
+            self.flush()
+        elif pending >= self.batch_size:
+            self._wake.set()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def backing_off(self) -> bool:
+        return time.monotonic() < self._retry_at
+
+    def flush(self) -> int:
+        """把当前队列在一个事务内写入，返回写入的行数。"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                self._insert(batch)
+            except IntegrityError:
+                # 批内有违反约束的行：逐行重写，只丢弃有问题的行
+                return self._insert_rows(batch)
+            except Exception:
+                self.app.logger.exception("延迟写入失败，%s 条记录等待重试", len(batch))
+                self._requeue(batch)
+                return 0
+            self.flushed += len(batch)
+            self._reset_backoff()
+            return len(batch)
+
+    def _insert(self, batch: list[tuple[type, dict, int]]) -> None:
+        from . import db
+
+        grouped: dict[type, list[dict]] = {}
+        for model, values, _ in batch:
+            grouped.setdefault(model, []).append(values)
+        with self.app.app_context(), db.engine.begin() as connection:
+            for model, rows in grouped.items():
+                connection.execute(insert(model.__table__), rows)
+
+    def _insert_rows(self, batch: list[tuple[type, dict, int]]) -> int:
+        written = 0
+        retry = []
+        for item in batch:
+            try:
+                self._insert([item])
+            except IntegrityError:
+                # 数据本身有问题，重试也不会成功
+                self.dropped += 1
+                self.app.logger.exception("延迟写入的记录违反约束，已丢弃：%s %r", item[0].__table__.name, item[1])
+            except Exception:
+                retry.append(item)
+            else:
+                written += 1
+        self.flushed += written
+        if retry:
+            self.app.logger.warning("延迟写入失败，%s 条记录等待重试", len(retry))
+            self._requeue(retry)
+        else:
+            self._reset_backoff()
+        return written
+
+    def _requeue(self, batch: list[tuple[type, dict, int]]) -> None:
+        """暂时性错误：未超过重试次数的记录放回队首，并推迟下一次刷新。"""
+        retry = [(model, values, failures + 1) for model, values, failures in batch if failures + 1 < self.max_retries]
+        expired = len(batch) - len(retry)
+        if expired:
+            self.dropped += expired
+            self.app.logger.error("延迟写入重试 %s 次仍失败，丢弃 %s 条记录", self.max_retries, expired)
+        with self._lock:
+            self._pending[:0] = retry
+        self._failures += 1
+        delay = min(self.max_backoff, self.interval * 2 ** (self._failures - 1))
+        self._retry_at = time.monotonic() + delay
+
+    def _reset_backoff(self) -> None:
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(max(self.interval, self._retry_at - time.monotonic()))
+            self._wake.clear()
+            # 退避期间积压到批量阈值也不提前刷新
+            if self.backing_off() and not self._stopped.is_set():
+                continue
+            self.flush()
+
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,137 @@
+"""对比默认 SQLite 配置与 SQLITE_PRAGMAS 配置下的并发读写吞吐。
+
+模拟多 worker 部署：若干读进程反复执行 /state 缓存未命中时的查询，若干写进程发聊天并推进房间版本。
+
+    python benchmarks/sqlite_profile.py --readers 12 --writers 4 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from app import db  # noqa: E402
+from app import models  # noqa: E402,F401
+from app.sqlite_profile import apply_pragmas, engine_options  # noqa: E402
+from config import Config  # noqa: E402
+
+ROOMS = 50
+USERS = 200
+
+READ_SQL = [
+    text("SELECT id, playback_status, state_version FROM room WHERE code = :code"),
+    text("SELECT COUNT(*) FROM room_member WHERE room_id = :room_id"),
+    text(
+        "SELECT m.id, m.content, u.nickname FROM room_message m JOIN user u ON u.id = m.user_id "
+        "WHERE m.room_id = :room_id ORDER BY m.created_at DESC LIMIT 50"
+    ),
+]
+WRITE_SQL = [
+    text(
+        "INSERT INTO room_message (room_id, user_id, content, created_at) "
+        "VALUES (:room_id, :user_id, 'bench', CURRENT_TIMESTAMP)"
+    ),
+    text("UPDATE room SET state_version = state_version + 1 WHERE id = :room_id"),
+]
+
+
+def make_engine(uri: str, profile: bool):
+    if not profile:
+        return create_engine(uri)
+    config = {
+        "SQLALCHEMY_DATABASE_URI": uri,
+        "SQLITE_POOL_SIZE": Config.SQLITE_POOL_SIZE,
+        "SQLITE_MAX_OVERFLOW": Config.SQLITE_MAX_OVERFLOW,
+        "SQLITE_POOL_TIMEOUT": Config.SQLITE_POOL_TIMEOUT,
+        "SQLITE_PRAGMAS": Config.SQLITE_PRAGMAS,
+    }
+    engine = create_engine(uri, **engine_options(config))
+    apply_pragmas(engine, Config.SQLITE_PRAGMAS)
+    return engine
+
+
+def seed(uri: str, profile: bool) -> None:
+    engine = make_engine(uri, profile)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO user (id, username, password_hash, nickname) VALUES (:id, :name, 'x', :name)"),
+            [{"id": i, "name": f"u{i}"} for i in range(1, USERS + 1)],
+        )
+        conn.execute(
+            text("INSERT INTO room (id, owner_id, name, code, is_active, playback_status, current_position, "
+                 "state_version, playlist_version) VALUES (:id, 1, 'r', :code, 1, 'paused', 0, 0, 0)"),
+            [{"id": i, "code": f"{i:06d}"} for i in range(1, ROOMS + 1)],
+        )
+        conn.execute(
+            text("INSERT INTO room_message (room_id, user_id, content, created_at) "
+                 "VALUES (:room_id, :user_id, 'seed', CURRENT_TIMESTAMP)"),
+            [{"room_id": random.randint(1, ROOMS), "user_id": random.randint(1, USERS)} for _ in range(20000)],
+        )
+    engine.dispose()
+
+
+def worker(args) -> tuple[str, int, int]:
+    uri, profile, role, seconds = args
+    engine = make_engine(uri, profile)
+    ops = errors = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        room_id = random.randint(1, ROOMS)
+        try:
+            if role == "read":
+                with engine.connect() as conn:
+                    conn.execute(READ_SQL[0], {"code": f"{room_id:06d}"}).fetchall()
+                    for statement in READ_SQL[1:]:
+                        conn.execute(statement, {"room_id": room_id}).fetchall()
+            else:
+                with engine.begin() as conn:
+                    conn.execute(WRITE_SQL[0], {"room_id": room_id, "user_id": random.randint(1, USERS)})
+                    conn.execute(WRITE_SQL[1], {"room_id": room_id})
+            ops += 1
+        except OperationalError:
+            errors += 1
+    engine.dispose()
+    return role, ops, errors
+
+
+def run(profile: bool, readers: int, writers: int, seconds: float) -> dict:
+    directory = tempfile.mkdtemp()
+    uri = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    seed(uri, profile)
+    jobs = [(uri, profile, "read", seconds)] * readers + [(uri, profile, "write", seconds)] * writers
+    with multiprocessing.Pool(len(jobs)) as pool:
+        results = pool.map(worker, jobs)
+    summary = {"read": [0, 0], "write": [0, 0]}
+    for role, ops, errors in results:
+        summary[role][0] += ops
+        summary[role][1] += errors
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readers", type=int, default=12)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+    print(f"{args.readers} 读进程 + {args.writers} 写进程，每轮 {args.seconds:g} 秒")
+    for label, profile in (("默认配置", False), ("SQLITE_PRAGMAS", True)):
+        summary = run(profile, args.readers, args.writers, args.seconds)
+        (reads, read_errors), (writes, write_errors) = summary["read"], summary["write"]
+        print(
+            f"{label:<16} 读 {reads / args.seconds:8.0f}/s  写 {writes / args.seconds:7.0f}/s  "
+            f"locked 错误 读 {read_errors} / 写 {write_errors}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,15 +11,82 @@ class Config:
         "DATABASE_URL", f"sqlite:///{BASE_DIR / 'app.db'}"
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite 文件库的连接级设置，见 app/sqlite_profile.py；置为 {} 则不做任何调整
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",  # 读写并发：轮询读不再被写事务阻塞
+        "synchronous": "NORMAL",  # WAL 下只在检查点时 fsync，掉电最多丢最近的提交，不会损坏
+        "busy_timeout": 5000,  # 写写冲突时排队等待的毫秒数
+        "cache_size": -16000,  # 每连接约 16 MB 页缓存（负数单位为 KiB）
+        "mmap_size": 134217728,  # 128 MB 内存映射读
+        "temp_store": "MEMORY",
+    }
+    SCHEMA_AUTO_UPGRADE = True  # 启动时自动执行未应用的迁移；关闭后用 flask migrate 手动执行
+    SQLITE_POOL_SIZE = 10
+    SQLITE_MAX_OVERFLOW = 20
+    SQLITE_POOL_TIMEOUT = 10
     MAX_CONTENT_LENGTH = 60 * 1024 * 1024  # 60 MB upper bound for uploads
     UPLOAD_FOLDER = BASE_DIR / "static" / "uploads"
     AVATAR_FOLDER = UPLOAD_FOLDER / "avatars"
     MUSIC_FOLDER = UPLOAD_FOLDER / "music"
     ALLOWED_AVATAR_EXTENSIONS = {"png", "jpg", "jpeg", "gif"}
+    AVATAR_PIPELINE_ENABLED = True  # 需安装 Pillow；关闭或未安装时直接展示原图
+    AVATAR_PIPELINE_WORKERS = 2
     ALLOWED_MUSIC_EXTENSIONS = {"mp3"}
     MAX_MUSIC_FILE_MB = 50
-    LISTEN_RECORD_WINDOW_DAYS = 30
+    MUSIC_UPLOAD_CHUNK_MB = 4  # 分块上传单块上限，整文件大小仍受 MAX_MUSIC_FILE_MB 限制
+    UPLOAD_SESSION_TTL_HOURS = 24  # 超时未完成的分块上传在用户下次发起上传时或存储回收时清理
+    # 上传目录的未引用文件回收，见 app/storage_gc.py；flask storage-gc --dry-run 可先查看
+    STORAGE_GC_ENABLED = True
+    STORAGE_GC_INTERVAL_SECONDS = 6 * 3600
+    STORAGE_GC_GRACE_HOURS = 24  # 修改时间在此之内的文件即使没有引用也保留
+    STORAGE_GC_REJECTED_DAYS = 7  # 驳回超过该天数的曲目删除文件（保留记录），0 为不删除
+    STORAGE_GC_BATCH_SIZE = 100  # 每批删除的文件数，音乐文件每批持有一次写锁
+    STORAGE_GC_BATCH_PAUSE = 0.1  # 批与批之间的间隔秒数
+    STORAGE_GC_MAX_DELETES = 10000  # 单轮删除上限，超出的留到下一轮
+    LISTEN_RECORD_WINDOW_DAYS = 30  # 听歌 / 房间参与记录的保留天数，过期由后台清理
+    RETENTION_ENABLED = True  # 后台定期清理过期记录与超量聊天，见 app/retention.py
+    RETENTION_INTERVAL_SECONDS = 3600
+    RETENTION_BATCH_SIZE = 500  # 每个删除事务的行数上限，越小单次持锁越短
+    RETENTION_BATCH_PAUSE = 0.05  # 批与批之间让出写锁的秒数
+    ROOM_MESSAGE_HISTORY_LIMIT = 5000  # 每个房间保留的最新消息条数，0 为不限制
+    # 听歌 / 参与记录延迟批量写入，见 app/writebehind.py；关闭后随请求事务同步写入
+    WRITE_BEHIND_ENABLED = True
+    WRITE_BEHIND_FLUSH_INTERVAL = 1.0  # 秒
+    WRITE_BEHIND_BATCH_SIZE = 200  # 积压达到该条数时提前刷新
+    WRITE_BEHIND_MAX_PENDING = 5000  # 积压上限，超过后由请求线程同步刷新
+    WRITE_BEHIND_MAX_RETRIES = 5  # 暂时性错误下每条记录最多尝试写入的次数，超过后记日志丢弃
+    WRITE_BEHIND_MAX_BACKOFF = 30  # 连续失败时刷新间隔按指数增长的上限（秒）
+    # 登录失败限流："memory" 仅本进程有效；多 worker 部署请用 "sqlite"，同机进程共享同一计数文件
+    LOGIN_RATELIMIT_BACKEND = os.environ.get("LOGIN_RATELIMIT_BACKEND", "memory")
+    LOGIN_RATELIMIT_SQLITE_PATH = BASE_DIR / "instance" / "ratelimit.db"
+    LOGIN_RATELIMIT_MAX_KEYS = 10000  # 内存后端最多跟踪的用户名 / IP 数，超出按 LRU 淘汰
+    LOGIN_LOCKOUT_SECONDS = 60
+    LOGIN_MAX_FAILED_ATTEMPTS = 2  # 同一用户名窗口内的失败上限
+    LOGIN_MAX_FAILED_PER_IP = 20  # 同一 IP 窗口内的失败上限
     ROOM_PLAYBACK_SYNC_INTERVAL = 3  # seconds
+    ROOM_CODE_KEY = os.environ.get("ROOM_CODE_KEY")  # 房间号置换密钥，未设置时由 SECRET_KEY 派生；上线后不要再改
+    ROOM_CODE_REUSE_AFTER_DAYS = 30  # 删除房间的号码冷却多久后可再次分配
+    ROOM_EVENTS_HEARTBEAT_SECONDS = 15  # SSE / WebSocket 空闲保活间隔，同时是在线心跳间隔
+    PRESENCE_TTL_SECONDS = 45  # 超过该时长没有轮询或连接心跳即视为离线；须大于保活间隔与兜底轮询间隔
+    PRESENCE_TICK_SECONDS = 1.0
+    # 轮询间隔提示（毫秒）：/state 响应按房间状态建议客户端下一次轮询的时间
+    ROOM_POLL_BURST_MS = 1000  # 状态刚变化（房主操作、新消息）后的短时间内
+    ROOM_POLL_BURST_SECONDS = 10
+    ROOM_POLL_PLAYING_MS = 3000
+    ROOM_POLL_PAUSED_MS = 6000
+    ROOM_POLL_IDLE_MS = 12000  # 超过 ROOM_POLL_IDLE_AFTER_SECONDS 没有任何变化的非播放房间
+    ROOM_POLL_IDLE_AFTER_SECONDS = 120
+    ROOM_POLL_CLOSED_MS = 20000  # 已打烊房间（只有房主能看到）；各档都须小于 PRESENCE_TTL_SECONDS
+    ROOM_STATE_CACHE_MAX_ROOMS = 1000  # 房间状态缓存容量（LRU）
+    ROOM_STATE_CACHE_TTL = 30  # 快照最长存活秒数，兼顾多进程部署下的陈旧度
+    USER_CACHE_MAX_USERS = 10000  # 登录用户资料缓存容量（LRU）
+    USER_CACHE_TTL = 30  # 秒；多进程部署下其他进程的修改最多延迟这么久生效，0 为关闭
+    PLAYBACK_SCHEDULER_ENABLED = True  # 服务端按曲目时长自动切歌
+    PLAYBACK_SCHEDULER_TICK = 1.0  # 时间轮粒度（秒）
+    PLAYBACK_SCHEDULER_SLOTS = 512  # 时间轮槽位数，超过一圈的定时按圈数计
+    # 音频发送方式：None 由 WSGI 服务器 sendfile；"x-accel" 交给 nginx internal location；"x-sendfile" 交给 Apache/lighttpd
+    MUSIC_SENDFILE_MODE = os.environ.get("MUSIC_SENDFILE_MODE") or None
+    MUSIC_ACCEL_REDIRECT_PREFIX = "/_protected/music/"  # nginx 中对应 internal location，alias 指向 MUSIC_FOLDER
 
 
 class TestConfig(Config):
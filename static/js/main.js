@@ -4,6 +4,9 @@ document.addEventListener("DOMContentLoaded", () => {
   initChatControls();
   initRoomSync();
   initMusicAutofill();
+  initChunkedUpload();
+  initChatHistory();
+  initLibrarySearch();
 });
 
 // --- 1. 统一按钮控制 (修复版：兼容 data-action) ---
@@ -67,6 +70,17 @@ function initGlobalControls() {
     }
 
     try {
+      // 房间长连接可用时，播放控制直接走 WebSocket，结果由服务端广播回来
+      if (window.sendRoomFrame && window.roomConfig &&
+          new URL(targetUrl, window.location.href).pathname === window.roomConfig.toggleUrl) {
+        const musicId = formData.get('music_id');
+        const itemId = formData.get('item_id');
+        const frame = musicId
+          ? { t: 'ctl', a: 'switch', m: parseInt(musicId, 10), i: itemId ? parseInt(itemId, 10) : undefined }
+          : { t: 'ctl', a: action, p: pos };
+        if (window.sendRoomFrame(frame)) return;
+      }
+
       const response = await fetch(targetUrl, {
         method: 'POST',
         body: formData
@@ -107,6 +121,10 @@ function initChatControls() {
 
     const formData = new FormData(chatForm);
     try {
+      if (window.sendRoomFrame && window.sendRoomFrame({ t: 'msg', c: content })) {
+        input.value = '';
+        return;
+      }
       const response = await fetch(chatForm.action, {
         method: 'POST',
         body: formData
@@ -128,7 +146,7 @@ function initChatControls() {
 // --- 3. 房间同步核心 ---
 function initRoomSync() {
   if (!window.roomConfig) return;
-  const { stateUrl, audioSelector, isOwner, toggleUrl, playlistDeleteUrl } = window.roomConfig;
+  const { stateUrl, eventsUrl, socketUrl, timeUrl, audioSelector, isOwner, toggleUrl, playlistDeleteUrl } = window.roomConfig;
   const audio = document.querySelector(audioSelector);
 
   const label = document.querySelector("#state-label");
@@ -142,55 +160,111 @@ function initRoomSync() {
   const timeDuration = document.querySelector("#time-duration");
   const vinylWrapper = document.querySelector('.vinyl-wrapper');
 
-  // 用于自动切歌的状态
+  // 用于自动切歌的状态：以歌单条目 ID 定位当前曲目（歌名可能重复）
   let currentPlaylist = [];
   let currentTrackName = "";
+  let currentItemId = null;
+  let currentTrackDuration = null;
+  // 增量同步游标：服务端状态版本号 + 已收到的最新消息 ID
+  let stateVersion = null;
+  let lastMessageId = window.roomConfig.lastMessageId || 0;
+  // 在线成员版本号：成员进出时服务端递增，未变化时不再下发在线列表
+  let presenceVersion = null;
+  // 轮询节奏：服务端建议的间隔与连续失败次数
+  let pollAfter = 2000;
+  let pollFailures = 0;
+
+  // 权威播放时间线 {track, start_ms, rate, position}，本地按校准后的服务端时钟推算进度
+  let timeline = null;
+  const clock = createServerClock(timeUrl);
+  clock.sync();
+  setInterval(() => clock.sync(), 60000);
+
+  function expectedPosition() {
+    if (!timeline) return null;
+    if (!timeline.rate || timeline.start_ms === null) return timeline.position;
+    return (clock.now() - timeline.start_ms) / 1000 * timeline.rate;
+  }
+
+  // 漂移修正：小偏差微调 playbackRate 平滑追赶，只有偏差过大才硬跳转
+  const HARD_SEEK_SECONDS = 1.0;
+  const DRIFT_DEADBAND_SECONDS = 0.04;
+  const MAX_RATE_NUDGE = 0.05;
+  function correctDrift() {
+    if (!audio) return;
+    if (!timeline || !timeline.rate || audio.paused || audio.seeking || audio.readyState < 3) {
+      audio.playbackRate = 1;
+      return;
+    }
+    const drift = audio.currentTime - expectedPosition();
+    if (Math.abs(drift) > HARD_SEEK_SECONDS) {
+      audio.currentTime = expectedPosition();
+      audio.playbackRate = 1;
+    } else if (Math.abs(drift) > DRIFT_DEADBAND_SECONDS) {
+      // 超前则放慢、落后则加快，约 2 秒内追平当前偏差
+      audio.playbackRate = 1 - Math.max(-MAX_RATE_NUDGE, Math.min(MAX_RATE_NUDGE, drift / 2));
+    } else {
+      audio.playbackRate = 1;
+    }
+  }
+  setInterval(correctDrift, 500);
 
   if (audio) {
     audio.addEventListener("timeupdate", () => {
       const current = audio.currentTime || 0;
-      const duration = audio.duration || 0;
+      const duration = currentTrackDuration || audio.duration || 0;
       if (timeCurrent) timeCurrent.textContent = formatTime(current);
       if (timeDuration && duration) timeDuration.textContent = formatTime(duration);
       if (progressFill && duration) progressFill.style.width = `${(current / duration) * 100}%`;
     });
     audio.addEventListener("loadedmetadata", () => {
       if (timeDuration && audio.duration) timeDuration.textContent = formatTime(audio.duration);
+      // 曲目时长未知时由房主回填，服务端据此排程自动切歌
+      if (isOwner && currentItemId && !currentTrackDuration && isFinite(audio.duration)) {
+        currentTrackDuration = audio.duration;
+        sendHostCommand({ action: 'duration', duration: audio.duration });
+      }
     });
 
-    // 自动切歌逻辑
+    // 自动切歌：服务端排程器会按时长切歌，这里只是房主在线时的兜底，
+    // 带上当前条目 ID，服务端只在条目未变化时才切，不会与排程器重复切歌
     audio.addEventListener("ended", () => {
         if (!isOwner) return;
-        console.log("播放结束，尝试切歌...");
-
-        const currentIndex = currentPlaylist.findIndex(item => item.title === currentTrackName);
-        const csrfToken = document.querySelector('input[name="csrf_token"]')?.value || '';
-        const formData = new FormData();
-        formData.append('csrf_token', csrfToken);
-
-        if (currentIndex !== -1 && currentIndex < currentPlaylist.length - 1) {
-            // 下一首
-            const nextMusic = currentPlaylist[currentIndex + 1];
-            formData.append('music_id', nextMusic.music_id);
-            // 这里不需要 action，只要有 music_id 后端就会切歌
-        } else {
-            // 没有下一首，停止
-            formData.append('action', 'stop');
-        }
+        sendHostCommand({ action: 'next', item_id: currentItemId });
+    });
+  }
 
-        // 发送请求
-        fetch(toggleUrl, {
-            method: 'POST',
-            body: formData
-        }).then(async (res) => {
-            if (res.ok && window.manualRefreshState) await window.manualRefreshState();
-        });
+  function sendHostCommand({ action, item_id, duration }) {
+    const frame = { t: 'ctl', a: action, i: item_id ?? undefined, d: duration };
+    if (window.sendRoomFrame && window.sendRoomFrame(frame)) return;
+    const csrfToken = document.querySelector('input[name="csrf_token"]')?.value || '';
+    const formData = new FormData();
+    formData.append('csrf_token', csrfToken);
+    formData.append('action', action);
+    if (item_id) formData.append('item_id', item_id);
+    if (duration) formData.append('duration', duration);
+    fetch(toggleUrl, {
+        method: 'POST',
+        body: formData
+    }).then(async (res) => {
+        if (res.ok && window.manualRefreshState) await window.manualRefreshState();
     });
   }
 
   async function refreshState() {
     try {
-      const response = await fetch(stateUrl);
+      const params = new URLSearchParams();
+      if (stateVersion !== null) params.set('since_version', stateVersion);
+      if (lastMessageId) params.set('since_message_id', lastMessageId);
+      if (presenceVersion !== null) params.set('since_presence', presenceVersion);
+      const query = params.toString();
+      const response = await fetch(query ? `${stateUrl}?${query}` : stateUrl);
+      // 服务端按房间状态建议下一次轮询的间隔，304 响应同样携带
+      const hint = parseInt(response.headers.get('X-Poll-After'), 10);
+      if (hint > 0) pollAfter = hint;
+      pollFailures = response.status >= 500 ? pollFailures + 1 : 0;
+      // 状态未变化，服务端直接返回 304
+      if (response.status === 304) return;
       // [新增] 处理房间已删除 (404 Not Found)
       // 当房主删除房间后，room_state 接口会返回 404
       if (response.status === 404) {
@@ -209,16 +283,49 @@ function initRoomSync() {
 
       if (!response.ok) return;
       const state = await response.json();
+      // 游标只随轮询结果前进：推送可能来自其他进程之外的局部视图，不能据此跳过消息
+      if (state.version !== undefined) stateVersion = state.version;
+      if (state.presence_version !== undefined) presenceVersion = state.presence_version;
+      if (state.messages && state.messages.length) {
+          lastMessageId = Math.max(lastMessageId, ...state.messages.map(m => m.id));
+      }
+      await applyState(state);
+    } catch (e) {
+      pollFailures += 1;
+      console.error(e);
+    }
+  }
 
+  // 把（完整或局部的）房间状态应用到界面；轮询响应与实时推送共用
+  async function applyState(state) {
       // [新增] 实时更新在线人数
       if (state.member_count !== undefined) {
           const countEl = document.getElementById("member-count-display");
           if (countEl) countEl.textContent = state.member_count;
+          if (countEl && state.online) countEl.title = state.online.map(m => m.name).join('、');
       }
       // 更新本地状态
       if (state.playlist) currentPlaylist = state.playlist;
-      currentTrackName = state.current_track_name;
+      const hasPlayback = state.playback_status !== undefined;
+      if (hasPlayback) {
+          currentTrackName = state.current_track_name;
+          currentItemId = state.current_item_id;
+          currentTrackDuration = state.current_track_duration;
+          // 上传时已扫描出时长，不必等浏览器加载完元数据
+          if (timeDuration && currentTrackDuration) timeDuration.textContent = formatTime(currentTrackDuration);
+      }
 
+      // 歌单 & 聊天同步（切歌后需要刷新歌单高亮）
+      if (playlistContainer && (state.playlist || hasPlayback)) {
+          updatePlaylistUI(playlistContainer, currentPlaylist, currentItemId, isOwner, toggleUrl, playlistDeleteUrl);
+      }
+      if (chatLog && state.messages) updateChatLog(chatLog, state.messages);
+
+      if (hasPlayback) await applyPlayback(state);
+  }
+
+  async function applyPlayback(state) {
+      if (state.timeline) timeline = state.timeline;
       // UI 更新
       if (label) label.textContent = state.playback_status === "playing" ? "播放中" : "已暂停";
 
@@ -272,45 +379,33 @@ function initRoomSync() {
           }
       }
 
-      // 歌单 & 聊天同步
-      if (playlistContainer && state.playlist) {
-          updatePlaylistUI(playlistContainer, state.playlist, state.current_track_name, isOwner, toggleUrl, playlistDeleteUrl);
-      }
-      if (chatLog && state.messages) updateChatLog(chatLog, state.messages);
-
       // 音频同步
       if (audio && state.is_active) {
           if (state.current_track_file) {
-            const targetSrc = `/static/uploads/music/${state.current_track_file}`;
-            const currentSrcPath = decodeURIComponent(audio.src).split('/static/uploads/music/')[1];
+            const targetSrc = `/music/stream/${state.current_track_file}`;
+            const currentSrcPath = decodeURIComponent(audio.src).split('/music/stream/')[1];
 
             // 切歌
             if (currentSrcPath !== state.current_track_file) {
               audio.src = targetSrc;
-              if (state.current_position > 0) audio.currentTime = state.current_position;
+              const startAt = expectedPosition() ?? state.current_position;
+              if (startAt > 0) audio.currentTime = startAt;
               try {
                   await audio.load();
                   if (state.playback_status === "playing") audio.play().catch(()=>{});
               } catch (e) { console.error(e); }
             }
 
-            // 进度修正
-            if (state.current_position !== undefined) {
-                 const diff = Math.abs(audio.currentTime - state.current_position);
-                 if (state.playback_status === "paused") {
-                     if (diff > 0.5) audio.currentTime = state.current_position;
-                 } else if (state.playback_status === "playing") {
-                     if (isOwner && !audio.paused) {
-                         if (diff > 5) audio.currentTime = state.current_position;
-                     } else {
-                         if (diff > 2) audio.currentTime = state.current_position;
-                     }
-                 }
+            // 进度修正：暂停时对齐到固定位置，播放中交给时间线漂移修正
+            if (state.playback_status === "paused") {
+                const target = expectedPosition() ?? state.current_position;
+                if (target !== undefined && Math.abs(audio.currentTime - target) > 0.5) audio.currentTime = target;
             }
 
             // 状态控制
             if (state.playback_status === "playing") {
                 if (audio.paused) audio.play().catch(()=>{});
+                correctDrift();
                 if (vinylWrapper) vinylWrapper.classList.add('spinning');
             } else {
                 if (!audio.paused) audio.pause();
@@ -324,16 +419,152 @@ function initRoomSync() {
               if (audio.src) audio.removeAttribute('src');
           }
       }
-    } catch (e) { console.error(e); }
   }
 
-  window.manualRefreshState = refreshState;
-  refreshState();
-  setInterval(refreshState, 2000);
+  // 实时推送（SSE / WebSocket）：携带数据的事件直接应用，其余事件再走增量轮询
+  function handlePush(event, data) {
+    if (event === 'deleted') {
+      alert("房间已解散，正在返回首页...");
+      window.location.href = "/dashboard";
+      return;
+    }
+    if (data.playback) applyState(data.playback);
+    else if (data.message) applyState({ messages: [data.message] });
+    // 人数变化直接显示；在线列表留给下一次轮询按 presence 版本增量拉取
+    else if (data.member_count !== undefined) applyState({ member_count: data.member_count });
+    else refreshState();
+  }
+
+  // 轮询兜底：间隔由服务端按房间状态提示，实时通道连通时降为低频校验；
+  // 连续失败按指数退避，所有间隔都带随机抖动，避免大量客户端在同一时刻集中请求
+  const SAFETY_POLL_INTERVAL = 15000;
+  const HIDDEN_POLL_INTERVAL = 30000; // 后台标签页只保持在线心跳，须小于服务端在线 TTL（45 秒）
+  const MAX_BACKOFF = 30000;
+  const PUSH_EVENTS = ['playback', 'message', 'playlist', 'members', 'presence', 'availability', 'deleted'];
+  let pollTimer = null;
+  let pushConnected = false;
+
+  function nextPollDelay() {
+    if (pollFailures > 0) {
+      // 抖动退避：在 [基准, min(上限, 基准 * 2^n)] 内随机取值
+      const ceiling = Math.max(pollAfter, Math.min(MAX_BACKOFF, pollAfter * 2 ** pollFailures));
+      return pollAfter + Math.random() * (ceiling - pollAfter);
+    }
+    let delay = pollAfter;
+    if (document.hidden) delay = HIDDEN_POLL_INTERVAL;
+    else if (pushConnected) delay = Math.max(delay, SAFETY_POLL_INTERVAL);
+    return delay * (0.8 + Math.random() * 0.4);
+  }
+
+  function schedulePoll() {
+    clearTimeout(pollTimer);
+    pollTimer = null;
+    // 后台标签页有实时连接时完全停止轮询，在线心跳由连接承担
+    if (document.hidden && pushConnected) return;
+    pollTimer = setTimeout(async () => {
+      await refreshState();
+      schedulePoll();
+    }, nextPollDelay());
+  }
+
+  function setPushConnected(connected) {
+    pushConnected = connected;
+    schedulePoll();
+  }
+
+  // 房主操作后立即拉取一次，并按新的（变化后加密的）间隔重新排期
+  window.manualRefreshState = async () => {
+    await refreshState();
+    schedulePoll();
+  };
+  window.manualRefreshState();
+
+  document.addEventListener('visibilitychange', () => {
+    if (document.hidden) schedulePoll();
+    else window.manualRefreshState();
+  });
+
+  function connectEvents() {
+    if (!eventsUrl || !window.EventSource) return;
+    const source = new EventSource(eventsUrl);
+    source.addEventListener('open', () => setPushConnected(true));
+    // 浏览器会自动重连，重连期间先回到常规轮询
+    source.addEventListener('error', () => setPushConnected(false));
+    PUSH_EVENTS.forEach((name) => {
+      source.addEventListener(name, (e) => {
+        if (name === 'deleted') source.close();
+        handlePush(name, JSON.parse(e.data || '{}'));
+      });
+    });
+  }
+
+  // WebSocket 优先：房主控制与聊天也走这条连接；握手失败则退回 SSE
+  let socket = null;
+  window.sendRoomFrame = (frame) => {
+    if (!socket || socket.readyState !== WebSocket.OPEN) return false;
+    socket.send(JSON.stringify(frame));
+    return true;
+  };
+
+  function connectSocket() {
+    if (!socketUrl || !window.WebSocket) return connectEvents();
+    const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const ws = new WebSocket(`${scheme}://${window.location.host}${socketUrl}`);
+    let opened = false;
+    ws.addEventListener('open', () => {
+      opened = true;
+      socket = ws;
+      setPushConnected(true);
+    });
+    ws.addEventListener('message', (e) => {
+      const frame = JSON.parse(e.data);
+      if (frame.t === 'ev') handlePush(frame.e, frame);
+      else if (frame.t === 'err') {
+        console.warn("房间指令被拒绝:", frame.c);
+        refreshState();
+      }
+    });
+    ws.addEventListener('close', () => {
+      socket = null;
+      setPushConnected(false);
+      if (!opened) connectEvents();
+      else setTimeout(connectSocket, 3000);
+    });
+  }
+  connectSocket();
+}
+
+// --- 3.1 时钟同步：NTP 式估算服务端时钟偏移，取往返时间最短的样本 ---
+function createServerClock(timeUrl) {
+  let offset = 0;
+  let bestRtt = Infinity;
+
+  async function sample() {
+    const t0 = Date.now();
+    const response = await fetch(`${timeUrl}?t0=${t0}`, { cache: 'no-store' });
+    const t3 = Date.now();
+    if (!response.ok) return;
+    const { t1, t2 } = await response.json();
+    const rtt = (t3 - t0) - (t2 - t1);
+    if (rtt <= bestRtt) {
+      bestRtt = rtt;
+      offset = ((t1 - t0) + (t2 - t3)) / 2;
+    }
+  }
+
+  async function sync(rounds = 5) {
+    // 每轮重新取样，避免旧的“幸运”样本在时钟漂移后一直占优
+    bestRtt = Infinity;
+    for (let i = 0; i < rounds; i++) {
+      try { await sample(); } catch (e) { break; }
+    }
+  }
+
+  return { now: () => Date.now() + offset, sync };
 }
 
 // --- 4. 歌单渲染 (确保按钮带 type="button" 和 data-action) ---
-function updatePlaylistUI(container, playlist, currentTrackName, isOwner, toggleUrl, deleteUrl) {
+function updatePlaylistUI(container, playlist, currentItemId, isOwner, toggleUrl, deleteUrl) {
     let html = '';
     const csrfToken = document.querySelector('input[name="csrf_token"]')?.value || '';
 
@@ -341,7 +572,7 @@ function updatePlaylistUI(container, playlist, currentTrackName, isOwner, toggle
         html = '<div class="empty-list-placeholder">队列空空如也</div>';
     } else {
         playlist.forEach(item => {
-            const isPlaying = (item.title === currentTrackName);
+            const isPlaying = (item.id === currentItemId);
             let actionsHtml = '';
 
             if (isOwner) {
@@ -350,6 +581,7 @@ function updatePlaylistUI(container, playlist, currentTrackName, isOwner, toggle
                     <form method="post" action="${toggleUrl}" class="inline-btn-form">
                         <input type="hidden" name="csrf_token" value="${csrfToken}" />
                         <input type="hidden" name="music_id" value="${item.music_id}" />
+                        <input type="hidden" name="item_id" value="${item.id}" />
                         <button type="button" class="icon-btn-sm control-btn" title="播放" data-action="play">
                             <i class="ri-play-mini-fill"></i>
                         </button>
@@ -380,6 +612,85 @@ function updatePlaylistUI(container, playlist, currentTrackName, isOwner, toggle
     if (container.innerHTML.trim() !== html.trim()) container.innerHTML = html;
 }
 
+// --- 分块上传：断线后从服务端确认的偏移继续，刷新页面后也能续传同一文件 ---
+function initChunkedUpload() {
+  const form = document.querySelector('.music-upload-form[data-upload-url]');
+  if (!form || !window.fetch) return;
+  const uploadUrl = form.dataset.uploadUrl;
+  const fileInput = form.querySelector('input[type="file"]');
+  const titleInput = form.querySelector('input[name="title"]');
+  const submitBtn = form.querySelector('button[type="submit"]');
+  const csrfToken = form.querySelector('input[name="csrf_token"]')?.value || '';
+  const headers = { 'X-CSRFToken': csrfToken };
+
+  async function request(url, options = {}) {
+    const res = await fetch(url, { credentials: 'same-origin', ...options, headers: { ...headers, ...(options.headers || {}) } });
+    const body = await res.json().catch(() => ({}));
+    return { res, body };
+  }
+
+  async function openSession(file, storageKey) {
+    const saved = localStorage.getItem(storageKey);
+    if (saved) {
+      const { res, body } = await request(`${uploadUrl}/${saved}`);
+      if (res.ok) return body;
+      localStorage.removeItem(storageKey);
+    }
+    const { res, body } = await request(uploadUrl, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size, title: titleInput ? titleInput.value : '' }),
+    });
+    if (!res.ok) throw new Error(body.error || '创建上传失败');
+    localStorage.setItem(storageKey, body.id);
+    return body;
+  }
+
+  async function sendChunk(session, file, offset, attempt = 0) {
+    const chunk = file.slice(offset, offset + session.chunk_size);
+    try {
+      const { res, body } = await request(`${uploadUrl}/${session.id}?offset=${offset}`, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        body: chunk,
+      });
+      if (res.ok || res.status === 409) return body.offset;  // 409 时按服务端偏移继续
+      if (res.status < 500) throw Object.assign(new Error(body.error || '上传失败'), { fatal: true });
+    } catch (err) {
+      if (err.fatal || attempt >= 5) throw err;
+    }
+    // 网络错误或 5xx：指数退避后重试同一偏移
+    await new Promise((r) => setTimeout(r, Math.min(1000 * 2 ** attempt, 15000)));
+    const { res, body } = await request(`${uploadUrl}/${session.id}`);
+    return sendChunk(session, file, res.ok ? body.offset : offset, attempt + 1);
+  }
+
+  form.addEventListener('submit', async (e) => {
+    const file = fileInput && fileInput.files && fileInput.files[0];
+    if (!file) return;  // 交给原表单提交，由服务端提示
+    e.preventDefault();
+    const storageKey = `vs-upload:${file.name}:${file.size}:${file.lastModified}`;
+    const originalHtml = submitBtn ? submitBtn.innerHTML : '';
+    if (submitBtn) submitBtn.disabled = true;
+    try {
+      const session = await openSession(file, storageKey);
+      let offset = session.offset;
+      while (offset < file.size) {
+        if (submitBtn) submitBtn.textContent = `上传中 ${Math.floor((offset / file.size) * 100)}%`;
+        offset = await sendChunk(session, file, offset);
+      }
+      if (submitBtn) submitBtn.textContent = '校验中...';
+      const { res, body } = await request(`${uploadUrl}/${session.id}/finalize`, { method: 'POST' });
+      localStorage.removeItem(storageKey);
+      if (!res.ok) throw new Error(body.error || '上传失败');
+      window.location.href = window.location.pathname;  // 刷新列表并显示服务端提示
+    } catch (err) {
+      alert(err.message || '上传失败，请稍后重试');
+      if (submitBtn) { submitBtn.disabled = false; submitBtn.innerHTML = originalHtml; }
+    }
+  });
+}
+
 // (辅助函数保持不变)
 function updateChatLog(container, messages) {
     const existingItems = container.querySelectorAll('.chat-bubble-row');
@@ -389,32 +700,111 @@ function updateChatLog(container, messages) {
     const noMsg = container.querySelector('.no-msg');
 
     if (messages.length > 0 && noMsg) noMsg.remove();
-    if (messages.length === 0 && !noMsg) container.innerHTML = '<div class="no-msg"><i class="ri-chat-1-line"></i><p>暂无消息，打个招呼吧</p></div>';
+    // 增量响应中空数组只代表“没有新消息”，已有消息时不能清空
+    if (messages.length === 0 && !noMsg && existingItems.length === 0) container.innerHTML = '<div class="no-msg"><i class="ri-chat-1-line"></i><p>暂无消息，打个招呼吧</p></div>';
 
     messages.forEach(msg => {
         if (!existingIds.has(msg.id)) {
-        // [新增] 判断是否为自己发的消息
-            // 注意：需要确保你的 room.html 已经按第三步修改，注入了 currentUserId
-            const isSelf = (msg.author_id === window.roomConfig.currentUserId);
-            const selfClass = isSelf ? 'self' : '';
-            const html = `
-                <div class="chat-bubble-row ${selfClass}" data-id="${msg.id}">
-                    <img src="${msg.author_avatar}" class="chat-avatar-sm" />
-                    <div class="chat-content-wrap">
-                        <div class="chat-meta">
-                            <span class="chat-name">${escapeHtml(msg.author_name)}</span>
-                            <span class="chat-time">${msg.created_at}</span>
-                        </div>
-                        <div class="chat-bubble">${escapeHtml(msg.content)}</div>
-                    </div>
-                </div>`;
-            container.insertAdjacentHTML('beforeend', html);
+            container.insertAdjacentHTML('beforeend', chatRowHtml(msg));
             hasNew = true;
         }
     });
     if (hasNew) container.scrollTop = container.scrollHeight;
 }
 
+function chatRowHtml(msg) {
+    // 判断是否为自己发的消息（room.html 注入了 currentUserId）
+    const isSelf = (msg.author_id === window.roomConfig.currentUserId);
+    const selfClass = isSelf ? 'self' : '';
+    return `
+        <div class="chat-bubble-row ${selfClass}" data-id="${msg.id}">
+            <img src="${msg.author_avatar}" srcset="${msg.author_avatar_2x || msg.author_avatar} 2x" class="chat-avatar-sm" />
+            <div class="chat-content-wrap">
+                <div class="chat-meta">
+                    <span class="chat-name">${escapeHtml(msg.author_name)}</span>
+                    <span class="chat-time">${msg.created_at}</span>
+                </div>
+                <div class="chat-bubble">${escapeHtml(msg.content)}</div>
+            </div>
+        </div>`;
+}
+
+// 聊天记录懒加载：滚动到顶部时按游标取更早的一页，插入后保持当前阅读位置不跳动
+function initChatHistory() {
+    const chatLog = document.querySelector('#chat-log[data-history-url]');
+    if (!chatLog) return;
+    let cursor = chatLog.dataset.historyCursor;
+    let loading = false;
+    const link = chatLog.querySelector('.chat-history-link');
+    if (link) link.remove();
+
+    async function loadOlder() {
+        if (!cursor || loading) return;
+        loading = true;
+        try {
+            const params = new URLSearchParams({ before: cursor });
+            const response = await fetch(`${chatLog.dataset.historyUrl}?${params}`, { headers: { 'Accept': 'application/json' } });
+            if (!response.ok) return;
+            const data = await response.json();
+            const existingIds = new Set([...chatLog.querySelectorAll('.chat-bubble-row')].map(el => parseInt(el.dataset.id)));
+            const html = data.messages.filter(msg => !existingIds.has(msg.id)).map(chatRowHtml).join('');
+            const previousHeight = chatLog.scrollHeight;
+            chatLog.insertAdjacentHTML('afterbegin', html);
+            chatLog.scrollTop += chatLog.scrollHeight - previousHeight;
+            cursor = data.next_cursor;
+        } catch (e) {
+            console.error(e);
+        } finally {
+            loading = false;
+        }
+    }
+
+    chatLog.addEventListener('scroll', () => {
+        if (chatLog.scrollTop < 40) loadOlder();
+    }, { passive: true });
+}
+
+// 点歌面板输入联想：防抖后请求检索接口，只渲染最后一次输入的结果
+function initLibrarySearch() {
+    const input = document.querySelector('.library-search-input');
+    const list = document.querySelector('.library-scroll');
+    if (!input || !list) return;
+    const csrfInput = document.querySelector('input[name="csrf_token"]');
+    const csrf = csrfInput ? csrfInput.value : '';
+    let timer = null;
+    let seq = 0;
+
+    function render(results) {
+        if (!results.length) {
+            list.innerHTML = '<p class="empty-lib-text">没有匹配的音乐</p>';
+            return;
+        }
+        list.innerHTML = results.map(music => `
+            <div class="library-item-row">
+                <span class="lib-name">${escapeHtml(music.title)}</span>
+                <form method="post" action="${input.dataset.addUrl}">
+                    <input type="hidden" name="csrf_token" value="${csrf}" />
+                    <input type="hidden" name="music_id" value="${music.id}" />
+                    <button type="submit" class="add-btn-sm"><i class="ri-add-line"></i> 点歌</button>
+                </form>
+            </div>`).join('');
+    }
+
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(async () => {
+            const current = ++seq;
+            try {
+                const params = new URLSearchParams({ q: input.value.trim() });
+                const response = await fetch(`${input.dataset.searchUrl}?${params}`, { headers: { 'Accept': 'application/json' } });
+                if (!response.ok || current !== seq) return;
+                const data = await response.json();
+                if (current === seq) render(data.results);
+            } catch (e) { console.error(e); }
+        }, 150);
+    });
+}
+
 function escapeHtml(t){if(!t)return t;return t.replace(/&/g,"&amp;").replace(/</g,"&lt;").replace(/>/g,"&gt;").replace(/"/g,"&quot;").replace(/'/g,"&#039;");}
 function formatTime(s){if(!s||isNaN(s)||s===Infinity)return"00:00";const m=Math.floor(s/60);const sc=Math.floor(s%60);return`${m.toString().padStart(2,'0')}:${sc.toString().padStart(2,'0')}`;}
 function initMusicAutofill(){document.querySelectorAll('input[type="file"][data-autofill-target]').forEach((i)=>{const t=document.getElementById(i.dataset.autofillTarget);if(!t)return;i.addEventListener("change",()=>{const f=i.files&&i.files[0];if(!f)return;const n=f.name.replace(/\.[^.]+$/,"")||f.name;if(t&&!t.value.trim())t.value=n;});});}
@@ -0,0 +1,69 @@
+import pytest
+
+from app import create_app, db
+
+
+@pytest.fixture
+def app(tmp_path):
+    uploads = tmp_path / "uploads"
+    app = create_app(
+        {
+            "TESTING": True,
+            "WTF_CSRF_ENABLED": False,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+            "UPLOAD_FOLDER": uploads,
+            "AVATAR_FOLDER": uploads / "avatars",
+            "MUSIC_FOLDER": uploads / "music",
+        }
+    )
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def login(app):
+    """login(user_id) 返回以该用户登录的测试客户端。"""
+
+    def make_client(user_id: int):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+        return client
+
+    return make_client
+
+
+@pytest.fixture
+def make_user(app):
+    """make_user(name) 建一个密码为 secret1 的用户，返回其 ID。"""
+    from app.models import User
+
+    def factory(name: str, *, admin: bool = False) -> int:
+        with app.app_context():
+            user = User(username=name, nickname=name, is_admin=admin)
+            user.set_password("secret1")
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+
+    return factory
+
+
+def _mp3_frame(bitrate_index: int, fill: int) -> bytes:
+    # MPEG-1 Layer III，44.1 kHz，立体声，无填充位
+    header = bytes([0xFF, 0xFB, bitrate_index << 4, 0x00])
+    bitrate = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320][bitrate_index]
+    length = 144 * bitrate * 1000 // 44100
+    return header + bytes([fill]) * (length - 4)
+
+
+@pytest.fixture
+def make_mp3():
+    """make_mp3(frames) 生成只含合法帧头的 MP3 字节；fill 不同则内容（摘要）不同。"""
+
+    def build(frames: int, *, bitrate_index: int = 9, fill: int = 0) -> bytes:
+        return _mp3_frame(bitrate_index, fill) * frames
+
+    return build
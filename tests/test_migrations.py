@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from app import create_app, db, migrations
+from app.models import Music, Room, User
+
+# 引入版本化迁移之前的表结构（只含本项目最早发布时的列）
+BASELINE_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER PRIMARY KEY, username VARCHAR(64) NOT NULL UNIQUE, password_hash VARCHAR(256) NOT NULL,
+    is_admin BOOLEAN, nickname VARCHAR(32), avatar_path VARCHAR(256), notification_message VARCHAR(256),
+    created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE musics (
+    id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id) ON DELETE CASCADE,
+    title VARCHAR(128) NOT NULL, original_filename VARCHAR(255) NOT NULL, stored_filename VARCHAR(255) NOT NULL,
+    status VARCHAR(32), rejection_reason VARCHAR(255), uploaded_at DATETIME, created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE room (
+    id INTEGER PRIMARY KEY, owner_id INTEGER NOT NULL REFERENCES user (id), name VARCHAR(64) NOT NULL,
+    code VARCHAR(6) NOT NULL UNIQUE, is_active BOOLEAN, playback_status VARCHAR(16),
+    current_track_name VARCHAR(255), current_track_file VARCHAR(255), current_position FLOAT,
+    created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE room_playlist (
+    id INTEGER PRIMARY KEY, room_id INTEGER NOT NULL REFERENCES room (id),
+    music_id INTEGER NOT NULL REFERENCES musics (id), created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE room_message (
+    id INTEGER PRIMARY KEY, room_id INTEGER NOT NULL REFERENCES room (id),
+    user_id INTEGER NOT NULL REFERENCES user (id), content TEXT NOT NULL, created_at DATETIME, updated_at DATETIME
+);
+CREATE TABLE room_member (
+    id INTEGER PRIMARY KEY, room_id INTEGER NOT NULL REFERENCES room (id),
+    user_id INTEGER NOT NULL REFERENCES user (id), joined_at DATETIME,
+    CONSTRAINT uniq_room_member UNIQUE (room_id, user_id)
+);
+CREATE TABLE listen_record (
+    id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id),
+    song_name VARCHAR(255) NOT NULL, played_at DATETIME
+);
+CREATE TABLE room_participation_record (
+    id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES user (id),
+    room_code VARCHAR(6) NOT NULL, participated_at DATETIME
+);
+INSERT INTO user (id, username, password_hash, nickname) VALUES (1, 'alice', 'x', 'alice');
+INSERT INTO musics (id, user_id, title, original_filename, stored_filename, status)
+VALUES (1, 1, 'Blue Monday', 'blue.mp3', 'blue.mp3', 'approved'),
+       (2, 1, 'Blue Pending', 'pending.mp3', 'pending.mp3', 'pending');
+INSERT INTO room (id, owner_id, name, code) VALUES (1, 1, 'old room', '123456');
+"""
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    path = tmp_path / "baseline.db"
+    with sqlite3.connect(path) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+    return path
+
+
+def _objects(path, kind: str) -> set[str]:
+    with sqlite3.connect(path) as conn:
+        return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = ?", (kind,))}
+
+
+def _versions(path) -> list[int]:
+    with sqlite3.connect(path) as conn:
+        return [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+
+
+def test_upgrade_from_baseline(baseline):
+    engine = create_engine(f"sqlite:///{baseline}")
+    try:
+        assert migrations.upgrade(engine) == [version for version, _, _ in migrations.MIGRATIONS]
+        assert migrations.upgrade(engine) == []
+    finally:
+        engine.dispose()
+
+    assert _versions(baseline) == [1, 2, 3, 4]
+    indexes = _objects(baseline, "index")
+    for name, _, _ in migrations._HOT_PATH_INDEXES:
+        assert name in indexes
+    assert "ix_room_participation_time" in indexes
+    with sqlite3.connect(baseline) as conn:
+        assert {"state_version", "playlist_version"} <= {row[1] for row in conn.execute("PRAGMA table_info(room)")}
+        assert conn.execute("SELECT state_version FROM room").fetchone() == (0,)
+        if "music_search" in _objects(baseline, "table"):
+            # 只有已审核的曲目进入全文索引
+            assert conn.execute("SELECT rowid FROM music_search").fetchall() == [(1,)]
+
+
+def test_app_starts_on_baseline_database(baseline, tmp_path):
+    app = create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{baseline}",
+            "UPLOAD_FOLDER": tmp_path / "uploads",
+            "AVATAR_FOLDER": tmp_path / "uploads" / "avatars",
+            "MUSIC_FOLDER": tmp_path / "uploads" / "music",
+        }
+    )
+    with app.app_context():
+        room = Room.query.one()
+        room.bump_version()
+        db.session.commit()
+        assert room.state_version == 1
+        assert db.session.get(User, 1).avatar_key is None
+        assert db.session.get(Music, 1).duration is None
+        db.engine.dispose()
+    assert _versions(baseline) == [1, 2, 3, 4]
+
+
+def test_failed_migration_is_rolled_back(baseline, monkeypatch):
+    def broken(cursor):
+        cursor.execute('CREATE INDEX ix_should_not_exist ON "room" (name)')
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(migrations, "MIGRATIONS", [*migrations.MIGRATIONS[:1], (2, "broken", broken)])
+    engine = create_engine(f"sqlite:///{baseline}")
+    try:
+        with pytest.raises(RuntimeError):
+            migrations.upgrade(engine)
+    finally:
+        engine.dispose()
+    assert _versions(baseline) == [1]
+    assert "ix_should_not_exist" not in _objects(baseline, "index")
@@ -0,0 +1,108 @@
+import io
+import struct
+
+import pytest
+
+from app.mp3 import MAX_RESYNC_BYTES, Mp3FormatError, scan_mp3, seek_offset
+
+FRAME_SECONDS = 1152 / 44100
+
+
+def _frame(bitrate_index: int = 9, payload: bytes = b"") -> bytes:
+    # MPEG-1 Layer III，44.1 kHz，立体声；payload 紧跟 32 字节的 side info
+    bitrate = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320][bitrate_index]
+    length = 144 * bitrate * 1000 // 44100
+    body = bytes(32) + payload
+    return bytes([0xFF, 0xFB, bitrate_index << 4, 0x00]) + body + bytes(length - 4 - len(body))
+
+
+def _tag_frame(tag: bytes, frames: int) -> bytes:
+    return _frame(payload=tag + struct.pack(">II", 0x01, frames))
+
+
+def _id3(size: int) -> bytes:
+    syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x03\x00\x00" + syncsafe + bytes(size)
+
+
+def _scan(data: bytes):
+    return scan_mp3(io.BytesIO(data))
+
+
+def test_cbr_stream():
+    info = _scan(_frame() * 100)
+    assert info.frames == 100
+    assert info.bitrate == 128
+    assert info.sample_rate == 44100 and info.channels == 2
+    assert not info.vbr
+    assert info.audio_offset == 0
+    assert info.duration == pytest.approx(100 * FRAME_SECONDS)
+
+
+def test_leading_id3_tag_is_skipped():
+    info = _scan(_id3(300) + _frame() * 20)
+    assert info.audio_offset == 310
+    assert info.frames == 20
+
+
+def test_xing_header_marks_vbr_and_gives_duration():
+    info = _scan(_tag_frame(b"Xing", 500) + _frame() * 100)
+    assert info.vbr
+    assert info.frames == 100
+    assert info.duration == pytest.approx(500 * FRAME_SECONDS)
+
+
+def test_info_header_is_not_vbr():
+    info = _scan(_tag_frame(b"Info", 100) + _frame() * 100)
+    assert not info.vbr
+    assert info.frames == 100
+    assert info.duration == pytest.approx(100 * FRAME_SECONDS)
+
+
+def test_mixed_bitrates_are_vbr():
+    info = _scan((_frame(9) + _frame(10)) * 50)
+    assert info.vbr
+    assert 128 < info.bitrate < 160
+
+
+@pytest.mark.parametrize("gap", [b"\x00" * 100, b"\xff\xfb" + b"\x00" * 50, _id3(2000)])
+def test_resyncs_after_garbage_between_frames(gap):
+    info = _scan(_frame() * 50 + gap + _frame() * 50)
+    assert info.frames == 100
+    assert info.duration == pytest.approx(100 * FRAME_SECONDS)
+
+
+def test_unsyncable_gap_falls_back_to_average_bitrate():
+    gap = bytes(MAX_RESYNC_BYTES + 1000)
+    info = _scan(_frame() * 50 + gap + _frame() * 50)
+    assert info.frames == 50
+    audio_bytes = 100 * len(_frame()) + len(gap)
+    assert info.duration == pytest.approx(audio_bytes * 8 / (info.bitrate * 1000))
+
+
+def test_truncated_last_frame_is_ignored():
+    data = _frame() * 10
+    assert _scan(data + _frame()[:200]).frames == 10
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"", b"plain text, not audio" * 100, _frame() * 2, bytes(MAX_RESYNC_BYTES + 10) + _frame() * 10],
+)
+def test_rejects_non_mp3(data):
+    with pytest.raises(Mp3FormatError):
+        _scan(data)
+
+
+def test_seek_table_points_at_frame_starts():
+    frame = _frame()
+    info = _scan(_id3(90) + frame * 200)
+    blob = info.pack_seek_table()
+    assert len(info.seek_table) == int(200 * FRAME_SECONDS) + 1
+    assert seek_offset(blob, 0) == 100
+    # 2 秒处之后的第一帧（不早于该时刻）
+    first_frame = -(-2 // FRAME_SECONDS)
+    assert seek_offset(blob, 2.5) == 100 + int(first_frame) * len(frame)
+    assert seek_offset(blob, 10_000) == info.seek_table[-1]
+    assert seek_offset(blob, -5) == 100
+    assert seek_offset(None, 1) is None
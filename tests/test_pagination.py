@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import ListenRecord
+from app.pagination import decode_cursor, encode_cursor, paginate
+
+START = datetime(2025, 1, 1, 12, 0)
+
+
+@pytest.fixture
+def records(app, make_user):
+    user_id = make_user("listener")
+    with app.app_context():
+        # 每三条共用一个时间戳，检验以 id 区分并列时间
+        db.session.add_all(
+            ListenRecord(user_id=user_id, song_name=f"s{i}", played_at=START + timedelta(minutes=i // 3))
+            for i in range(25)
+        )
+        db.session.commit()
+    return user_id
+
+
+def _page(cursor=None, *, descending=True, per_page=10):
+    return paginate(
+        ListenRecord.query, ListenRecord.played_at, ListenRecord.id,
+        cursor=cursor, per_page=per_page, descending=descending,
+    )
+
+
+def _ids(page) -> list[int]:
+    return [record.id for record in page.items]
+
+
+@pytest.mark.parametrize("descending", [True, False])
+def test_forward_then_back_covers_every_row_once(app, records, descending):
+    with app.app_context():
+        expected = [
+            record.id
+            for record in ListenRecord.query.order_by(ListenRecord.played_at, ListenRecord.id).all()
+        ]
+        if descending:
+            expected.reverse()
+
+        pages = [_page(descending=descending)]
+        assert not pages[0].has_prev
+        while pages[-1].has_next:
+            pages.append(_page(pages[-1].next_cursor, descending=descending))
+        assert [len(page.items) for page in pages] == [10, 10, 5]
+        assert sum((_ids(page) for page in pages), []) == expected
+
+        back = _page(pages[-1].prev_cursor, descending=descending)
+        assert _ids(back) == _ids(pages[1])
+        first = _page(back.prev_cursor, descending=descending)
+        assert _ids(first) == _ids(pages[0])
+        assert not first.has_prev and first.has_next
+
+
+def test_new_rows_do_not_shift_later_pages(app, records):
+    with app.app_context():
+        first = _page()
+        second_before = _ids(_page(first.next_cursor))
+        db.session.add(ListenRecord(user_id=records, song_name="new", played_at=START + timedelta(hours=1)))
+        db.session.commit()
+        assert _ids(_page(first.next_cursor)) == second_before
+
+
+@pytest.mark.parametrize("cursor", ["", "garbage", encode_cursor(START, 1, "sideways")])
+def test_invalid_cursor_returns_first_page(app, records, cursor):
+    with app.app_context():
+        assert _ids(_page(cursor)) == _ids(_page())
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(START, 42, "before")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (START, 42, "before")
+
+
+def test_empty_query(app):
+    with app.app_context():
+        page = _page()
+    assert page.items == [] and not page.has_next and not page.has_prev
+
+
+def test_url_keeps_other_arguments(app):
+    with app.test_request_context("/records?days=7&listen_cursor=old"):
+        page = _page()
+        assert page.url("listen_cursor", "abc") == "/records?days=7&listen_cursor=abc"
+        assert page.url("listen_cursor", None) == "/records?days=7"
@@ -0,0 +1,72 @@
+import pytest
+
+from app.events import broker
+from app.presence import PresenceRegistry
+
+
+@pytest.fixture
+def registry():
+    registry = PresenceRegistry()
+    registry.ttl = 3.0
+    return registry
+
+
+def _expire(registry, ticks: int) -> None:
+    for _ in range(ticks):
+        registry.expire()
+
+
+def test_touch_counts_members_once(registry):
+    registry.touch("100200", 1, "a", "")
+    version = registry.version("100200")
+    registry.touch("100200", 1, "a", "")
+    registry.touch("100200", 2, "b", "")
+    assert registry.count("100200") == 2
+    assert registry.version("100200") > version
+    assert {member["id"] for member in registry.members("100200")} == {1, 2}
+
+
+def test_heartbeat_keeps_member_online(registry):
+    registry.touch("100200", 1, "a", "")
+    _expire(registry, 2)
+    registry.touch("100200", 1, "a", "")
+    _expire(registry, 2)
+    assert registry.count("100200") == 1
+    _expire(registry, 2)
+    assert registry.count("100200") == 0
+
+
+def test_empty_rooms_do_not_keep_versions(registry):
+    for index in range(50):
+        code = f"{100000 + index}"
+        registry.touch(code, 1, "a", "")
+        registry.leave(code, 1)
+    registry.touch("200000", 2, "b", "")
+    _expire(registry, 5)
+    assert registry._rooms == {}
+    assert registry._versions == {}
+
+
+def test_version_never_repeats_after_room_empties(registry):
+    registry.touch("100200", 1, "a", "")
+    seen = registry.version("100200")
+    registry.leave("100200", 1)
+    assert registry.version("100200") != seen
+    registry.touch("100200", 1, "a", "")
+    assert registry.version("100200") > seen
+
+
+def test_leave_announces_new_count(app, registry):
+    registry.touch("100200", 1, "a", "")
+    registry.touch("100200", 2, "b", "")
+    queue = broker.subscribe("100200")
+    try:
+        registry.leave("100200", 2)
+        registry.leave("100200", 2)
+        event = queue.get_nowait()
+        assert queue.empty()
+    finally:
+        broker.unsubscribe("100200", queue)
+    assert event[0] == "presence"
+    assert event[1]["member_count"] == 1
+    assert event[1]["presence_version"] == registry.version("100200")
@@ -0,0 +1,116 @@
+"""房间状态、房间页、我的房间与管理后台的 SQL 语句数不随成员、曲目、消息数量增长（防止 N+1 回归）。"""
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.cache import room_cache
+from app.models import Music, Room, RoomMember, RoomMessage, RoomPlaylist, User
+
+SMALL, LARGE = 1, 8
+
+
+def _user(name: str, *, admin: bool = False) -> User:
+    user = User(username=name, nickname=name, is_admin=admin)
+    user.set_password("secret1")
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def _music(owner: User, title: str, status: str = "approved") -> Music:
+    music = Music(
+        user_id=owner.id,
+        title=title,
+        original_filename=f"{title}.mp3",
+        stored_filename=f"{title}.mp3",
+        status=status,
+    )
+    db.session.add(music)
+    db.session.flush()
+    return music
+
+
+def _populated_room(prefix: str, size: int) -> tuple[int, str]:
+    """房主 + size 个成员；每个成员一首歌进歌单、一条消息。返回 (房主 ID, 房间号)。"""
+    owner = _user(f"{prefix}-owner")
+    room = Room(owner_id=owner.id, name=prefix, code=f"{size:06d}")
+    db.session.add(room)
+    db.session.flush()
+    for index in range(size):
+        member = _user(f"{prefix}-member{index}")
+        db.session.add(RoomMember(room_id=room.id, user_id=member.id))
+        music = _music(member, f"{prefix}-track{index}")
+        db.session.add(RoomPlaylist(room_id=room.id, music_id=music.id))
+        db.session.add(RoomMessage(room_id=room.id, user_id=member.id, content=f"hello {index}"))
+    db.session.commit()
+    return owner.id, room.code
+
+
+def _statement_count(app, client, url: str) -> int:
+    # 先预热进程级 / 登录用户级的一次性查询；房间状态缓存会让请求不访问数据库，计数前清空，比较的是冷路径
+    client.get(url)
+    room_cache.clear()
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith("PRAGMA"):
+            statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert response.status_code == 200, url
+    return len(statements)
+
+
+@pytest.mark.parametrize("path", ["/rooms/{code}/state", "/rooms/{code}"])
+def test_room_queries_do_not_grow_with_room_size(app, login, path):
+    with app.app_context():
+        rooms = {size: _populated_room(f"room{size}", size) for size in (SMALL, LARGE)}
+
+    counts = {}
+    for size, (owner_id, code) in rooms.items():
+        counts[size] = _statement_count(app, login(owner_id), path.format(code=code))
+    assert counts[SMALL] == counts[LARGE]
+
+
+def test_my_rooms_queries_do_not_grow_with_membership_count(app, login):
+    viewers = {}
+    with app.app_context():
+        for size in (SMALL, LARGE):
+            viewer = _user(f"viewer{size}")
+            for index in range(size):
+                db.session.add(Room(owner_id=viewer.id, name=f"own{index}", code=f"{size}1{index:04d}"))
+                host = _user(f"host{size}-{index}")
+                joined = Room(owner_id=host.id, name=f"joined{index}", code=f"{size}2{index:04d}")
+                db.session.add(joined)
+                db.session.flush()
+                db.session.add(RoomMember(room_id=joined.id, user_id=viewer.id))
+            db.session.commit()
+            viewers[size] = viewer.id
+
+    counts = {size: _statement_count(app, login(user_id), "/my-rooms") for size, user_id in viewers.items()}
+    assert counts[SMALL] == counts[LARGE]
+
+
+def test_admin_dashboard_queries_do_not_grow_with_queue_length(app, login):
+    with app.app_context():
+        admin_id = _user("admin", admin=True).id
+        db.session.commit()
+    client = login(admin_id)
+
+    counts = {}
+    for size in (SMALL, LARGE):
+        with app.app_context():
+            # 每一档补足到 size 首待审核、size 首已驳回，上传者各不相同
+            existing = Music.query.filter_by(status="pending").count()
+            for index in range(existing, size):
+                _music(_user(f"uploader-p{index}"), f"pending{index}", status="pending")
+                _music(_user(f"uploader-r{index}"), f"rejected{index}", status="rejected")
+            db.session.commit()
+        counts[size] = _statement_count(app, client, "/admin/")
+    assert counts[SMALL] == counts[LARGE]
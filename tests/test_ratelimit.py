@@ -0,0 +1,98 @@
+import pytest
+
+from app import ratelimit
+from app.ratelimit import LoginRateLimiter, MemoryLimiterBackend, SQLiteLimiterBackend
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def limiter(request, tmp_path):
+    limiter = LoginRateLimiter()
+    limiter.max_per_user = 2
+    limiter.max_per_ip = 3
+    if request.param == "sqlite":
+        limiter.backend = SQLiteLimiterBackend(tmp_path / "ratelimit.db", window=limiter.window)
+    return limiter
+
+
+def test_user_is_locked_after_max_failures(limiter, clock):
+    limiter.record_failure("alice", "10.0.0.1")
+    assert limiter.allowed("alice", "10.0.0.1")
+    limiter.record_failure("alice", "10.0.0.1")
+    assert not limiter.allowed("alice", "10.0.0.1")
+    assert limiter.allowed("bob", "10.0.0.2")
+
+
+def test_failures_expire_after_the_window(limiter, clock):
+    limiter.record_failure("alice")
+    clock.now += 30
+    limiter.record_failure("alice")
+    assert not limiter.allowed("alice")
+    clock.now += 31
+    assert limiter.allowed("alice")
+
+
+def test_ip_limit_spans_usernames(limiter, clock):
+    for name in ("a", "b", "c"):
+        limiter.record_failure(name, "10.0.0.1")
+    assert not limiter.allowed("d", "10.0.0.1")
+    assert limiter.allowed("d", "10.0.0.2")
+
+
+def test_reset_clears_only_the_username(limiter, clock):
+    for name in ("alice", "alice", "bob"):
+        limiter.record_failure(name, "10.0.0.1")
+    limiter.reset("alice")
+    assert limiter.allowed("alice")
+    assert not limiter.allowed("alice", "10.0.0.1")
+
+
+def test_memory_backend_evicts_least_recent_keys():
+    backend = MemoryLimiterBackend(max_keys=2, max_hits=5)
+    for key in ("a", "b", "a", "c"):
+        backend.hit(key, 0.0)
+    assert len(backend) == 2
+    assert backend.count("b", 60, 1.0) == 0
+    assert backend.count("a", 60, 1.0) == 2
+
+
+def test_memory_backend_keeps_only_max_hits():
+    backend = MemoryLimiterBackend(max_hits=3)
+    for second in range(10):
+        backend.hit("a", float(second))
+    assert backend.count("a", 60, 10.0) == 3
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    first = SQLiteLimiterBackend(tmp_path / "ratelimit.db")
+    second = SQLiteLimiterBackend(tmp_path / "ratelimit.db")
+    first.hit("user:alice", 100.0)
+    assert second.count("user:alice", 60, 110.0) == 1
+
+
+def test_login_route_locks_out_after_failures(app, make_user):
+    make_user("alice")
+    client = app.test_client()
+
+    def attempt(password):
+        return client.post("/login", data={"username": "alice", "password": password})
+
+    attempt("wrong")
+    attempt("wrong")
+    response = attempt("secret1")
+    assert response.status_code == 200
+    assert "操作频繁" in response.get_data(as_text=True)
@@ -0,0 +1,88 @@
+import io
+
+import pytest
+from PIL import Image
+
+from app import db
+from app.avatars import avatar_pipeline
+from app.cache import RoomStateCache, room_cache
+from app.models import Room, RoomMessage, User
+from app.routes import _load_room_snapshot
+
+
+def _create_room(app, owner_id: int, code: str, version: int = 0) -> None:
+    with app.app_context():
+        db.session.add(Room(owner_id=owner_id, name="r", code=code, state_version=version))
+        db.session.commit()
+
+
+def test_snapshot_read_before_a_write_is_rejected(app, make_user):
+    _create_room(app, make_user("host"), "100200", version=3)
+    cache = RoomStateCache()
+    with app.app_context():
+        stale = _load_room_snapshot("100200")
+    cache.update("100200", 4)
+    cache.put("100200", stale)
+    assert cache.get("100200") is None
+
+
+def test_reused_code_is_cached_again_after_delete(app, login, make_user):
+    owner_id = make_user("host")
+    client = login(owner_id)
+    _create_room(app, owner_id, "100200", version=40)
+    room_cache.update("100200", 41)
+    assert client.post("/rooms/100200/delete").status_code == 302
+
+    # 同一房间号分配给新房间，版本号从头开始
+    _create_room(app, owner_id, "100200")
+    assert client.get("/rooms/100200/state").status_code == 200
+    snapshot = room_cache.get("100200")
+    assert snapshot is not None and snapshot.state_version == 0
+
+
+@pytest.fixture
+def chat_room(app, login, make_user):
+    owner_id, guest_id = make_user("host"), make_user("guest")
+    with app.app_context():
+        room = Room(owner_id=owner_id, name="r", code="100200")
+        db.session.add(room)
+        db.session.flush()
+        db.session.add(RoomMessage(room_id=room.id, user_id=guest_id, content="hi"))
+        db.session.commit()
+    return login(owner_id), login(guest_id), guest_id
+
+
+def _last_message(client) -> dict:
+    return client.get("/rooms/100200/state").get_json()["messages"][-1]
+
+
+def test_nickname_change_refreshes_cached_messages(chat_room):
+    owner, guest, _ = chat_room
+    assert _last_message(owner)["author_name"] == "guest"
+    assert guest.post("/profile", data={"nickname": "renamed"}).status_code == 302
+    assert _last_message(owner)["author_name"] == "renamed"
+
+
+def test_processed_avatar_refreshes_cached_messages(app, chat_room):
+    owner, _, guest_id = chat_room
+    folder = app.config["AVATAR_FOLDER"]
+    folder.mkdir(parents=True, exist_ok=True)
+    Image.new("RGB", (200, 200), "red").save(folder / "original.png")
+    with app.app_context():
+        db.session.get(User, guest_id).avatar_path = "original.png"
+        db.session.commit()
+    assert _last_message(owner)["author_avatar"].endswith("/original.png")
+
+    avatar_key = avatar_pipeline.process_now(guest_id, "original.png")
+    assert avatar_key
+    assert avatar_key.split(".")[0] in _last_message(owner)["author_avatar"]
+
+
+def test_snapshot_loaded_before_a_profile_change_is_rejected(app, chat_room):
+    _, _, guest_id = chat_room
+    cache = RoomStateCache()
+    with app.app_context():
+        stale = _load_room_snapshot("100200")
+    cache.invalidate_author(guest_id)
+    cache.put("100200", stale)
+    assert cache.get("100200") is None
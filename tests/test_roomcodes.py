@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import Room, RoomCodeFree, RoomCodeSequence
+from app.roomcodes import CODE_SPACE, RoomCodesExhausted, _key, allocate_room_code, permute, release_room_code
+
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+
+
+def _room(owner_id: int, code: str) -> Room:
+    room = Room(owner_id=owner_id, name=code, code=code)
+    db.session.add(room)
+    db.session.commit()
+    return room
+
+
+def _long_ago() -> datetime:
+    return datetime.utcnow() - timedelta(days=365)
+
+
+def test_permute_is_injective_within_code_space():
+    key = b"k" * 32
+    codes = [permute(index, key) for index in range(20000)]
+    assert len(set(codes)) == len(codes)
+    assert all(0 <= code < CODE_SPACE for code in codes)
+    assert codes != [permute(index, b"other key") for index in range(20000)]
+
+
+def test_sequence_allocates_distinct_six_digit_codes(ctx):
+    codes = [allocate_room_code() for _ in range(50)]
+    db.session.commit()
+    assert len(set(codes)) == 50
+    assert all(len(code) == 6 and code.isdigit() for code in codes)
+    assert db.session.get(RoomCodeSequence, 1).value == 50
+
+
+def test_rolled_back_allocation_reuses_the_sequence_value(ctx):
+    code = allocate_room_code()
+    db.session.rollback()
+    assert allocate_room_code() == code
+
+
+def test_released_code_waits_for_cooldown(ctx, make_user):
+    room = _room(make_user("host"), allocate_room_code())
+    db.session.delete(room)
+    release_room_code(room.code)
+    db.session.commit()
+    assert allocate_room_code() != room.code
+
+    db.session.rollback()
+    RoomCodeFree.query.filter_by(code=room.code).update({"released_at": _long_ago()})
+    db.session.commit()
+    assert allocate_room_code() == room.code
+    assert RoomCodeFree.query.count() == 0
+
+
+def test_sequence_skips_codes_waiting_in_the_free_list(ctx):
+    # 旧版随机号码删除后进入空闲表，序号恰好映射到同一个号码
+    legacy = f"{permute(0, _key()):06d}"
+    db.session.add(RoomCodeFree(code=legacy, released_at=datetime.utcnow()))
+    db.session.commit()
+    assert allocate_room_code() != legacy
+
+
+def test_sequence_skips_codes_held_by_legacy_rooms(ctx, make_user):
+    legacy = f"{permute(0, _key()):06d}"
+    _room(make_user("host"), legacy)
+    assert allocate_room_code() != legacy
+
+
+def test_free_list_skips_codes_that_are_in_use(ctx, make_user):
+    live = _room(make_user("host"), "123456")
+    db.session.add(RoomCodeFree(code=live.code, released_at=_long_ago()))
+    db.session.commit()
+    code = allocate_room_code()
+    assert code != live.code
+    _room(live.owner_id, code)
+
+
+def test_releasing_a_code_already_in_the_free_list(ctx, make_user):
+    db.session.add(RoomCodeFree(code="654321", released_at=_long_ago()))
+    db.session.commit()
+    release_room_code("654321")
+    db.session.commit()
+    entry = RoomCodeFree.query.one()
+    assert entry.released_at > _long_ago() + timedelta(days=300)
+
+
+def test_delete_room_releases_its_code(app, login, make_user):
+    host = make_user("host")
+    client = login(host)
+    client.post("/rooms/create", data={"name": "r"})
+    with app.app_context():
+        code = Room.query.one().code
+    client.post(f"/rooms/{code}/delete")
+    with app.app_context():
+        assert Room.query.count() == 0
+        assert RoomCodeFree.query.one().code == code
+
+
+def test_exhausted_sequence(ctx):
+    db.session.add(RoomCodeSequence(id=1, value=CODE_SPACE))
+    db.session.commit()
+    with pytest.raises(RoomCodesExhausted):
+        allocate_room_code()
@@ -0,0 +1,98 @@
+"""WebSocket 上行帧的解析与校验（直接调用 _handle_socket_frame，不经过真实连接）。"""
+import json
+
+import pytest
+
+from app import db
+from app.models import Music, Room, RoomMessage, RoomPlaylist
+from app.routes import _handle_socket_frame
+
+
+@pytest.fixture
+def room(app, make_user):
+    owner_id = make_user("host")
+    guest_id = make_user("guest")
+    with app.app_context():
+        music = Music(
+            user_id=owner_id,
+            title="song",
+            original_filename="song.mp3",
+            stored_filename="song.mp3",
+            status="approved",
+            duration=180.0,
+        )
+        room = Room(owner_id=owner_id, name="r", code="100200")
+        db.session.add_all([music, room])
+        db.session.flush()
+        db.session.add(RoomPlaylist(room_id=room.id, music_id=music.id))
+        db.session.commit()
+        return {"id": room.id, "owner": owner_id, "guest": guest_id, "music": music.id}
+
+
+@pytest.fixture
+def send(app, room):
+    def send_frame(frame, user_id=None):
+        raw = frame if isinstance(frame, str) else json.dumps(frame)
+        with app.test_request_context():
+            reply = _handle_socket_frame(room["id"], user_id or room["owner"], raw)
+            db.session.remove()
+            return reply
+
+    return send_frame
+
+
+def _room(app, room_id):
+    with app.app_context():
+        return db.session.get(Room, room_id)
+
+
+def test_switch_then_seek(app, room, send):
+    assert send({"t": "ctl", "a": "switch", "m": room["music"]}) is None
+    assert send({"t": "ctl", "a": "seek", "p": 42.5}) is None
+    state = _room(app, room["id"])
+    assert state.playback_status == "playing"
+    assert state.current_position == 42.5
+
+
+@pytest.mark.parametrize("position", ["true", "false", "NaN", "Infinity", "-Infinity", '"12"'])
+def test_seek_ignores_non_numeric_positions(app, room, send, position):
+    send({"t": "ctl", "a": "switch", "m": room["music"]})
+    send({"t": "ctl", "a": "seek", "p": 7})
+    send('{"t": "ctl", "a": "seek", "p": %s}' % position)
+    assert _room(app, room["id"]).current_position == 7
+
+
+def test_switch_rejects_boolean_ids(room, send):
+    assert send({"t": "ctl", "a": "switch", "m": True}) == {"t": "err", "c": "bad_frame"}
+    assert send({"t": "ctl", "a": "switch", "i": False}) == {"t": "err", "c": "bad_frame"}
+
+
+def test_duration_ignores_infinity(app, room, send):
+    with app.app_context():
+        Music.query.update({"duration": None})
+        db.session.commit()
+    send({"t": "ctl", "a": "switch", "m": room["music"]})
+    send('{"t": "ctl", "a": "duration", "d": Infinity}')
+    with app.app_context():
+        assert db.session.get(Music, room["music"]).duration is None
+    send({"t": "ctl", "a": "duration", "d": 200.5})
+    with app.app_context():
+        assert db.session.get(Music, room["music"]).duration == 200.5
+
+
+def test_guest_cannot_control_but_can_chat(app, room, send):
+    assert send({"t": "ctl", "a": "play"}, user_id=room["guest"]) == {"t": "err", "c": "forbidden"}
+    assert send({"t": "msg", "c": " hi "}, user_id=room["guest"]) is None
+    with app.app_context():
+        assert RoomMessage.query.one().content == "hi"
+
+
+def test_ping_echoes_only_numeric_timestamps(send):
+    pong = send({"t": "ping", "c0": 1234.5})
+    assert pong["t"] == "pong" and pong["c0"] == 1234.5 and pong["s"] > 0
+    assert send({"t": "ping", "c0": True})["c0"] is None
+
+
+@pytest.mark.parametrize("raw", ["not json", "[1, 2]", '{"t": "nope"}'])
+def test_malformed_frames(send, raw):
+    assert send(raw) == {"t": "err", "c": "bad_frame"}
@@ -0,0 +1,79 @@
+import io
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.models import Music
+from app.mp3 import Mp3FormatError
+from app.storage import stage_upload
+
+
+def _upload(client, data: bytes, title: str = "song"):
+    return client.post(
+        "/music",
+        data={"title": title, "file": (io.BytesIO(data), "song.mp3", "audio/mpeg")},
+        content_type="multipart/form-data",
+    )
+
+
+def _stored_files(app) -> list[str]:
+    return sorted(path.name for path in app.config["MUSIC_FOLDER"].glob("*.mp3"))
+
+
+@pytest.fixture
+def uploaders(login, make_user):
+    return login(make_user("alice")), login(make_user("bob"))
+
+
+def test_identical_uploads_share_one_file(app, uploaders, make_mp3):
+    data = make_mp3(200)
+    for client in uploaders:
+        assert _upload(client, data).status_code == 302
+    with app.app_context():
+        names = {music.stored_filename for music in Music.query.all()}
+    assert len(names) == 1
+    assert _stored_files(app) == sorted(names)
+    assert (app.config["MUSIC_FOLDER"] / names.pop()).read_bytes() == data
+
+
+def test_file_is_removed_with_its_last_reference(app, uploaders, make_mp3):
+    data = make_mp3(200)
+    for client in uploaders:
+        _upload(client, data)
+    with app.app_context():
+        first, second = Music.query.order_by(Music.id).all()
+        first_id, second_id = first.id, second.id
+
+    alice, bob = uploaders
+    alice.post(f"/music/{first_id}/delete")
+    assert len(_stored_files(app)) == 1
+    bob.post(f"/music/{second_id}/delete")
+    assert _stored_files(app) == []
+
+
+def test_failed_delete_keeps_the_file(app, uploaders, make_mp3):
+    alice, _ = uploaders
+    _upload(alice, make_mp3(200))
+    with app.app_context():
+        music_id = Music.query.one().id
+
+    def fail(session):
+        raise RuntimeError("commit failed")
+
+    event.listen(db.session, "before_commit", fail)
+    try:
+        with pytest.raises(RuntimeError):
+            alice.post(f"/music/{music_id}/delete")
+    finally:
+        event.remove(db.session, "before_commit", fail)
+    with app.app_context():
+        assert db.session.get(Music, music_id) is not None
+    assert len(_stored_files(app)) == 1
+
+
+def test_invalid_upload_leaves_no_temp_file(app):
+    with app.app_context():
+        with pytest.raises(Mp3FormatError):
+            stage_upload(io.BytesIO(b"definitely not audio" * 1000))
+    assert list(app.config["MUSIC_FOLDER"].iterdir()) == []
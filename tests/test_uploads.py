@@ -0,0 +1,108 @@
+import pytest
+
+from app import db
+from app.models import Music, UploadSession
+from app.storage import StagedMusic, chunk_path
+
+
+@pytest.fixture
+def client(login, make_user):
+    return login(make_user("uploader"))
+
+
+def _open(client, data: bytes) -> dict:
+    response = client.post("/music/uploads", json={"filename": "song.mp3", "size": len(data), "title": "song"})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def _put(client, session_id: str, data: bytes, offset: int):
+    return client.put(
+        f"/music/uploads/{session_id}?offset={offset}",
+        data=data,
+        headers={"Content-Type": "application/octet-stream"},
+    )
+
+
+def _chunk_exists(app, session_id: str) -> bool:
+    with app.app_context():
+        return chunk_path(session_id).exists()
+
+
+def _upload(client, data: bytes, chunk: int = 64 * 1024) -> str:
+    session = _open(client, data)
+    for offset in range(0, len(data), chunk):
+        assert _put(client, session["id"], data[offset:offset + chunk], offset).status_code == 200
+    return session["id"]
+
+
+def test_chunked_upload_creates_music(app, client, make_mp3):
+    data = make_mp3(400)
+    session_id = _upload(client, data)
+    response = client.post(f"/music/uploads/{session_id}/finalize")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "pending"
+    with app.app_context():
+        music = Music.query.one()
+        assert music.duration == pytest.approx(400 * 1152 / 44100)
+        assert (app.config["MUSIC_FOLDER"] / music.stored_filename).read_bytes() == data
+        assert UploadSession.query.count() == 0
+    assert not _chunk_exists(app, session_id)
+
+
+def test_out_of_order_chunk_reports_server_offset(client, make_mp3):
+    data = make_mp3(400)
+    session = _open(client, data)
+    assert _put(client, session["id"], data[:70000], 0).status_code == 200
+    response = _put(client, session["id"], data[100000:], 100000)
+    assert response.status_code == 409
+    assert response.get_json()["offset"] == 70000
+    assert client.get(f"/music/uploads/{session['id']}").get_json()["offset"] == 70000
+
+
+def test_finalize_before_last_chunk_is_rejected(client, make_mp3):
+    data = make_mp3(400)
+    session = _open(client, data)
+    _put(client, session["id"], data[:70000], 0)
+    assert client.post(f"/music/uploads/{session['id']}/finalize").status_code == 409
+
+
+def test_non_mp3_first_chunk_is_rejected_early(app, client):
+    data = b"not an mp3 at all" * 5000
+    session = _open(client, data)
+    assert _put(client, session["id"], data[:70000], 0).status_code == 422
+    assert client.get(f"/music/uploads/{session['id']}").status_code == 404
+    assert not _chunk_exists(app, session["id"])
+
+
+def test_failed_commit_drops_the_session_with_its_chunks(app, client, make_mp3, monkeypatch):
+    session_id = _upload(client, make_mp3(400))
+
+    def fail(self):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(StagedMusic, "publish", fail)
+    with pytest.raises(OSError):
+        client.post(f"/music/uploads/{session_id}/finalize")
+    # 会话不能停留在“已传完”却没有分块文件的状态
+    assert client.get(f"/music/uploads/{session_id}").status_code == 404
+    assert not _chunk_exists(app, session_id)
+    with app.app_context():
+        assert Music.query.count() == 0
+
+
+def test_finalize_with_missing_chunk_file_asks_for_a_new_upload(app, client, make_mp3):
+    session_id = _upload(client, make_mp3(400))
+    with app.app_context():
+        chunk_path(session_id).unlink()
+    assert client.post(f"/music/uploads/{session_id}/finalize").status_code == 410
+    assert client.get(f"/music/uploads/{session_id}").status_code == 404
+
+
+def test_cancel_removes_chunks(app, client, make_mp3):
+    data = make_mp3(400)
+    session = _open(client, data)
+    _put(client, session["id"], data[:70000], 0)
+    assert client.delete(f"/music/uploads/{session['id']}").status_code == 200
+    assert not _chunk_exists(app, session["id"])
+    assert client.get(f"/music/uploads/{session['id']}").status_code == 404
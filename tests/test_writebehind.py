@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.models import ListenRecord, Room, RoomParticipationRecord
+from app.writebehind import write_behind
+
+
+@pytest.fixture
+def queue(app):
+    """启用延迟写入，但刷新线程不会自行触发，由用例显式调用 flush()。"""
+    write_behind.interval = 3600
+    write_behind.batch_size = 10 ** 6
+    write_behind.start()
+    yield write_behind
+    write_behind.stop()
+
+
+def _count(app, model) -> int:
+    with app.app_context():
+        return db.session.query(model).count()
+
+
+def test_disabled_queue_commits_with_the_request(app, login, make_user):
+    assert not write_behind.enabled
+    client = login(make_user("host"))
+    assert client.post("/rooms/create", data={"name": "r"}).status_code == 302
+    assert _count(app, Room) == 1
+    assert _count(app, RoomParticipationRecord) == 1
+
+
+def test_records_wait_for_flush(app, queue, make_user):
+    user_id = make_user("listener")
+    for index in range(3):
+        queue.add(ListenRecord, user_id=user_id, song_name=f"song{index}")
+    assert queue.pending() == 3
+    assert _count(app, ListenRecord) == 0
+    assert queue.flush() == 3
+    assert queue.pending() == 0
+    assert _count(app, ListenRecord) == 3
+
+
+def test_default_timestamp_is_taken_when_queued(app, queue, make_user):
+    user_id = make_user("listener")
+    queue.add(ListenRecord, user_id=user_id, song_name="song")
+    queued_at = queue._pending[0][1]["played_at"]
+    queue.flush()
+    with app.app_context():
+        assert ListenRecord.query.one().played_at == queued_at
+
+
+def test_constraint_violation_drops_only_the_bad_row(app, queue, make_user):
+    user_id = make_user("listener")
+    dropped = queue.dropped
+    queue.add(ListenRecord, user_id=user_id, song_name="good")
+    queue.add(ListenRecord, user_id=None, song_name="bad")
+    queue.add(RoomParticipationRecord, user_id=user_id, room_code="000001")
+    assert queue.flush() == 2
+    assert queue.dropped == dropped + 1
+    assert queue.pending() == 0
+    assert not queue.backing_off()
+    assert _count(app, ListenRecord) == 1
+    assert _count(app, RoomParticipationRecord) == 1
+
+
+def test_transient_failure_backs_off_then_gives_up(app, queue, make_user, monkeypatch):
+    user_id = make_user("listener")
+    dropped = queue.dropped
+    queue.add(ListenRecord, user_id=user_id, song_name="song")
+
+    def locked(batch):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(queue, "_insert", locked)
+    delays = []
+    for _ in range(queue.max_retries):
+        assert queue.flush() == 0
+        assert queue.backing_off()
+        delays.append(queue._retry_at)
+    # 每次失败后推迟得更久，重试次数耗尽后记录被丢弃
+    assert delays == sorted(delays)
+    assert queue.pending() == 0
+    assert queue.dropped == dropped + 1
+
+    monkeypatch.undo()
+    queue.add(ListenRecord, user_id=user_id, song_name="later")
+    assert queue.flush() == 1
+    assert not queue.backing_off()
+
+
+def test_stop_flushes_remaining_records(app, make_user):
+    user_id = make_user("listener")
+    write_behind.interval = 3600
+    write_behind.start()
+    write_behind.add(ListenRecord, user_id=user_id, song_name="tail")
+    write_behind.stop()
+    assert not write_behind.enabled
+    assert _count(app, ListenRecord) == 1